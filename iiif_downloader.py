@@ -1,19 +1,38 @@
 """Download all images from an IIIF manifest."""
 
 import logging
-from re import match, Match
+from re import match, Match, Pattern, compile as compile_regex
 import argparse
 import json
 import time
 import os
+import asyncio
+import sqlite3
+import zlib
+from codecs import getincrementaldecoder
 from shutil import rmtree
-from urllib.request import urlopen, Request
+from urllib.request import urlopen, Request, getproxies, proxy_bypass
 from urllib.error import URLError
-from urllib.parse import urlsplit
-from http.client import HTTPResponse
-from typing import List, Dict, Any
-from ssl import create_default_context, CERT_NONE
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin, urldefrag
+from http.client import HTTPResponse, HTTPConnection, HTTPSConnection
+from http.client import HTTPException, InvalidURL
+from typing import List, Dict, Tuple, Callable, Iterator, NamedTuple, Any
+from typing import Deque, BinaryIO, TextIO, Iterable, overload
+from ssl import create_default_context, CERT_NONE, SSLCertVerificationError
+from ssl import SSLError, SSLContext
+from email.utils import parsedate_to_datetime, formatdate
+from random import uniform
+from select import select
+from threading import Lock, Condition, Event, Thread, get_ident
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from concurrent.futures import FIRST_COMPLETED
+from collections import OrderedDict, deque
+from queue import Queue, Empty, Full
+from hashlib import sha1, sha256
+from copy import copy
+from itertools import chain, groupby
+from array import array
+from tempfile import mkstemp
 
 issue_str = "\nPLEASE submit a bug report to \
 https://github.com/ClaudioMartino/IIIF-Downloader/issues \
@@ -134,18 +153,30 @@ def debug_check(name: str, to_check: str, expected: str | None = None) -> None:
                 str(expected))
 
 
-def open_json_file(json_file: str, referer: str = "") -> Dict[str, Any]:
-    """Check if json file is local or remote and read it."""
+def open_json_file(json_file: str, referer: str = "",
+                   read_item: "ItemReader | None" = None) -> Dict[str, Any]:
+    """Check if json file is local or remote and read it. The remote files
+    are read from the HTTP cache, if they are fresh, and compressed files are
+    decompressed while they are read. With read_item, the canvases are
+    parsed one at a time while the file is read (see JSONStreamParser)."""
     if is_url(json_file):
-        response = open_url(json_file, referer)
-        if response is not None:
-            d = json.loads(response.read().decode("utf-8"))
+        entry = http_cache.get(json_file)
+        if entry is not None and entry.is_fresh():
+            d = entry.decode(read_item)
         else:
-            raise Exception("Cannot read remote manifest " + json_file)
+            response = open_url(json_file, referer,
+                                extra_headers=get_json_request_headers(entry))
+            if response is None:
+                raise Exception("Cannot read remote manifest " + json_file)
+            d = http_cache.update(
+                json_file, entry, response.status,
+                {k.lower(): v for k, v in response.headers.items()},
+                iter(lambda: response.read(256 * 1024), b""), read_item)
     else:
         if os.path.isfile(json_file):
-            with open(json_file, encoding="utf8") as f:
-                d = json.load(f)
+            with open(json_file, "rb") as f:
+                d = JSONBodyDecoder().parse(
+                    iter(lambda: f.read(1024 * 1024), b""), read_item)
         else:
             raise Exception("Cannot open manifest " + json_file)
 
@@ -156,12 +187,16 @@ def open_json_file(json_file: str, referer: str = "") -> Dict[str, Any]:
 
 
 def print_statistics(downloaded_cnt: int, skipped_cnt: int, failed_cnt: int,
-                     total_time: float, total_filesize: int) -> None:
+                     total_time: float, total_filesize: int,
+                     info_hits: int = 0, info_misses: int = 0,
+                     retries: int = 0, concurrency: str = "") -> None:
     """Print useful statistics."""
     logging.info("--- Stats ---")
     logging.info("- Downloaded files: %s", str(downloaded_cnt))
     logging.info("- Skipped downloads: %s", str(skipped_cnt))
     logging.info("- Failed downloads: %s", str(failed_cnt))
+    if retries > 0:
+        logging.info("- Retried requests: %s", str(retries))
     logging.info("- Elapsed time: %s s", str(round(total_time)))
     if downloaded_cnt > 0:
         logging.info(
@@ -171,13 +206,286 @@ def print_statistics(downloaded_cnt: int, skipped_cnt: int, failed_cnt: int,
         logging.info(
             "- Avg file size: %s kB",
             str(round(total_filesize / (downloaded_cnt * 1000))))
+    if concurrency:
+        logging.info("- Concurrent downloads: %s", concurrency)
+    if info_hits + info_misses > 0:
+        logging.info(
+            "- Image Information cache: %s hits, %s misses", str(info_hits),
+            str(info_misses))
     logging.info("-------------")
 
 
-def open_url(url: str, referer: str = "",
-             timeout: int = 30) -> HTTPResponse | None:
-    """Open the given URL and return the response."""
-    # Create URL request
+class PooledHTTPResponse(HTTPResponse):
+    """An HTTP response that gives its connection back to the pool once the
+    body has been entirely read or the response has been closed."""
+    release: Callable[[bool], None] | None = None
+
+    def check_release(self, reusable: bool = True) -> None:
+        """Release the connection if the response is over. A connection is
+        not reusable if the body has not been entirely read."""
+        if self.release is not None and self.isclosed():
+            release = self.release
+            self.release = None
+            release(reusable)
+
+    def read(self, amt: int | None = None) -> bytes:
+        data = super().read(amt)
+        self.check_release()
+        return data
+
+    def readinto(self, b: Any) -> int:
+        n = super().readinto(b)
+        self.check_release()
+        return n
+
+    def close(self) -> None:
+        reusable = self.isclosed()
+        super().close()
+        self.check_release(reusable)
+
+
+class ConnectionPool:
+    """A pool of persistent HTTP(S) connections, grouped by host."""
+    def __init__(self, max_per_host: int = 8,
+                 max_idle_time: float = 30) -> None:
+        self.max_per_host: int = max_per_host  # idle connections per host
+        self.max_idle_time: float = max_idle_time  # seconds
+        self.lock: Lock = Lock()
+        # Idle connections and the time they were released, per host
+        self.idle: Dict[Tuple[str, str, bool],
+                        List[Tuple[HTTPConnection, float]]] = {}
+        # Hosts whose SSL certificate cannot be verified
+        self.unverified_hosts: set[str] = set()
+
+    def acquire(self, scheme: str, netloc: str, timeout: float
+                ) -> Tuple[HTTPConnection, bool]:
+        """Return a healthy idle connection to the host, or a new one. The
+        second value tells if the connection has already been used."""
+        verify = netloc not in self.unverified_hosts
+        key = (scheme, netloc, verify)
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                idle_conn, released = idle.pop()
+                if time.monotonic() - released < self.max_idle_time and \
+                        is_connection_alive(idle_conn):
+                    idle_conn.timeout = timeout
+                    if idle_conn.sock is not None:
+                        idle_conn.sock.settimeout(timeout)
+                    return idle_conn, True
+                idle_conn.close()
+
+        conn: HTTPConnection
+        if scheme == "https":
+            ctx = create_default_context()
+            if not verify:
+                ctx.check_hostname = False
+                ctx.verify_mode = CERT_NONE
+            conn = HTTPSConnection(netloc, timeout=timeout, context=ctx)
+        else:
+            conn = HTTPConnection(netloc, timeout=timeout)
+        conn.response_class = PooledHTTPResponse
+        return conn, False
+
+    def release(self, scheme: str, netloc: str, verify: bool,
+                conn: HTTPConnection, reusable: bool = True) -> None:
+        """Put a connection back in the pool, or close it if the pool of the
+        host is full."""
+        if not reusable:
+            conn.close()
+            return
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc, verify), [])
+            if len(idle) < self.max_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, url: str, headers: Dict[str, str],
+                timeout: float) -> PooledHTTPResponse:
+        """Send a GET request on a pooled connection and return the response.
+        Stale connections are replaced by new ones."""
+        split_url = urlsplit(url)
+        scheme, netloc = split_url.scheme, split_url.netloc
+        path = split_url.path or "/"
+        if split_url.query:
+            path += "?" + split_url.query
+
+        while True:
+            conn, reused = self.acquire(scheme, netloc, timeout)
+            verify = netloc not in self.unverified_hosts
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except SSLCertVerificationError as e:
+                conn.close()
+                if not verify:
+                    raise
+                # If the SSL certificate verification fails, try disabling it
+                logging.warning("Exception: %s", str(e))
+                logging.debug("Disabling SSL certificate verification")
+                with self.lock:
+                    self.unverified_hosts.add(netloc)
+                continue
+            except (HTTPException, ConnectionError):
+                conn.close()
+                # The server may have closed an idle connection: open a new
+                # one, but only once
+                if not reused:
+                    raise
+                logging.debug("Stale connection to %s, reconnecting", netloc)
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            assert isinstance(response, PooledHTTPResponse)
+            response.release = \
+                lambda r, c=conn, v=verify: self.release(
+                    scheme, netloc, v, c, r)
+            response.check_release()  # e.g. HEAD-like empty bodies
+            return response
+
+    def clear(self) -> None:
+        """Close all the idle connections."""
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle.clear()
+
+
+def is_connection_alive(conn: HTTPConnection) -> bool:
+    """Check if an idle connection can be used for a new request."""
+    if conn.sock is None:
+        return True  # http.client opens the connection again automatically
+    try:
+        # An idle socket must have nothing to read: if it is readable the
+        # server has closed it (or has sent something unexpected)
+        readable, _, _ = select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+# Persistent connections shared by all the threads
+connection_pool = ConnectionPool()
+
+
+class RetryPolicy:
+    """The policy used to retry the HTTP requests that failed for a transient
+    error: capped exponential backoff with jitter, or the delay requested by
+    the server. The retries are counted."""
+    def __init__(self, max_retries: int = 4, backoff_base: float = 1,
+                 backoff_cap: float = 60, max_retry_after: float = 300
+                 ) -> None:
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base  # seconds
+        self.backoff_cap: float = backoff_cap  # seconds
+        self.max_retry_after: float = max_retry_after  # seconds
+        self.lock: Lock = Lock()
+        self.retries: int = 0
+
+    def get_delay(self, attempt: int, retry_after: str | None) -> float:
+        """Return the delay before the next attempt (the first one is 0)."""
+        if retry_after:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return min(delay, self.max_retry_after)
+        # "Full jitter": a random delay up to the exponential backoff
+        return uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def count_retry(self, attempt: int, retry_after: str | None) -> float:
+        """Count the retry and return the delay before the next attempt."""
+        delay = self.get_delay(attempt, retry_after)
+        logging.debug(
+            "Retrying in %s s (retry n.%s)", str(round(delay, 1)),
+            str(attempt + 1))
+        with self.lock:
+            self.retries += 1
+        return delay
+
+    def wait(self, attempt: int, retry_after: str | None) -> None:
+        """Wait before the next attempt and count the retry."""
+        time.sleep(self.count_retry(attempt, retry_after))
+
+
+# Retries of the HTTP requests, shared by all the threads
+retry_policy = RetryPolicy()
+
+
+class RateLimiter:
+    """Token buckets limiting the rate of the HTTP requests sent to each host,
+    shared by all the threads."""
+    def __init__(self, rate: float = 0, burst: int = 1) -> None:
+        self.rate: float = rate  # requests per second (0: no limit)
+        self.burst: int = burst  # requests sent at once after an idle time
+        # Rate and burst of specific hosts, instead of the default ones
+        self.host_limits: Dict[str, Tuple[float, int]] = {}
+        self.lock: Lock = Lock()
+        # Available tokens and time of the last update, per host
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    def set_host_limit(self, host: str, rate: float, burst: int) -> None:
+        """Set the rate and the burst of a specific host."""
+        with self.lock:
+            self.host_limits[host] = (rate, burst)
+            self.buckets.pop(host, None)
+
+    def reserve(self, host: str) -> float:
+        """Take a token if a request can be sent to the host and return 0,
+        otherwise return the time to wait before trying again."""
+        with self.lock:
+            rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+            if rate <= 0:
+                return 0
+            now = time.monotonic()
+            tokens, last = self.buckets.get(host, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self.buckets[host] = (tokens - 1, now)
+                return 0
+            self.buckets[host] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def acquire(self, host: str) -> None:
+        """Wait until a request can be sent to the host."""
+        while (delay := self.reserve(host)) > 0:
+            time.sleep(delay)
+
+
+# Request rate limits, shared by all the threads
+rate_limiter = RateLimiter()
+
+# Status codes of the HTTP errors that may be transient
+retryable_status_codes = (408, 425, 429, 500, 502, 503, 504)
+
+
+def is_retryable_exception(e: Exception) -> bool:
+    """Check if an exception raised by a request may be transient (timeouts,
+    connections closed or reset by the server)."""
+    if isinstance(e, (InvalidURL, SSLError)):
+        return False
+    return isinstance(e, (
+        TimeoutError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+        ConnectionError, HTTPException))
+
+
+def parse_retry_after(retry_after: str) -> float | None:
+    """Return the delay in seconds given the value of the Retry-After header
+    (seconds or HTTP date)."""
+    if retry_after.strip().isdigit():
+        return float(retry_after)
+    try:
+        date = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+def get_request_headers(url: str, referer: str = "") -> Dict[str, str]:
+    """Return the headers of the HTTP requests."""
     headers = {}
     headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) \
 AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36 \
@@ -188,7 +496,76 @@ Edg/138.0.0.0"
         headers["Referer"] = default_referer
     else:
         headers["Referer"] = referer
+    return headers
+
+
+def open_url(url: str, referer: str = "", timeout: int = 30,
+             extra_headers: Dict[str, str] | None = None
+             ) -> HTTPResponse | None:
+    """Open the given URL and return the response."""
+    headers = get_request_headers(url, referer)
+    headers.update(extra_headers or {})
+
+    # Proxies are handled by urllib only
+    split_url = urlsplit(url)
+    if split_url.scheme in getproxies() and \
+            not proxy_bypass(split_url.hostname or ""):
+        return open_url_with_urllib(url, headers, timeout)
+
+    # Open the URL, following the redirections and retrying the requests
+    # that failed for a transient error
+    max_redirections = 10
+    redirections = 0
+    attempt = 0
+    while True:
+        rate_limiter.acquire(urlsplit(url).netloc)
+        try:
+            response = connection_pool.request(url, headers, timeout)
+        except Exception as e:
+            logging.warning("Exception: %s", str(e))
+            if not is_retryable_exception(e) or \
+                    attempt >= retry_policy.max_retries:
+                return None
+            retry_policy.wait(attempt, None)
+            attempt += 1
+            continue
+
+        location = response.headers["Location"]
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()  # the body must be read to reuse the connection
+            redirections += 1
+            if redirections > max_redirections:
+                logging.warning(
+                    "Exception: Too many redirections (%s)", url)
+                return None
+            url = urljoin(url, location)
+            continue
+
+        if response.status >= 400:
+            logging.warning(
+                "Exception: HTTP Error %s: %s", str(response.status),
+                response.reason)
+            retry_after = response.headers["Retry-After"]
+            try:
+                response.read()
+            except Exception:
+                response.close()
+            if response.status not in retryable_status_codes or \
+                    attempt >= retry_policy.max_retries:
+                return None
+            retry_policy.wait(attempt, retry_after)
+            attempt += 1
+            continue
+
+        return response
+
+
+def open_url_with_urllib(url: str, headers: Dict[str, str],
+                         timeout: int) -> HTTPResponse | None:
+    """Open the given URL with urllib (one connection per request) and return
+    the response."""
     url_req = Request(url, headers=headers)
+    rate_limiter.acquire(urlsplit(url).netloc)
 
     # Create default SSL context
     ctx = create_default_context()
@@ -221,41 +598,849 @@ Edg/138.0.0.0"
     return None
 
 
-def download_file(uri: str, filepath: str, referer: str) -> int:
-    """Open a connection to a remote file and save it locally."""
+class BufferPool:
+    """A small pool of reusable buffers, one for each file being downloaded.
+    """
+    def __init__(self, buffer_size: int = 256 * 1024,
+                 max_buffers: int = 8) -> None:
+        self.buffer_size: int = buffer_size
+        self.max_buffers: int = max_buffers  # free buffers kept in the pool
+        self.lock: Lock = Lock()
+        self.buffers: List[bytearray] = []
+
+    def acquire(self) -> bytearray:
+        """Return a free buffer, or a new one."""
+        with self.lock:
+            if self.buffers:
+                return self.buffers.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        """Put a buffer back in the pool."""
+        with self.lock:
+            if len(self.buffers) < self.max_buffers:
+                self.buffers.append(buffer)
+
+
+# Download buffers shared by all the threads
+buffer_pool = BufferPool()
+
+
+class JSONBodyDecoder:
+    """A decoder of a json body read in chunks: each chunk is decompressed
+    (gzip or deflate) and decoded to text as soon as it is read, so that the
+    whole body is never kept both compressed and decompressed."""
+    def __init__(self, content_encoding: str = "",
+                 keep_chunks: bool = False) -> None:
+        self.content_encoding: str = content_encoding.strip().lower()
+        self.decompressor: Any = None  # zlib decompress object
+        if self.content_encoding in ("gzip", "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.content_encoding == "deflate":
+            self.decompressor = zlib.decompressobj()
+        elif self.content_encoding not in ("", "identity"):
+            raise Exception(
+                "Unsupported content encoding " + self.content_encoding)
+        self.text_decoder: Any = getincrementaldecoder("utf-8")()
+        self.started: bool = False
+        # Chunks as they were received (to be saved in the HTTP cache)
+        self.chunks: List[bytes] | None = [] if keep_chunks else None
+
+    def decode(self, chunk: bytes) -> str:
+        """Decompress and decode the next chunk of the body."""
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+        if self.decompressor is not None:
+            try:
+                chunk = self.decompressor.decompress(chunk)
+            except zlib.error:
+                # Some servers send deflate data without the zlib header
+                if self.started or self.content_encoding != "deflate":
+                    raise
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunk = self.decompressor.decompress(chunk)
+        self.started = True
+        return str(self.text_decoder.decode(chunk))
+
+    def flush(self) -> str:
+        """Return the text left at the end of the body."""
+        data = b"" if self.decompressor is None \
+            else self.decompressor.flush()
+        return str(self.text_decoder.decode(data, True))
+
+    def iter_text(self, chunks: Iterable[bytes]) -> Iterator[str]:
+        """Yield the text of the body, one chunk at a time."""
+        for chunk in chunks:
+            yield self.decode(chunk)
+        yield self.flush()
+
+    def parse(self, chunks: Iterable[bytes],
+              read_item: "ItemReader | None" = None) -> Any:
+        """Return the json object of the body. With read_item, the canvases
+        are parsed while the body is read (see JSONStreamParser)."""
+        if read_item is None:
+            return json.loads("".join(self.iter_text(chunks)))
+        return JSONStreamParser(self.iter_text(chunks), read_item).parse()
+
+
+# A function returning the value kept in place of an item of a streamed
+# array, given the path of the array, the position and the item
+ItemReader = Callable[[Tuple[Any, ...], int, Any], Any]
+
+# Arrays of the canvases of the manifests (3.0, 2.0/2.1), streamed by the
+# parser
+canvas_paths = (("items",), ("sequences", 0, "canvases"))
+
+whitespace_regex = compile_regex(r"[ \t\n\r]*")
+
+
+class JSONStreamParser:
+    """A parser of a json document read in chunks of text. The items of the
+    streamed arrays are parsed one at a time and replaced by the value
+    returned by read_item (e.g. each canvas by its Page), so that the tree of
+    the whole document is never built. The other values are parsed as
+    usual."""
+    def __init__(self, texts: Iterator[str], read_item: ItemReader,
+                 paths: Tuple[Tuple[Any, ...], ...] = canvas_paths) -> None:
+        self.texts: Iterator[str] = texts
+        self.read_item: ItemReader = read_item
+        self.paths: Tuple[Tuple[Any, ...], ...] = paths
+        # Containers to be parsed step by step to reach the arrays
+        self.prefixes: set[Tuple[Any, ...]] = {
+            path[:n] for path in paths for n in range(len(path) + 1)}
+        self.decoder: json.JSONDecoder = json.JSONDecoder()
+        self.buffer: str = ""
+        self.pos: int = 0  # first character not parsed yet
+        self.eof: bool = False
+
+    def parse(self) -> Any:
+        """Return the json object of the document."""
+        value = self.parse_value(())
+        if self.peek():
+            raise ValueError("Extra data at the end of the json document")
+        return value
+
+    def parse_value(self, path: Tuple[Any, ...]) -> Any:
+        """Parse the value at a path of the document."""
+        char = self.peek()
+        if path in self.prefixes and char == "{":
+            return self.parse_object(path)
+        if path in self.prefixes and char == "[":
+            return self.parse_array(path)
+        return self.decode_value()
+
+    def parse_object(self, path: Tuple[Any, ...]) -> Dict[str, Any]:
+        """Parse an object, one member at a time."""
+        self.pos += 1  # {
+        d: Dict[str, Any] = {}
+        if self.peek() == "}":
+            self.pos += 1
+            return d
+        while True:
+            key = self.decode_value()
+            if not isinstance(key, str) or self.peek() != ":":
+                raise ValueError("Invalid object member in json document")
+            self.pos += 1
+            d[key] = self.parse_value(path + (key,))
+            if self.next_delimiter("}"):
+                return d
+
+    def parse_array(self, path: Tuple[Any, ...]) -> List[Any]:
+        """Parse an array, one item at a time. The items of the streamed
+        arrays are given to read_item."""
+        self.pos += 1  # [
+        items: List[Any] = []
+        if self.peek() == "]":
+            self.pos += 1
+            return items
+        while True:
+            if path in self.paths:
+                items.append(
+                    self.read_item(path, len(items), self.decode_value()))
+            else:
+                items.append(self.parse_value(path + (len(items),)))
+            if self.next_delimiter("]"):
+                return items
+
+    def next_delimiter(self, closing: str) -> bool:
+        """Skip the delimiter after a value. Return True at the end of the
+        container."""
+        char = self.peek()
+        self.pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise ValueError("Expecting ',' delimiter in json document")
+        return False
+
+    def decode_value(self) -> Any:
+        """Parse a whole value, reading more text until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may be incomplete
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the text to parse, not to parse it again too often
+            self.read_more(2 * (len(self.buffer) - self.pos) + 1)
+
+    def peek(self) -> str:
+        """Skip the whitespace and return the next character, or an empty
+        string at the end of the document."""
+        while True:
+            whitespace = whitespace_regex.match(self.buffer, self.pos)
+            if whitespace is not None:
+                self.pos = whitespace.end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ""
+            self.read_more(1)
+
+    def read_more(self, size: int) -> None:
+        """Read the next chunks of text, until at least size characters can
+        be parsed. The text already parsed is dropped."""
+        parts = [self.buffer[self.pos:]]
+        length = len(parts[0])
+        while length < size:
+            text = next(self.texts, None)
+            if text is None:
+                self.eof = True
+                break
+            parts.append(text)
+            length += len(text)
+        self.buffer = "".join(parts)
+        self.pos = 0
+
+
+def get_json_request_headers(entry: "HTTPCacheEntry | None"
+                             ) -> Dict[str, str]:
+    """Return the headers of the request of a json file: the compressed body
+    is accepted, and a cached response is revalidated."""
+    headers = {"Accept-Encoding": "gzip, deflate"}
+    if entry is not None:
+        headers.update(entry.get_request_headers())
+    return headers
+
+
+def get_expiration_time(headers: Dict[str, str]) -> float | None:
+    """Return the time a response stops being fresh, from the Cache-Control
+    and Expires headers (lower-case names), or None if it must not be
+    stored."""
+    directives = {}
+    for directive in headers.get("cache-control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    now = time.time()
+    if "no-cache" in directives:
+        return now  # to be revalidated each time
+
+    age = headers.get("age", "")
+    max_age = directives.get("max-age", "")
+    if max_age.isdigit():
+        return now + int(max_age) - (int(age) if age.isdigit() else 0)
+    try:
+        return parsedate_to_datetime(headers["expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return now
+
+
+class HTTPCacheEntry:
+    """A response saved in the HTTP cache, with its validators and the time
+    it stops being fresh."""
+    def __init__(self, url: str, etag: str, last_modified: str,
+                 expires: float, body: bytes,
+                 content_encoding: str = "") -> None:
+        self.url: str = url
+        self.etag: str = etag
+        self.last_modified: str = last_modified
+        self.expires: float = expires
+        self.body: bytes = body  # as it was received, maybe compressed
+        self.content_encoding: str = content_encoding
+
+    def is_fresh(self) -> bool:
+        """Check if the response can be used without asking the server."""
+        return time.time() < self.expires
+
+    def decode(self, read_item: ItemReader | None = None) -> Any:
+        """Return the json object of the response."""
+        return JSONBodyDecoder(self.content_encoding).parse(
+            [self.body], read_item)
+
+    def get_request_headers(self) -> Dict[str, str]:
+        """Return the headers of the request that revalidates the response.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HTTPCache:
+    """An on-disk cache of the json files (manifests, collections and Image
+    Information), keyed by URL. The stale responses are revalidated with
+    their ETag, and the least recently used ones are deleted when the
+    cache exceeds its maximum size."""
+    def __init__(self, directory: str = "",
+                 max_size: int = 256 * 1024 * 1024) -> None:
+        self.directory: str = directory  # "": no cache
+        self.max_size: int = max_size  # bytes
+        self.lock: Lock = Lock()
+        # Size of each file, the least recently used first (read from the
+        # directory when it is used for the first time)
+        self.files: OrderedDict[str, int] | None = None
+        self.size: int = 0
+
+    def get(self, url: str) -> HTTPCacheEntry | None:
+        """Return the cached response of a URL."""
+        if not self.directory:
+            return None
+        filename = self.get_filename(url)
+        with self.lock:
+            files = self.get_files()
+            if filename not in files:
+                return None
+            files.move_to_end(filename)
+        try:
+            with open(filename, "rb") as f:
+                header = json.loads(f.readline())
+                body = f.read()
+            os.utime(filename)  # the order is kept by the next runs
+        except (OSError, ValueError):
+            return None
+        if header.get("url") != url:
+            return None
+        return HTTPCacheEntry(
+            url, header["etag"], header["last_modified"], header["expires"],
+            body, header.get("content_encoding", ""))
+
+    def update(self, url: str, entry: HTTPCacheEntry | None, status: int,
+               headers: Dict[str, str], chunks: Iterable[bytes],
+               read_item: ItemReader | None = None) -> Any:
+        """Save a response (lower-case header names, body in chunks) and
+        return its json object, or the cached one if it has not been
+        modified."""
+        if status == 304 and entry is not None:
+            logging.debug("%s not modified", url)
+            for _ in chunks:
+                pass  # empty body
+            headers = {"etag": entry.etag,
+                       "last-modified": entry.last_modified, **headers,
+                       "content-encoding": entry.content_encoding}
+            body = entry.body
+            d = entry.decode(read_item)
+        else:
+            decoder = JSONBodyDecoder(
+                headers.get("content-encoding", ""), bool(self.directory))
+            d = decoder.parse(chunks, read_item)
+            body = b"".join(decoder.chunks or [])
+        if self.directory:
+            self.store(url, headers, body)
+        return d
+
+    def store(self, url: str, headers: Dict[str, str], body: bytes) -> None:
+        """Write a response in the cache, if it can be stored."""
+        expires = get_expiration_time(headers)
+        if expires is None:
+            return
+
+        # Write the header (one line) and the body
+        filename = self.get_filename(url)
+        header = {
+            "url": url, "etag": headers.get("etag", ""),
+            "last_modified": headers.get("last-modified", ""),
+            "expires": expires,
+            "content_encoding": headers.get("content-encoding", "")}
+        tmp_filename = filename + "." + str(get_ident()) + ".tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                f.write(body)
+            size = os.path.getsize(tmp_filename)
+            os.replace(tmp_filename, filename)
+        except OSError as e:
+            logging.warning("Exception: %s", str(e))
+            return
+
+        with self.lock:
+            files = self.get_files()
+            self.size += size - files.pop(filename, 0)
+            files[filename] = size
+            self.evict()
+
+    def get_filename(self, url: str) -> str:
+        """Return the name of the file of a URL."""
+        return self.directory + "/" + \
+            sha1(url.encode("utf-8")).hexdigest() + ".cache"
+
+    def get_files(self) -> OrderedDict[str, int]:
+        """Return the files of the cache, the least recently used first (the
+        lock must be held)."""
+        if self.files is None:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            with os.scandir(self.directory) as entries:
+                stats = [
+                    (entry.stat().st_mtime, entry.path, entry.stat().st_size)
+                    for entry in entries if entry.name.endswith(".cache")]
+            self.files = OrderedDict(
+                (path, size) for _, path, size in sorted(stats))
+            self.size = sum(self.files.values())
+        return self.files
+
+    def evict(self) -> None:
+        """Delete the least recently used files while the cache is too large
+        (the lock must be held)."""
+        files = self.get_files()
+        while self.size > self.max_size and len(files) > 1:
+            filename, size = files.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            logging.debug("%s deleted from the HTTP cache", filename)
+
+
+# Cached json files, shared by all the threads
+http_cache = HTTPCache()
+
+
+class FileChecksum:
+    """The SHA-256 checksum of a downloaded file, computed while its chunks
+    are written. The file is read only for the bytes not hashed on the way:
+    the part downloaded by a previous run, or the segments written by other
+    threads."""
+    def __init__(self) -> None:
+        self.hash = sha256()
+        self.size: int = 0  # bytes hashed
+
+    def reset(self) -> None:
+        """Start again from the first byte."""
+        self.hash = sha256()
+        self.size = 0
+
+    def update(self, data: bytes | memoryview) -> None:
+        """Hash the next bytes of the file."""
+        self.hash.update(data)
+        self.size += len(data)
+
+    def update_from_file(self, filepath: str, size: int) -> None:
+        """Hash the bytes of a file not hashed yet, up to the given size."""
+        if self.size > size:
+            self.reset()
+        with open(filepath, "rb") as f:
+            f.seek(self.size)
+            while self.size < size:
+                chunk = f.read(min(1024 * 1024, size - self.size))
+                if not chunk:
+                    raise OSError("Cannot hash " + filepath)
+                self.update(chunk)
+
+    def hexdigest(self) -> str:
+        """Return the checksum."""
+        return self.hash.hexdigest()
+
+
+class PartialDownload:
+    """The partial file of a download (.part) and its validator (.part.json:
+    URI, ETag, Last-Modified and Content-Length), used to resume the download
+    with a range request after an interruption. The checksum of the file, if
+    given, is computed while it is downloaded."""
+    def __init__(self, uri: str, filepath: str,
+                 checksum: FileChecksum | None = None) -> None:
+        self.uri: str = uri
+        self.filepath: str = filepath
+        self.tmp_filepath: str = filepath + ".part"
+        self.validator_filepath: str = filepath + ".part.json"
+        self.validator: Dict[str, str] = {}
+        self.offset: int = 0  # bytes downloaded before
+        self.checksum: FileChecksum | None = checksum
+        if checksum is not None:
+            checksum.reset()
+
+        # Read the validator of a previous download of the same URI
+        if not os.path.isfile(self.validator_filepath) or \
+                not os.path.isfile(self.tmp_filepath):
+            return
+        try:
+            with open(self.validator_filepath, encoding="utf-8") as f:
+                validator = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(validator, dict) and validator.get("uri") == uri:
+            self.validator = validator
+            self.offset = os.path.getsize(self.tmp_filepath)
+
+    def is_complete(self) -> bool:
+        """Check if the partial file has been entirely downloaded before."""
+        return self.offset > 0 and \
+            str(self.offset) == self.validator.get("content_length")
+
+    def get_request_headers(self) -> Dict[str, str]:
+        """Return the headers of the range request, if the download can be
+        resumed. The whole file is sent if it has changed (If-Range)."""
+        if self.offset == 0:
+            return {}
+        logging.debug("Resuming the download from byte %s", str(self.offset))
+        return {
+            "Range": "bytes=" + str(self.offset) + "-",
+            "If-Range": self.validator.get("etag") or
+            self.validator.get("last_modified", "")}
+
+    def start(self, status: int, content_range: str | None,
+              etag: str | None, last_modified: str | None,
+              content_length: str | None) -> None:
+        """Check the response: the body is appended to the partial file (206
+        Partial Content), or a new download starts and its validator is
+        saved."""
+        if self.offset > 0 and status == 206:
+            range_match = match(r"bytes (\d+)-", content_range or "")
+            if range_match is not None and \
+                    int(range_match.group(1)) == self.offset:
+                if self.checksum is not None:
+                    self.checksum.update_from_file(
+                        self.tmp_filepath, self.offset)
+                return
+            self.discard()
+            raise ConnectionError(
+                "Unexpected Content-Range (" + str(content_range) + ")")
+        if self.offset > 0:
+            logging.debug("The download cannot be resumed, restarting it")
+        self.offset = 0
+        if self.checksum is not None:
+            self.checksum.reset()
+
+        # Only strong ETags can be used to resume a download
+        self.validator = {}
+        if etag and not etag.startswith("W/"):
+            self.validator["etag"] = etag
+        if last_modified:
+            self.validator["last_modified"] = last_modified
+        if self.validator:
+            self.validator["uri"] = self.uri
+            self.validator["content_length"] = content_length or ""
+            tmp_filename = self.validator_filepath + ".tmp"
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(self.validator, f)
+            os.replace(tmp_filename, self.validator_filepath)
+        elif os.path.exists(self.validator_filepath):
+            os.remove(self.validator_filepath)
+
+    def open(self) -> BinaryIO:
+        """Open the partial file, to append the body or to write it."""
+        return open(self.tmp_filepath, "ab" if self.offset > 0 else "wb")
+
+    def write(self, file: BinaryIO, data: bytes | memoryview) -> None:
+        """Append a chunk of the body to the partial file and hash it."""
+        file.write(data)
+        if self.checksum is not None:
+            self.checksum.update(data)
+
+    def finish(self, file_size: int, content_length: str | None) -> int:
+        """Check the size of the partial file and rename it. Return the size.
+        """
+        if content_length and file_size != self.offset + int(content_length):
+            raise ConnectionError(
+                "Incomplete download (" + str(file_size) + " of " +
+                str(self.offset + int(content_length)) + " bytes)")
+        if self.checksum is not None and file_size > 0:
+            self.checksum.update_from_file(self.tmp_filepath, file_size)
+        if file_size > 0:
+            os.replace(self.tmp_filepath, self.filepath)
+        else:
+            os.remove(self.tmp_filepath)
+        if os.path.exists(self.validator_filepath):
+            os.remove(self.validator_filepath)
+        return file_size
+
+    def fail(self) -> None:
+        """Keep the partial file only if the download can be resumed."""
+        if not self.validator:
+            self.discard()
+        elif os.path.exists(self.tmp_filepath):
+            self.offset = os.path.getsize(self.tmp_filepath)
+
+    def discard(self) -> None:
+        """Delete the partial file and its validator."""
+        for filename in (self.tmp_filepath, self.validator_filepath):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.offset = 0
+        self.validator = {}
+
+
+class ConditionalRequest:
+    """The validators (ETag and Last-Modified) of a file downloaded before,
+    sent with the request of its URI to download it again only if it has
+    changed. The validators of the response are kept for the next time."""
+    def __init__(self, uri: str = "", etag: str = "",
+                 last_modified: str = "") -> None:
+        self.uri: str = uri  # the URI of the validators
+        self.etag: str = etag
+        self.last_modified: str = last_modified
+        self.not_modified: bool = False  # 304 Not Modified
+        self.response_etag: str = ""
+        self.response_last_modified: str = ""
+
+    def get_request_headers(self, uri: str) -> Dict[str, str]:
+        """Return the headers of the conditional request of a URI."""
+        headers = {}
+        if uri == self.uri and self.etag:
+            headers["If-None-Match"] = self.etag
+        if uri == self.uri and self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, uri: str, status: int, etag: str | None,
+               last_modified: str | None) -> bool:
+        """Keep the validators of a response. Return True if the file has not
+        been modified."""
+        self.not_modified = status == 304 and bool(
+            self.get_request_headers(uri))
+        self.response_etag = etag or (
+            self.etag if self.not_modified else "")
+        self.response_last_modified = last_modified or (
+            self.last_modified if self.not_modified else "")
+        return self.not_modified
+
+
+class SegmentPolicy:
+    """The policy used to split the download of a large file into byte ranges
+    downloaded at the same time, each one with its own connection."""
+    def __init__(self, segments: int = 1,
+                 min_size: int = 4 * 1024 * 1024) -> None:
+        self.segments: int = segments  # 1: the files are not split
+        self.min_size: int = min_size  # bytes of each segment, at least
+
+    def get_ranges(self, size: int) -> List[Tuple[int, int]]:
+        """Return the first and the last byte of each segment of a file."""
+        segments = max(1, min(self.segments, size // self.min_size))
+        bounds = [size * n // segments for n in range(segments + 1)]
+        return [(bounds[n], bounds[n + 1] - 1) for n in range(segments)]
+
+
+# Segmented downloads, shared by all the threads
+segment_policy = SegmentPolicy()
+
+
+def download_file(uri: str, filepath: str, referer: str,
+                  conditional: ConditionalRequest | None = None,
+                  checksum: FileChecksum | None = None) -> int:
+    """Open a connection to a remote file and save it locally. An interrupted
+    download is resumed, and a large file is downloaded in segments, if the
+    server supports range requests. With a conditional request, the local
+    file is kept if the remote one has not been modified. The checksum, if
+    given, is computed while the file is downloaded."""
     uri = sanitize_uri(uri)
     logging.debug("Downloading %s...", uri)
 
-    # Open connection to remote file
-    res = open_url(uri, referer)
-    if res is None:
-        return -1
-    else:
-        logging.debug("HTTP status code: %s", str(res.getcode()))
-
-    # Check the response header (file size, MIME type)
-    if res.headers["Content-Length"]:
-        logging.debug(
-            "Remote file size: %s bytes", res.headers["Content-Length"])
-    content_type_subtype = res.headers["Content-Type"]
-    content_type = content_type_subtype.split('/')[0]
-    if content_type not in ("image", "application"):
-        logging.warning("Invalid content type (%s)", str(content_type))
-        return -1
+    part = PartialDownload(uri, filepath, checksum)
+    if part.is_complete():
+        return part.finish(part.offset, None)
+
+    attempt = 0
+    while True:
+        # Open connection to remote file
+        headers = part.get_request_headers()
+        if conditional is not None:
+            headers.update(conditional.get_request_headers(uri))
+        res = open_url(uri, referer, extra_headers=headers)
+        if res is None:
+            return -1
+        else:
+            logging.debug("HTTP status code: %s", str(res.status))
+        if conditional is not None and conditional.update(
+                uri, res.status, res.headers["ETag"],
+                res.headers["Last-Modified"]):
+            res.read()
+            return os.path.getsize(filepath)
+
+        # Check the response header (file size, MIME type)
+        if res.headers["Content-Length"]:
+            logging.debug(
+                "Remote file size: %s bytes", res.headers["Content-Length"])
+        content_type_subtype = str(res.headers["Content-Type"])
+        content_type = content_type_subtype.split('/')[0]
+        if content_type not in ("image", "application"):
+            logging.warning("Invalid content type (%s)", str(content_type))
+            res.close()
+            return -1
 
-    # Create the file (binary mode) even when it exists
-    with open(filepath, "wb") as file:
         try:
-            file.write(res.read())
-            # Flush the write buffer to ensure that its content is dumped to
-            # the file before calling getsize
-            file.flush()
-            file_size = os.path.getsize(filepath)
-            return file_size
+            part.start(
+                res.status, res.headers["Content-Range"], res.headers["ETag"],
+                res.headers["Last-Modified"], res.headers["Content-Length"])
+            if can_download_segments(res, part):
+                return download_segments(res, part, uri, referer)
+            return save_response(res, part)
         except Exception as e:
             logging.warning("Exception: %s", str(e))
-            os.remove(filepath)
-            return -1
+            res.close()
+            # Retry if the transfer has been interrupted
+            if not is_retryable_exception(e) or \
+                    attempt >= retry_policy.max_retries:
+                return -1
+            retry_policy.wait(attempt, None)
+            attempt += 1
+
+
+def save_response(res: HTTPResponse, part: PartialDownload) -> int:
+    """Save the body of a response in a file and return its size."""
+    # Copy the remote file in chunks into a temporary file, which is renamed
+    # only when the download is complete
+    buffer = buffer_pool.acquire()
+    view = memoryview(buffer)
+    file_size = part.offset
+    try:
+        with part.open() as file:
+            while True:
+                n = res.readinto(view)
+                if n == 0:
+                    break
+                part.write(file, view[:n])
+                file_size += n
+        return part.finish(file_size, res.headers["Content-Length"])
+    except Exception:
+        part.fail()
+        raise
+    finally:
+        view.release()
+        buffer_pool.release(buffer)
+
+
+def can_download_segments(res: HTTPResponse, part: PartialDownload) -> bool:
+    """Check if the body of a response can be downloaded in segments: a whole
+    large file, from a server accepting range requests, with a validator to
+    check that all the segments belong to the same file."""
+    content_length = res.headers["Content-Length"]
+    return segment_policy.segments > 1 and res.status == 200 and \
+        bool(part.validator) and \
+        str(res.headers["Accept-Ranges"]).lower() == "bytes" and \
+        bool(content_length) and \
+        int(content_length) >= 2 * segment_policy.min_size
+
+
+def download_segments(res: HTTPResponse, part: PartialDownload, uri: str,
+                      referer: str) -> int:
+    """Download a file in segments at the same time and write them in place
+    in the preallocated partial file. The first segment is read from the
+    response, the other ones with range requests. The checksum is computed
+    while the first segment is written, then with each next one as soon as
+    it is complete."""
+    size = int(res.headers["Content-Length"])
+    ranges = segment_policy.get_ranges(size)
+    logging.debug("Downloading %s in %s segments", uri, str(len(ranges)))
+    with part.open() as file:
+        file.truncate(size)
+
+    executor = ThreadPoolExecutor(max_workers=len(ranges) - 1)
+    try:
+        futures = [
+            executor.submit(download_segment, uri, referer, part, first, last)
+            for first, last in ranges[1:]]
+        first, last = ranges[0]
+        if write_segment(res, part.tmp_filepath, first, last,
+                         part.checksum) != last - first + 1:
+            raise ConnectionError("Incomplete download (first segment)")
+        res.close()  # the rest of the body is downloaded by the others
+        for future, (first, last) in zip(futures, ranges[1:]):
+            future.result()
+            if part.checksum is not None:
+                part.checksum.update_from_file(part.tmp_filepath, last + 1)
+    except BaseException:
+        # A partial file with holes cannot be resumed
+        executor.shutdown(cancel_futures=True)
+        part.discard()
+        raise
+    executor.shutdown()
+    return part.finish(size, None)
+
+
+def download_segment(uri: str, referer: str, part: PartialDownload,
+                     first: int, last: int) -> None:
+    """Download the bytes [first, last] of a file with range requests and
+    write them in the partial file. An interrupted segment is resumed."""
+    if_range = part.validator.get("etag") or \
+        part.validator.get("last_modified", "")
+    attempt = 0
+    while True:
+        res = open_url(uri, referer, extra_headers={
+            "Range": "bytes=" + str(first) + "-" + str(last),
+            "If-Range": if_range})
+        if res is None:
+            raise ConnectionError(
+                "Cannot download bytes " + str(first) + "-" + str(last))
+        range_match = match(
+            r"bytes (\d+)-", res.headers["Content-Range"] or "")
+        if res.status != 206 or range_match is None or \
+                int(range_match.group(1)) != first:
+            res.close()
+            raise ConnectionError(
+                "Range request not satisfied (bytes " + str(first) + "-" +
+                str(last) + ")")
+
+        first += write_segment(res, part.tmp_filepath, first, last)
+        res.close()
+        if first > last:
+            return
+        if attempt >= retry_policy.max_retries:
+            raise ConnectionError("Incomplete download (segment)")
+        retry_policy.wait(attempt, None)
+        attempt += 1
+
+
+def write_segment(res: HTTPResponse, filepath: str, first: int, last: int,
+                  checksum: FileChecksum | None = None) -> int:
+    """Write the body of a response in the bytes [first, last] of a file and
+    return the number of bytes written, which may be less if the transfer is
+    interrupted. The bytes are added to the checksum too, if given."""
+    buffer = buffer_pool.acquire()
+    view = memoryview(buffer)
+    written = 0
+    try:
+        with open(filepath, "r+b") as file:
+            file.seek(first)
+            while written < last - first + 1:
+                size = min(len(view), last - first + 1 - written)
+                n = res.readinto(view[:size])
+                if n == 0:
+                    break
+                file.write(view[:n])
+                if checksum is not None:
+                    checksum.update(view[:n])
+                written += n
+    except Exception as e:
+        if not is_retryable_exception(e):
+            raise
+        logging.warning("Exception: %s", str(e))
+    finally:
+        view.release()
+        buffer_pool.release(buffer)
+    return written
+
+
+def probe_file(uri: str, referer: str) -> bool:
+    """Check if a remote file can be downloaded, reading only the response
+    header."""
+    uri = sanitize_uri(uri)
+    logging.debug("Probing %s...", uri)
+
+    res = open_url(uri, referer)
+    if res is None:
+        return False
+    content_type = str(res.headers["Content-Type"]).split('/')[0]
+    res.close()  # the body is not read
+    return content_type in ("image", "application")
 
 
 def is_url(url: str) -> bool:
@@ -263,10 +1448,492 @@ def is_url(url: str) -> bool:
     return url[:4] == "http"
 
 
+# Asynchronous download (asyncio)
+
+class AsyncResponse:
+    """An HTTP response read from an asyncio stream. The connection goes back
+    to the pool once the body has been entirely read."""
+    def __init__(self, status: int, reason: str, headers: Dict[str, str],
+                 reader: asyncio.StreamReader, timeout: float,
+                 keep_alive: bool, release: Callable[[bool], None]) -> None:
+        self.status: int = status
+        self.reason: str = reason
+        self.headers: Dict[str, str] = headers  # lower-case names
+        self.reader: asyncio.StreamReader = reader
+        self.timeout: float = timeout
+        self.release: Callable[[bool], None] = release
+        self.complete: bool = False
+
+        # Bytes left in the body (None: until the connection is closed), or
+        # in the current chunk
+        self.chunked: bool = \
+            "chunked" in headers.get("transfer-encoding", "").lower()
+        self.remaining: int | None = None
+        self.chunk_left: int = 0
+        content_length = headers.get("content-length")
+        if status in (204, 304):
+            self.remaining = 0
+        elif content_length and not self.chunked:
+            self.remaining = int(content_length)
+        self.keep_alive: bool = keep_alive and (
+            self.chunked or self.remaining is not None)
+
+    async def read_chunk(self, size: int = 256 * 1024) -> bytes:
+        """Return the next part of the body, or an empty string at its end."""
+        if self.complete:
+            return b""
+        if self.chunked:
+            if self.chunk_left == 0:
+                line = await self.read_line()
+                self.chunk_left = int(line.split(b";")[0], 16)
+                if self.chunk_left == 0:
+                    # Skip the trailer
+                    while await self.read_line():
+                        pass
+                    self.finish()
+                    return b""
+            data = await self.read_data(min(size, self.chunk_left))
+            self.chunk_left -= len(data)
+            if self.chunk_left == 0:
+                await self.read_line()  # end of the chunk
+            return data
+        if self.remaining is None:
+            # The body ends when the server closes the connection
+            data = await asyncio.wait_for(
+                self.reader.read(size), self.timeout)
+            if not data:
+                self.finish()
+            return data
+        if self.remaining == 0:
+            self.finish()
+            return b""
+        data = await self.read_data(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    async def read(self) -> bytes:
+        """Return the whole body."""
+        chunks = []
+        while chunk := await self.read_chunk():
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def read_line(self) -> bytes:
+        """Return one line of the chunked body, without CRLF."""
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line.endswith(b"\n"):
+            raise ConnectionError("Incomplete response")
+        return line.strip()
+
+    async def read_data(self, size: int) -> bytes:
+        """Return at most size bytes of the body."""
+        data = await asyncio.wait_for(self.reader.read(size), self.timeout)
+        if not data:
+            raise ConnectionError("Incomplete response")
+        return data
+
+    def finish(self) -> None:
+        """Give the connection back to the pool at the end of the body."""
+        self.complete = True
+        self.release(self.keep_alive)
+
+    def close(self) -> None:
+        """Close the connection if the body has not been entirely read."""
+        if not self.complete:
+            self.complete = True
+            self.release(False)
+
+
+class AsyncConnectionPool:
+    """Persistent connections opened with asyncio streams, kept for each host
+    and shared by the tasks of one event loop."""
+    def __init__(self, max_idle_time: float = 30) -> None:
+        self.max_idle_time: float = max_idle_time  # seconds
+        # Idle connections and the time they were released, per scheme, host
+        # and SSL verification
+        self.idle: Dict[
+            Tuple[str, str, bool],
+            List[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]
+        ] = {}
+        # Hosts whose SSL certificate cannot be verified
+        self.unverified_hosts: set[str] = set()
+        self.ssl_contexts: Dict[bool, SSLContext] = {}
+        # The connections can be used only in the event loop that opened them
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def get_ssl_context(self, verify: bool) -> SSLContext:
+        """Return the SSL context, with or without certificate verification.
+        """
+        ctx = self.ssl_contexts.get(verify)
+        if ctx is None:
+            ctx = create_default_context()
+            if not verify:
+                ctx.check_hostname = False
+                ctx.verify_mode = CERT_NONE
+            self.ssl_contexts[verify] = ctx
+        return ctx
+
+    async def connect(self, scheme: str, netloc: str, verify: bool,
+                      timeout: float
+                      ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter,
+                                 bool]:
+        """Return an idle connection to the host, or a new one. The last
+        value is True if the connection is reused."""
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.idle.clear()
+            self.loop = loop
+        idle = self.idle.get((scheme, netloc, verify), [])
+        now = time.monotonic()
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used < self.max_idle_time and \
+                    not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        if scheme not in ("http", "https"):
+            raise InvalidURL("Unsupported URL scheme: " + scheme)
+        split_url = urlsplit(scheme + "://" + netloc)
+        port = split_url.port or (443 if scheme == "https" else 80)
+        ctx = self.get_ssl_context(verify) if scheme == "https" else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(split_url.hostname, port, ssl=ctx),
+            timeout)
+        return reader, writer, False
+
+    async def request(self, url: str, headers: Dict[str, str],
+                      timeout: float) -> AsyncResponse:
+        """Send a GET request and return the response, once its header has
+        been read."""
+        split_url = urlsplit(url)
+        scheme, netloc = split_url.scheme, split_url.netloc
+        path = split_url.path or "/"
+        if split_url.query:
+            path += "?" + split_url.query
+        lines = ["GET " + path + " HTTP/1.1", "Host: " + netloc]
+        lines += [name + ": " + value for name, value in headers.items()]
+        if "Accept-Encoding" not in headers:
+            lines.append("Accept-Encoding: identity")
+        lines += ["", ""]
+        request = "\r\n".join(lines).encode("ascii")
+
+        while True:
+            verify = netloc not in self.unverified_hosts
+            try:
+                reader, writer, reused = await self.connect(
+                    scheme, netloc, verify, timeout)
+            except SSLCertVerificationError:
+                # If the SSL certificate verification fails, try disabling it
+                logging.debug("Disabling SSL certificate verification")
+                self.unverified_hosts.add(netloc)
+                continue
+
+            try:
+                writer.write(request)
+                await asyncio.wait_for(writer.drain(), timeout)
+                version, status, reason, response_headers = \
+                    await asyncio.wait_for(read_response_header(reader),
+                                           timeout)
+            except BaseException as e:
+                writer.close()
+                # A reused connection may have been closed by the server
+                if reused and isinstance(e, (
+                        ConnectionError, asyncio.IncompleteReadError)):
+                    continue
+                raise
+
+            def release(reusable: bool,
+                        key: Tuple[str, str, bool] = (scheme, netloc, verify),
+                        reader: asyncio.StreamReader = reader,
+                        writer: asyncio.StreamWriter = writer) -> None:
+                if reusable and not writer.is_closing():
+                    self.idle.setdefault(key, []).append(
+                        (reader, writer, time.monotonic()))
+                else:
+                    writer.close()
+
+            keep_alive = version == "HTTP/1.1" and \
+                response_headers.get("connection", "").lower() != "close"
+            return AsyncResponse(
+                status, reason, response_headers, reader, timeout,
+                keep_alive, release)
+
+    async def close(self) -> None:
+        """Close all the idle connections."""
+        writers = [
+            writer for idle in self.idle.values() for _, writer, _ in idle]
+        self.idle.clear()
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(
+            *(writer.wait_closed() for writer in writers),
+            return_exceptions=True)
+
+
+async def read_response_header(reader: asyncio.StreamReader
+                               ) -> Tuple[str, int, str, Dict[str, str]]:
+    """Read the status line and the header fields of an HTTP response."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server")
+    parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise HTTPException("Invalid status line: " + repr(status_line))
+    reason = parts[2] if len(parts) > 2 else ""
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        if line in (b"\r\n", b"\n"):
+            break
+        if len(headers) >= 100:
+            raise HTTPException("Too many header fields")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], int(parts[1]), reason, headers
+
+
+# Persistent connections of the asyncio tasks
+async_connection_pool = AsyncConnectionPool()
+
+
+async def async_open_url(url: str, referer: str = "", timeout: int = 30,
+                         extra_headers: Dict[str, str] | None = None
+                         ) -> AsyncResponse | None:
+    """Open the given URL with asyncio and return the response."""
+    headers = get_request_headers(url, referer)
+    headers.update(extra_headers or {})
+
+    # Open the URL, following the redirections and retrying the requests
+    # that failed for a transient error
+    max_redirections = 10
+    redirections = 0
+    attempt = 0
+    while True:
+        while (delay := rate_limiter.reserve(urlsplit(url).netloc)) > 0:
+            await asyncio.sleep(delay)
+        try:
+            response = await async_connection_pool.request(
+                url, headers, timeout)
+        except Exception as e:
+            logging.warning("Exception: %s", str(e) or type(e).__name__)
+            if not is_retryable_exception(e) or \
+                    attempt >= retry_policy.max_retries:
+                return None
+            await asyncio.sleep(retry_policy.count_retry(attempt, None))
+            attempt += 1
+            continue
+
+        location = response.headers.get("location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            await response.read()  # to reuse the connection
+            redirections += 1
+            if redirections > max_redirections:
+                logging.warning(
+                    "Exception: Too many redirections (%s)", url)
+                return None
+            url = urljoin(url, location)
+            continue
+
+        if response.status >= 400:
+            logging.warning(
+                "Exception: HTTP Error %s: %s", str(response.status),
+                response.reason)
+            retry_after = response.headers.get("retry-after")
+            try:
+                await response.read()
+            except Exception:
+                response.close()
+            if response.status not in retryable_status_codes or \
+                    attempt >= retry_policy.max_retries:
+                return None
+            await asyncio.sleep(retry_policy.count_retry(attempt, retry_after))
+            attempt += 1
+            continue
+
+        return response
+
+
+async def async_open_json_file(json_file: str, referer: str = "",
+                               read_item: "ItemReader | None" = None
+                               ) -> Dict[str, Any]:
+    """Read a json file, reading the remote ones with asyncio. The body is
+    received (compressed, if possible) before it is parsed."""
+    if not is_url(json_file):
+        return open_json_file(json_file, referer, read_item)
+
+    entry = http_cache.get(json_file)
+    if entry is not None and entry.is_fresh():
+        d = entry.decode(read_item)
+    else:
+        response = await async_open_url(
+            json_file, referer, extra_headers=get_json_request_headers(entry))
+        if response is None:
+            raise Exception("Cannot read remote manifest " + json_file)
+        chunks = []
+        while chunk := await response.read_chunk():
+            chunks.append(chunk)
+        d = http_cache.update(
+            json_file, entry, response.status, response.headers, chunks,
+            read_item)
+    if isinstance(d, Dict):
+        return d
+    else:
+        raise Exception("Cannot decode JSON object from " + json_file)
+
+
+async def async_download_file(
+        uri: str, filepath: str, referer: str,
+        conditional: ConditionalRequest | None = None,
+        checksum: FileChecksum | None = None) -> int:
+    """Open a connection to a remote file with asyncio and save it locally.
+    An interrupted download is resumed, if the server supports range
+    requests. With a conditional request, the local file is kept if the
+    remote one has not been modified. The checksum, if given, is computed
+    while the file is downloaded."""
+    uri = sanitize_uri(uri)
+    logging.debug("Downloading %s...", uri)
+
+    part = PartialDownload(uri, filepath, checksum)
+    if part.is_complete():
+        return part.finish(part.offset, None)
+
+    attempt = 0
+    while True:
+        # Open connection to remote file
+        headers = part.get_request_headers()
+        if conditional is not None:
+            headers.update(conditional.get_request_headers(uri))
+        res = await async_open_url(uri, referer, extra_headers=headers)
+        if res is None:
+            return -1
+        else:
+            logging.debug("HTTP status code: %s", str(res.status))
+        if conditional is not None and conditional.update(
+                uri, res.status, res.headers.get("etag"),
+                res.headers.get("last-modified")):
+            await res.read()
+            return os.path.getsize(filepath)
+
+        # Check the response header (file size, MIME type)
+        if res.headers.get("content-length"):
+            logging.debug(
+                "Remote file size: %s bytes", res.headers["content-length"])
+        content_type = res.headers.get("content-type", "").split('/')[0]
+        if content_type not in ("image", "application"):
+            logging.warning("Invalid content type (%s)", str(content_type))
+            res.close()
+            return -1
+
+        try:
+            part.start(
+                res.status, res.headers.get("content-range"),
+                res.headers.get("etag"), res.headers.get("last-modified"),
+                res.headers.get("content-length"))
+            return await async_save_response(res, part)
+        except Exception as e:
+            logging.warning("Exception: %s", str(e) or type(e).__name__)
+            res.close()
+            # Retry if the transfer has been interrupted
+            if not is_retryable_exception(e) or \
+                    attempt >= retry_policy.max_retries:
+                return -1
+            await asyncio.sleep(retry_policy.count_retry(attempt, None))
+            attempt += 1
+
+
+async def async_save_response(res: AsyncResponse,
+                              part: PartialDownload) -> int:
+    """Save the body of a response in a file and return its size."""
+    # Copy the remote file in chunks into a temporary file, which is renamed
+    # only when the download is complete
+    file_size = part.offset
+    try:
+        with part.open() as file:
+            while chunk := await res.read_chunk():
+                part.write(file, chunk)
+                file_size += len(chunk)
+        return part.finish(file_size, res.headers.get("content-length"))
+    except BaseException:
+        part.fail()
+        raise
+
+
+async def async_probe_file(uri: str, referer: str) -> bool:
+    """Check if a remote file can be downloaded with asyncio, reading only
+    the response header."""
+    uri = sanitize_uri(uri)
+    logging.debug("Probing %s...", uri)
+
+    res = await async_open_url(uri, referer)
+    if res is None:
+        return False
+    content_type = res.headers.get("content-type", "").split('/')[0]
+    res.close()  # the body is not read
+    return content_type in ("image", "application")
+
+
+class SharedSettings:
+    """The settings of the objects shared by all the downloaders of the
+    process: connection pool, retry policy, rate limiter, segment policy and
+    HTTP cache. There is one configuration per process: it is applied by a
+    downloader when no other one is running, and kept until all the
+    downloaders started in the meantime have ended. Their own settings are
+    not applied."""
+    def __init__(self) -> None:
+        self.lock: Lock = Lock()
+        self.running_cnt: int = 0  # downloaders using the settings
+        self.values: Dict[str, Any] = {}
+
+    def acquire(self, values: Dict[str, Any]) -> None:
+        """Apply the settings of a downloader that starts, unless another
+        one is running."""
+        with self.lock:
+            if self.running_cnt == 0:
+                self.values = values
+                self.apply()
+            elif values != self.values:
+                logging.warning(
+                    "Another download is running in this process, its "
+                    "settings are used (%s)", str(self.values))
+            self.running_cnt += 1
+
+    def release(self) -> None:
+        """Tell that a downloader has ended."""
+        with self.lock:
+            self.running_cnt -= 1
+
+    def apply(self) -> None:
+        """Write the settings in the shared objects."""
+        values = self.values
+        connection_pool.max_per_host = values["max_per_host"]
+        retry_policy.max_retries = values["max_retries"]
+        rate_limiter.rate = values["rate"]
+        rate_limiter.burst = values["burst"]
+        segment_policy.segments = values["segments"]
+        if http_cache.directory != values["http_cache_dir"]:
+            http_cache.directory = values["http_cache_dir"]
+            http_cache.files = None
+        http_cache.max_size = values["http_cache_size"]
+
+
+# Settings of the shared objects, one configuration per process
+shared_settings = SharedSettings()
+
+
 # Main classes
 
+# Maximum number of threads when it is set automatically ('-t auto')
+max_auto_threads = 64
+
+
 class Page:
     """A class containing the features of one page."""
+    __slots__ = ("label", "id", "ext", "w", "h", "service_id")
+
     def __init__(self) -> None:
         self.label: str = "NA"
         self.id: List[str] = []
@@ -276,6 +1943,1097 @@ class Page:
         self.service_id: List[str | None] = []
 
 
+class PageTable:
+    """The pages of a document stored in columns: labels, dimensions and the
+    IDs, extensions and service IDs of all the images, one after the other.
+    The columns of strings are arrays of positions in a table of the strings,
+    where the labels and the extensions are stored once: a repeated one takes
+    only 4 bytes per row. The IDs and the service IDs, unique to each image,
+    are added to the table without looking them up, since a lookup table of
+    unique strings would take more memory than it saves. It is used as a
+    list of pages: each item is a new Page with the values of its row (the
+    changes of the Page are not written in the table)."""
+    def __init__(self) -> None:
+        # The strings of the columns (0: None), and the positions of the
+        # labels and the extensions
+        self.strings: List[Any] = [None]
+        self.string_indexes: Dict[Any, int] = {}
+        self.labels: "array[int]" = array("I")
+        self.widths: "array[int]" = array("q")
+        self.heights: "array[int]" = array("q")
+        # Sizes that are not non-negative integers (e.g. None), per column
+        # and position
+        self.other_sizes: Dict[Tuple[str, int], Any] = {}
+        # Images of each page: first position in the image columns
+        self.offsets: "array[int]" = array("q", [0])
+        self.ids: "array[int]" = array("I")
+        self.exts: "array[int]" = array("I")
+        self.service_ids: "array[int]" = array("I")
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __iter__(self) -> Iterator[Page]:
+        for index in range(len(self.labels)):
+            yield self.get_page(index)
+
+    @overload
+    def __getitem__(self, index: int) -> Page: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "PageTable": ...
+
+    def __getitem__(self, index: int | slice) -> "Page | PageTable":
+        if isinstance(index, slice):
+            table = PageTable()
+            table.extend(self[i] for i in range(*index.indices(len(self))))
+            return table
+        if index < 0:
+            index += len(self.labels)
+        if not 0 <= index < len(self.labels):
+            raise IndexError("page index out of range")
+        return self.get_page(index)
+
+    def get_page(self, index: int) -> Page:
+        """Return the page of a row."""
+        first, last = self.offsets[index], self.offsets[index + 1]
+        strings = self.strings
+        page = Page()
+        page.label = strings[self.labels[index]]
+        page.w = self.get_size("w", self.widths, index)
+        page.h = self.get_size("h", self.heights, index)
+        page.id = [strings[i] for i in self.ids[first:last]]
+        page.ext = [strings[i] for i in self.exts[first:last]]
+        page.service_id = [strings[i] for i in self.service_ids[first:last]]
+        return page
+
+    def append(self, page: Page) -> None:
+        """Add a page at the end of the table."""
+        index = len(self.labels)
+        self.labels.append(self.get_string_index(page.label))
+        self.widths.append(self.get_column_size("w", index, page.w))
+        self.heights.append(self.get_column_size("h", index, page.h))
+        for n, image_id in enumerate(page.id):
+            self.ids.append(self.add_string(image_id))
+            self.exts.append(self.get_string_index(
+                page.ext[n] if n < len(page.ext) else ""))
+            self.service_ids.append(self.add_string(
+                page.service_id[n] if n < len(page.service_id) else None))
+        self.offsets.append(len(self.ids))
+
+    def get_string_index(self, value: Any) -> int:
+        """Return the position of a repeated string in the table of the
+        strings, adding it if it is new."""
+        index = self.string_indexes.get(value)
+        if index is None:
+            index = self.add_string(value)
+            self.string_indexes[value] = index
+        return index
+
+    def add_string(self, value: Any) -> int:
+        """Add a string to the table of the strings and return its position.
+        """
+        if value is None:
+            return 0
+        self.strings.append(value)
+        return len(self.strings) - 1
+
+    def extend(self, pages: Iterable[Page]) -> None:
+        """Add some pages at the end of the table."""
+        for page in pages:
+            self.append(page)
+
+    def clear(self) -> None:
+        """Remove all the pages."""
+        for column in (self.labels, self.widths, self.heights, self.ids,
+                       self.exts, self.service_ids):
+            del column[:]
+        del self.offsets[1:]
+        del self.strings[1:]
+        self.string_indexes.clear()
+        self.other_sizes.clear()
+
+    def get_size(self, column: str, sizes: "array[int]",
+                 index: int) -> Any:
+        """Return the width ('w') or the height ('h') of a page."""
+        if sizes[index] < 0:
+            return self.other_sizes.get((column, index))
+        return sizes[index]
+
+    def get_column_size(self, column: str, index: int, value: Any) -> int:
+        """Return the value of the width ('w') or the height ('h') of a page
+        in its column. The other values are saved apart."""
+        if isinstance(value, int) and not isinstance(value, bool) and \
+                value >= 0:
+            return value
+        if value is not None:
+            self.other_sizes[(column, index)] = value
+        return -1
+
+
+class DownloadStats:
+    """The download counters of a document, safely updated by all the
+    threads. The counters of a collection (parent) are updated, too."""
+    def __init__(self, parent: "DownloadStats | None" = None) -> None:
+        self.parent: DownloadStats | None = parent
+        self.lock: Lock = Lock()
+        self.total_filesize: int = 0
+        self.downloaded_cnt: int = 0
+        self.skipped_cnt: int = 0
+        self.failed_cnt: int = 0
+
+    def add_downloaded(self, filesize: int) -> None:
+        """Count one downloaded file."""
+        with self.lock:
+            self.downloaded_cnt += 1
+            self.total_filesize += filesize
+        if self.parent is not None:
+            self.parent.add_downloaded(filesize)
+
+    def add_skipped(self) -> None:
+        """Count one skipped file."""
+        with self.lock:
+            self.skipped_cnt += 1
+        if self.parent is not None:
+            self.parent.add_skipped()
+
+    def add_failed(self) -> None:
+        """Count one failed download."""
+        with self.lock:
+            self.failed_cnt += 1
+        if self.parent is not None:
+            self.parent.add_failed()
+
+
+class Strategy:
+    """A download strategy (see docs/Discovery.md): the URI of an image is
+    built from a base ('service ID', 'image ID base' or 'image ID') and a
+    size ('full', 'max' or 'width'). Without size, the image ID is used as it
+    is."""
+    def __init__(self, code: str, base: str, size: str = "") -> None:
+        self.code: str = code
+        self.base: str = base
+        self.size: str = size
+
+    def get_base(self, image_id: str, service_id: str | None) -> str | None:
+        """Return the base of the URI of an image, or None if the strategy
+        cannot be used with it. The rewrite rules are applied to the image ID
+        only when a formatted URI is built from it."""
+        if not self.size:
+            # Image ID as it is
+            return image_id
+        image_id = rewrite_image_id(image_id)
+        if self.base == "service ID":
+            return service_id
+        if self.base == "image ID base":
+            # Only if the image ID is formatted as the URI pattern, when its
+            # base is different from the service ID
+            regex_match_id = match_uri_pattern(image_id)
+            if regex_match_id is None:
+                return None
+            base = regex_match_id.group("base")
+            return None if base == service_id else base
+        # Image ID as base, when it is different from the service ID
+        return None if image_id == service_id else image_id
+
+    def get_uri(self, base: str, width: Any, extension: str) -> str:
+        """Return the URI of an image given its base, its width and its
+        extension."""
+        if not self.size:
+            return base
+        size = str(width) + "," if self.size == "width" else self.size
+        return get_default_img_uri(base, size, extension)
+
+
+# Download strategies, in order of priority. They are never changed during
+# the download
+strategies: Tuple[Strategy, ...] = (
+    # 1. If the service ID is defined in the manifest, try to download the
+    # formatted URI with service ID as base and size = 'full' (1a),
+    # size = 'max' (1b), or size = '<width>,' (1c).
+    Strategy("1a", "service ID", "full"),
+    Strategy("1b", "service ID", "max"),
+    Strategy("1c", "service ID", "width"),
+    # 2. Try to download the image ID as it is written in the manifest, it
+    # may be a formatted URI or another type of URI.
+    Strategy("2", "image ID"),
+    # 3. If the image ID is a formatted URI, try to download it with size
+    # changed to 'full' (3a), 'max' (3b), or '<width>,' (3c).
+    Strategy("3a", "image ID base", "full"),
+    Strategy("3b", "image ID base", "max"),
+    Strategy("3c", "image ID base", "width"),
+    # 4. Lastly, only if the image ID is not the service ID, try to
+    # download the formatted URI with image ID as base and
+    # size = 'full' (4a), size = 'max' (4b), or size = '<width>,' (4c).
+    Strategy("4a", "image ID", "full"),
+    Strategy("4b", "image ID", "max"),
+    Strategy("4c", "image ID", "width"),
+)
+strategy_codes: Dict[str, Strategy] = {s.code: s for s in strategies}
+
+
+class RewriteRule:
+    """A rewrite of the image IDs written in the manifests, applied before the
+    URIs of the strategies are built. It can be limited to one host."""
+    def __init__(self, pattern: str, replacement: str,
+                 host: str = "") -> None:
+        self.pattern: Pattern[str] = compile_regex(pattern)
+        self.replacement: str = replacement
+        self.host: str = host
+
+    def apply(self, image_id: str) -> str:
+        """Return the rewritten image ID."""
+        if self.host and urlsplit(image_id).netloc != self.host:
+            return image_id
+        return self.pattern.sub(self.replacement, image_id)
+
+
+# Rewrite rules of the image IDs, each one limited to the host where it is
+# needed. The Cantaloupe server of the Blavatnik Archive writes the image IDs
+# as '.../iiif/3/baf__/<id>/...', but the full resolution image is found at
+# '.../iiif/3/baf__<id>/...' (see docs/Discovery.md)
+rewrite_rules: List[RewriteRule] = [
+    RewriteRule(r"/iiif/(\d)/baf__/", r"/iiif/\1/baf__",
+                host="iiiflb.blavatnikarchive.org"),
+]
+
+
+def rewrite_image_id(image_id: str) -> str:
+    """Apply the rewrite rules to an image ID."""
+    for rule in rewrite_rules:
+        image_id = rule.apply(image_id)
+    return image_id
+
+
+class ResolvedStrategy(NamedTuple):
+    """The download strategy found with the first page. It is published once
+    and then only read by the threads."""
+    # Codes of the strategies (see docs/Discovery.md): the successful one
+    # first, followed by the ones with a lower priority, used as fallbacks
+    codes: Tuple[str, ...]
+    # URIs of all the images of the document with the successful strategy,
+    # in the order of the image columns of the PageTable (None if they
+    # depend on the Image Information; an item is None if the strategy
+    # cannot be used with that image)
+    uris: List[str | None] | None = None
+
+
+class ConcurrencyController:
+    """An AIMD (additive increase, multiplicative decrease) controller of the
+    number of pages downloaded at the same time. The limit grows by one after
+    a window of downloads without retries, as long as the latency does not
+    grow, and it is halved when the servers ask to slow down (429 Too Many
+    Requests) or fail (5xx, timeouts)."""
+    def __init__(self, initial: int = 2, minimum: int = 1,
+                 maximum: int = 64) -> None:
+        self.limit: int = initial
+        self.minimum: int = minimum
+        self.maximum: int = maximum
+        self.condition: Condition = Condition()
+        self.in_flight: int = 0
+        # Downloads completed since the last change of the limit
+        self.window_cnt: int = 0
+        # Downloads started before the last decrease, ignored when they end
+        self.ignored_cnt: int = 0
+        self.retries: int = retry_policy.retries
+        self.min_latency: float | None = None
+        self.avg_latency: float | None = None
+        # Statistics
+        self.increases: int = 0
+        self.decreases: int = 0
+        self.peak: int = initial
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Wait until a new download can start, at most for the timeout (in
+        seconds). Return False if the time is over."""
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.in_flight < self.limit, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float) -> None:
+        """Update the limit when a download ends, given its duration."""
+        with self.condition:
+            self.in_flight -= 1
+
+            # Retries mean that the servers are throttling or failing
+            retries = retry_policy.retries
+            congestion = retries > self.retries
+            self.retries = retries
+
+            # Exponential moving average of the latency
+            if self.avg_latency is None or self.min_latency is None:
+                self.avg_latency = self.min_latency = latency
+            else:
+                self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+                self.min_latency = min(self.min_latency, latency)
+
+            if self.ignored_cnt > 0:
+                self.ignored_cnt -= 1
+            elif congestion:
+                self.set_limit(max(self.minimum, self.limit // 2))
+                self.decreases += 1
+                self.ignored_cnt = self.in_flight
+            else:
+                self.window_cnt += 1
+                # Do not grow if the latency has doubled: the knee has been
+                # reached
+                if self.window_cnt >= self.limit and \
+                        self.avg_latency < 2 * self.min_latency and \
+                        self.limit < self.maximum:
+                    self.set_limit(self.limit + 1)
+                    self.increases += 1
+            self.condition.notify_all()
+
+    def set_limit(self, limit: int) -> None:
+        """Change the limit."""
+        logging.debug(
+            "Concurrent downloads: %s -> %s", str(self.limit), str(limit))
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        self.window_cnt = 0
+
+    def report(self) -> str:
+        """Return a summary of the decisions of the controller."""
+        return "final " + str(self.limit) + ", peak " + str(self.peak) + \
+            ", " + str(self.increases) + " increases, " + \
+            str(self.decreases) + " decreases"
+
+
+class StrategyCache:
+    """The download strategies found with each image server, saved in a .json
+    file to be used again in the following runs."""
+    def __init__(self, filename: str, ttl: float = 7 * 24 * 3600) -> None:
+        self.filename: str = filename
+        self.ttl: float = ttl  # seconds
+        self.lock: Lock = Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.isfile(filename):
+            try:
+                with open(filename, encoding="utf-8") as f:
+                    entries = json.load(f)
+                if isinstance(entries, dict):
+                    self.entries = entries
+            except Exception as e:
+                logging.warning("Exception: %s", str(e))
+                logging.debug("Cannot read strategy cache %s", filename)
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        """Return the cache entry of an image server, if it is not expired.
+        An entry without the expected fields is a miss, like a corrupt file.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if not isinstance(entry, dict) or \
+                not isinstance(entry.get("strategy"), str) or \
+                not isinstance(entry.get("time"), (int, float)) or \
+                time.time() - entry["time"] > self.ttl:
+            return None
+        return entry
+
+    def set(self, key: str, strategy: str, latency: float,
+            failed: List[str]) -> None:
+        """Save the successful strategy of an image server, its latency and
+        the strategies that failed."""
+        with self.lock:
+            self.entries[key] = {
+                "strategy": strategy,
+                "latency": round(latency, 3),
+                "failed": failed,
+                "time": time.time()
+            }
+        self.save()
+
+    def invalidate(self, key: str) -> None:
+        """Delete the cache entry of an image server."""
+        with self.lock:
+            self.entries.pop(key, None)
+        self.save()
+
+    def save(self) -> None:
+        """Write the cache file. The file may be shared by several processes
+        (e.g. the shards of a download): each one writes a temporary file of
+        its own, then replaces the cache file with it."""
+        with self.lock:
+            fd, tmp_filename = mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filename)),
+                prefix=os.path.basename(self.filename) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, indent=4)
+                os.replace(tmp_filename, self.filename)
+            except BaseException:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+
+
+# Statistics of each shard, written in the output directory, and their merge
+shard_stats_prefix = ".iiif_shard_"
+merged_shard_stats_filename = ".iiif_shards.json"
+
+
+def get_shard_of(key: str, shards: int) -> int:
+    """Return the shard (from 1 to shards) of a page or a manifest given its
+    key. The hash is the same in every process, on every node."""
+    digest = sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards + 1
+
+
+def merge_shard_stats(directory: str) -> bool:
+    """Merge the statistics written by the shards of the downloads in a
+    directory and check that each download is complete: all the shards have
+    ended without failures, and their pages (or manifests) are disjoint and
+    cover the whole document. The reports of the documents are written in a
+    .json file."""
+    documents: Dict[str, List[Dict[str, Any]]] = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(shard_stats_prefix) and name.endswith(".json"):
+            with open(directory + "/" + name, encoding="utf-8") as f:
+                stats = json.load(f)
+            documents.setdefault(str(stats["document"]), []).append(stats)
+    if not documents:
+        logging.error("\033[91mNo shard statistics in %s\033[0m", directory)
+        return False
+
+    reports = [get_shard_report(document, shard_stats)
+               for document, shard_stats in documents.items()]
+    with open(directory + "/" + merged_shard_stats_filename, "w",
+              encoding="utf-8") as f:
+        json.dump(reports, f, indent=4)
+    return all(report["complete"] for report in reports)
+
+
+def get_shard_report(document: str,
+                     shard_stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Check the statistics of the shards of a document and return the
+    report of its download."""
+    problems: List[str] = []
+    shards = int(shard_stats[0]["shards"])
+    units = shard_stats[0]["units"]
+    found = {int(stats["shard"]) for stats in shard_stats}
+    missing = [i for i in range(1, shards + 1) if i not in found]
+    if missing:
+        problems.append("missing shards " + str(missing))
+    assigned: Dict[Any, int] = {}
+    for stats in shard_stats:
+        if int(stats["shards"]) != shards or stats["units"] != units:
+            problems.append(
+                "shard " + str(stats["shard"]) + " split another document")
+        if stats["failed"] > 0 or stats["stopped"]:
+            problems.append(
+                "shard " + str(stats["shard"]) + " is incomplete (" +
+                str(stats["failed"]) + " failed)")
+        for unit in stats["assigned"]:
+            if unit in assigned:
+                problems.append(
+                    str(unit) + " assigned to shards " +
+                    str(assigned[unit]) + " and " + str(stats["shard"]))
+            assigned[unit] = int(stats["shard"])
+    unassigned = [unit for unit in units if unit not in assigned]
+    if unassigned and not missing:
+        problems.append(str(len(unassigned)) + " not assigned")
+
+    report = {
+        "document": document, "shards": shards, "units": len(units),
+        "downloaded": sum(stats["downloaded"] for stats in shard_stats),
+        "skipped": sum(stats["skipped"] for stats in shard_stats),
+        "failed": sum(stats["failed"] for stats in shard_stats),
+        "complete": not problems, "problems": problems}
+    logging.info(
+        "%s: %s shards of %s, %s downloaded, %s skipped, %s failed",
+        document, str(len(shard_stats)), str(shards),
+        str(report["downloaded"]), str(report["skipped"]),
+        str(report["failed"]))
+    for problem in problems:
+        logging.error("\033[91m%s\033[0m", problem.capitalize())
+    return report
+
+
+def get_strategy_cache_key(page: Page, n: int) -> str:
+    """Return the key of the strategy cache for the n-th image of a page: the
+    host of the image server and the shape of the URIs (service ID or image
+    ID as base)."""
+    service_id = page.service_id[n]
+    if service_id is not None:
+        return urlsplit(service_id).netloc + " service"
+    return urlsplit(page.id[n]).netloc + " image"
+
+
+class ImageInformationCache:
+    """A bounded LRU cache of the Image Information documents, shared by all
+    the threads. Concurrent requests of the same document share one fetch.
+    The documents can be saved in a directory, too."""
+    def __init__(self, max_size: int = 1024, directory: str = "") -> None:
+        self.max_size: int = max_size
+        self.directory: str = directory
+        self.lock: Lock = Lock()
+        self.entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self.pending: Dict[str, Future[Dict[str, Any]]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, path: str, referer: str = "") -> Dict[str, Any]:
+        """Return the Image Information document of a path (service ID or
+        base of the image ID)."""
+        d, future, owner = self.reserve(path)
+        if d is not None:
+            return d
+        if not owner:
+            # Another thread is already reading it
+            return future.result()
+
+        try:
+            d = self.read(path, referer)
+        except Exception as e:
+            self.fail(path, future, e)
+            raise
+        self.store(path, future, d)
+        return d
+
+    async def async_get(self, path: str,
+                        referer: str = "") -> Dict[str, Any]:
+        """Return the Image Information document of a path, reading it with
+        asyncio."""
+        d, future, owner = self.reserve(path)
+        if d is not None:
+            return d
+        if not owner:
+            # Another task (or thread) is already reading it
+            return await asyncio.wrap_future(future)
+
+        try:
+            d = await self.async_read(path, referer)
+        except Exception as e:
+            self.fail(path, future, e)
+            raise
+        self.store(path, future, d)
+        return d
+
+    def reserve(self, path: str) -> Tuple[Dict[str, Any] | None,
+                                          Future[Dict[str, Any]], bool]:
+        """Return the cached document of a path, if any, or the future of its
+        fetch. The last value is True if the caller must fetch it."""
+        with self.lock:
+            d = self.entries.get(path)
+            if d is not None:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return d, Future(), False
+            future = self.pending.get(path)
+            if future is None:
+                future = Future()
+                self.pending[path] = future
+                self.misses += 1
+                return None, future, True
+            self.hits += 1
+            return None, future, False
+
+    def store(self, path: str, future: Future[Dict[str, Any]],
+              d: Dict[str, Any]) -> None:
+        """Save a fetched document and give it to the waiting readers."""
+        with self.lock:
+            self.entries[path] = d
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            del self.pending[path]
+        future.set_result(d)
+
+    def fail(self, path: str, future: Future[Dict[str, Any]],
+             e: Exception) -> None:
+        """Give the exception of a failed fetch to the waiting readers."""
+        with self.lock:
+            del self.pending[path]
+        future.set_exception(e)
+
+    def read(self, path: str, referer: str) -> Dict[str, Any]:
+        """Read the Image Information document from the directory, or from
+        the remote server."""
+        filename = self.get_filename(path)
+        if filename and os.path.isfile(filename):
+            return open_json_file(filename)
+
+        d = open_json_file(sanitize_uri(path) + "/info.json", referer)
+        self.write(filename, d)
+        return d
+
+    async def async_read(self, path: str, referer: str) -> Dict[str, Any]:
+        """Read the Image Information document from the directory, or from
+        the remote server with asyncio."""
+        filename = self.get_filename(path)
+        if filename and os.path.isfile(filename):
+            return open_json_file(filename)
+
+        d = await async_open_json_file(
+            sanitize_uri(path) + "/info.json", referer)
+        self.write(filename, d)
+        return d
+
+    def get_filename(self, path: str) -> str:
+        """Return the file of a document in the directory, if it is set."""
+        if not self.directory:
+            return ""
+        return self.directory + "/" + \
+            sha1(path.encode("utf-8")).hexdigest() + ".json"
+
+    def write(self, filename: str, d: Dict[str, Any]) -> None:
+        """Save a document in the directory, if it is set."""
+        if filename:
+            tmp_filename = filename + ".tmp" + str(get_ident())
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(d, f)
+            os.replace(tmp_filename, filename)
+
+
+def get_document_id(d: Dict[str, Any]) -> str:
+    """Return the ID of a document or of a reference (2.0/2.1 or 3.0)."""
+    return str(d.get("@id") or d.get("id") or "")
+
+
+def get_document_type(d: Dict[str, Any], default: str = "") -> str:
+    """Return the type of a document or of a reference (2.0/2.1 or 3.0),
+    without prefix and in lower case (e.g. 'manifest', 'collection')."""
+    doc_type = d.get("@type") or d.get("type") or default
+    return str(doc_type).lower().split(":")[-1]
+
+
+def read_collection(d: Dict[str, Any]
+                    ) -> Tuple[List[str], List[Dict[str, Any]],
+                               List[Dict[str, Any]]]:
+    """Return the IDs of the manifests listed in a collection (2.0/2.1 or
+    3.0), the collections it refers to and its pages, in order."""
+    manifests: List[str] = []
+    collections: List[Dict[str, Any]] = []
+    pages: List[Dict[str, Any]] = []
+
+    # 2.0/2.1: 'manifests', 'collections' and 'members' (both types)
+    # 3.0: 'items' (both types)
+    for key, default_type in (("manifests", "manifest"),
+                              ("collections", "collection"),
+                              ("members", ""), ("items", "")):
+        items = d.get(key)
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if isinstance(item, str):
+                item = {"id": item}
+            if not isinstance(item, dict):
+                continue
+            item_type = get_document_type(item, default_type)
+            if item_type == "collection":
+                collections.append(item)
+            elif item_type == "manifest" and get_document_id(item):
+                manifests.append(get_document_id(item))
+
+    # Paged collections: the first page, or the next one
+    for key in ("first", "next"):
+        page = d.get(key)
+        if isinstance(page, str):
+            page = {"id": page}
+        if isinstance(page, dict):
+            pages.append(page)
+
+    return manifests, collections, pages
+
+
+def is_embedded_collection(d: Dict[str, Any]) -> bool:
+    """Check if a collection reference contains the collection itself."""
+    return any(key in d for key in ("manifests", "collections", "members",
+                                    "items"))
+
+
+class CollectionCrawler:
+    """A crawler of nested and paged collections. The referred collections are
+    read by a few threads and the IDs of the manifests are queued as soon as
+    they are found, in order. Each document is read once, which stops the
+    cycles, and the collections nested deeper than the maximum depth are
+    skipped."""
+    def __init__(self, referer: str = "", max_depth: int = 10,
+                 max_workers: int = 4, max_queued: int = 1000) -> None:
+        self.referer: str = referer
+        self.max_depth: int = max_depth
+        self.max_workers: int = max_workers  # collections read at once
+        # Manifest IDs found and not taken yet (None: end of the crawl)
+        self.manifest_ids: Queue[str | None] = Queue(maxsize=max_queued)
+        self.finished: bool = False
+        self.seen: set[str] = set()
+        self.collections_cnt: int = 0
+        self.manifests_cnt: int = 0
+
+    def start(self, d: Dict[str, Any], url: str, stop_event: Event) -> None:
+        """Crawl a collection in a background thread."""
+        thread = Thread(target=self.crawl, args=(d, url, stop_event),
+                        daemon=True)
+        thread.start()
+
+    def get_manifest_id(self, block: bool = False) -> str | None:
+        """Return the next manifest ID, or None if it has not been found
+        yet (or if the crawl is finished)."""
+        if self.finished:
+            return None
+        try:
+            manifest_id = self.manifest_ids.get(block, timeout=0.5)
+        except Empty:
+            return None
+        if manifest_id is None:
+            self.finished = True
+        return manifest_id
+
+    def crawl(self, d: Dict[str, Any], url: str, stop_event: Event) -> None:
+        """Read a collection and the ones it refers to (breadth first) and
+        queue the IDs of their manifests."""
+        self.is_new(url)
+        self.is_new(get_document_id(d))
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        documents: Deque[Tuple[Dict[str, Any], int]] = deque([(d, 0)])
+        frontier: Deque[Tuple[str, int]] = deque()
+        reading: Deque[Tuple[Future[Dict[str, Any]], str, int]] = deque()
+        try:
+            while not stop_event.is_set():
+                # Queue the manifests and follow the references of the
+                # collections that have been read
+                while documents:
+                    document, depth = documents.popleft()
+                    self.add_document(
+                        document, depth, documents, frontier, stop_event)
+
+                # Read the next collections
+                while frontier and len(reading) < self.max_workers:
+                    collection_id, depth = frontier.popleft()
+                    reading.append((executor.submit(
+                        open_json_file, collection_id, self.referer),
+                        collection_id, depth))
+                if not reading:
+                    break
+
+                # The collections are used in the order they were found
+                future, collection_id, depth = reading.popleft()
+                try:
+                    documents.append((future.result(), depth))
+                except Exception as e:
+                    logging.error(
+                        "\033[91mCannot read collection %s (%s)\033[0m",
+                        collection_id, str(e))
+        except Exception as e:
+            logging.error("\033[91mCannot read collection (%s)\033[0m",
+                          str(e))
+        finally:
+            executor.shutdown(cancel_futures=True)
+            logging.info(
+                "%s manifests found in %s collections",
+                str(self.manifests_cnt), str(self.collections_cnt))
+            self.put(None, stop_event)
+
+    def add_document(self, d: Dict[str, Any], depth: int,
+                     documents: Deque[Tuple[Dict[str, Any], int]],
+                     frontier: Deque[Tuple[str, int]],
+                     stop_event: Event) -> None:
+        """Queue the manifests of a collection (or a manifest read as a
+        collection) and add the collections it refers to."""
+        if get_document_type(d) == "manifest":
+            self.add_manifest(get_document_id(d), stop_event)
+            return
+        self.collections_cnt += 1
+
+        manifests, collections, pages = read_collection(d)
+        logging.debug(
+            "Collection %s: %s manifests, %s collections",
+            get_document_id(d), str(len(manifests)), str(len(collections)))
+        for manifest_id in manifests:
+            self.add_manifest(manifest_id, stop_event)
+
+        # The pages are at the same depth of the collection
+        references = [(c, depth + 1) for c in collections] + \
+            [(p, depth) for p in pages]
+        for reference, reference_depth in references:
+            reference_id = get_document_id(reference)
+            if reference_depth > self.max_depth:
+                logging.warning(
+                    "Collection %s skipped (depth > %s)", reference_id,
+                    str(self.max_depth))
+                continue
+            if reference_id and not self.is_new(reference_id):
+                logging.debug("Collection %s already read", reference_id)
+                continue
+            if is_embedded_collection(reference):
+                documents.append((reference, reference_depth))
+            elif reference_id:
+                frontier.append((reference_id, reference_depth))
+
+    def add_manifest(self, manifest_id: str, stop_event: Event) -> None:
+        """Queue a manifest ID, if it has not been found before."""
+        if self.is_new(manifest_id):
+            self.manifests_cnt += 1
+            self.put(manifest_id, stop_event)
+
+    def is_new(self, url: str) -> bool:
+        """Check if a document has not been found before, and remember it."""
+        url = urldefrag(url).url
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        return True
+
+    def put(self, manifest_id: str | None, stop_event: Event) -> None:
+        """Queue a manifest ID, waiting while the queue is full."""
+        while True:
+            try:
+                self.manifest_ids.put(manifest_id, timeout=0.5)
+                return
+            except Full:
+                if stop_event.is_set():
+                    # Nobody takes the IDs anymore
+                    self.finished = True
+                    return
+
+
+def get_file_checksum(filepath: str) -> str:
+    """Return the SHA-256 checksum of a file."""
+    checksum = sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class DownloadJournal:
+    """An append-only journal of the files downloaded in a document directory:
+    page, file name, URI, strategy, size and SHA-256 checksum of each file.
+    Together with the files listed in the directory, it tells which files are
+    complete without checking them one by one. The records are written to
+    disk in batches."""
+    filename = ".iiif_journal.jsonl"
+
+    def __init__(self, directory: str, batch_size: int = 32,
+                 name: str = "") -> None:
+        self.filepath: str = directory + "/" + (name or self.filename)
+        self.batch_size: int = batch_size  # records written before fsync
+        self.lock: Lock = Lock()
+        self.records: Dict[str, Dict[str, Any]] = {}  # per file name
+        self.unsynced_cnt: int = 0
+        self.file: TextIO | None = None
+
+        # Directories downloaded without journal: the existing files are
+        # complete, and they are added to the journal when skipped
+        self.legacy: bool = not os.path.isfile(self.filepath)
+        if not self.legacy:
+            self.read()
+
+        # The files of the directory, listed once
+        with os.scandir(directory) as entries:
+            names = {entry.name for entry in entries if entry.is_file()}
+        if self.legacy:
+            self.complete: set[str] = names
+        else:
+            self.complete = {name for name in self.records if name in names}
+
+    def read(self) -> None:
+        """Read the records of the previous runs. A line written only in part
+        (the program was interrupted) is ignored."""
+        with open(self.filepath, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "file" in record:
+                    self.records[str(record["file"])] = record
+
+    def is_complete(self, filename: str, page: int) -> bool:
+        """Check if a file has been completely downloaded before."""
+        if filename not in self.complete:
+            return False
+        if self.legacy and filename not in self.records:
+            self.write({"page": page, "file": filename})
+        return True
+
+    def add(self, page: int, filename: str, uri: str, strategy: str,
+            size: int, checksum: str) -> None:
+        """Record a downloaded file and its SHA-256 checksum."""
+        self.write({
+            "page": page, "file": filename, "uri": uri, "strategy": strategy,
+            "size": size, "sha256": checksum})
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Append a record to the journal."""
+        with self.lock:
+            if self.file is None:
+                # Complete the last line, if it was written only in part
+                needs_newline = False
+                if os.path.isfile(self.filepath) and \
+                        os.path.getsize(self.filepath) > 0:
+                    with open(self.filepath, "rb") as f:
+                        f.seek(-1, os.SEEK_END)
+                        needs_newline = f.read(1) != b"\n"
+                self.file = open(self.filepath, "a", encoding="utf-8",
+                                 buffering=1)
+                if needs_newline:
+                    self.file.write("\n")
+            self.records[record["file"]] = record
+            self.complete.add(record["file"])
+            self.file.write(json.dumps(record) + "\n")
+            self.unsynced_cnt += 1
+            if self.unsynced_cnt >= self.batch_size:
+                self.sync()
+
+    def sync(self) -> None:
+        """Write the last records to disk (the lock must be held)."""
+        if self.file is not None and self.unsynced_cnt > 0:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced_cnt = 0
+
+    def close(self) -> None:
+        """Write the last records to disk and close the journal."""
+        with self.lock:
+            self.sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class SyncCatalog:
+    """A SQLite catalog of the documents and the images downloaded before,
+    with their validators (ETag and Last-Modified), used to download again
+    only what has changed. The changes are written to disk in batches."""
+    def __init__(self, filename: str, batch_size: int = 100) -> None:
+        self.filename: str = filename
+        self.batch_size: int = batch_size  # changes written at once
+        self.lock: Lock = Lock()
+        self.changes_cnt: int = 0
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            filename, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents (uri TEXT PRIMARY KEY, "
+                "etag TEXT, last_modified TEXT, content_encoding TEXT, "
+                "body BLOB, time REAL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS images (manifest TEXT, file TEXT, "
+                "page INTEGER, label TEXT, source TEXT, uri TEXT, "
+                "strategy TEXT, etag TEXT, last_modified TEXT, size INTEGER, "
+                "time REAL, PRIMARY KEY (manifest, file))")
+            self.connection.commit()
+
+    def open_json_file(self, url: str, referer: str = "",
+                       read_item: ItemReader | None = None
+                       ) -> Dict[str, Any]:
+        """Read a remote json file, or its copy in the catalog if it has not
+        been modified."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, last_modified, content_encoding, body "
+                "FROM documents WHERE uri = ?", (url,)).fetchone()
+        conditional = ConditionalRequest(url, *row[:2]) if row is not None \
+            else ConditionalRequest()
+        response = open_url(url, referer, extra_headers={
+            **get_json_request_headers(None),
+            **conditional.get_request_headers(url)})
+        if response is None:
+            raise Exception("Cannot read remote manifest " + url)
+        if conditional.update(url, response.status, response.headers["ETag"],
+                              response.headers["Last-Modified"]):
+            logging.info("%s not modified", url)
+            response.read()
+            d = JSONBodyDecoder(row[2]).parse([row[3]], read_item)
+        else:
+            # The body is saved as it was received (compressed, if possible)
+            content_encoding = response.headers["Content-Encoding"] or ""
+            decoder = JSONBodyDecoder(content_encoding, True)
+            d = decoder.parse(
+                iter(lambda: response.read(256 * 1024), b""), read_item)
+            self.write(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                (url, conditional.response_etag,
+                 conditional.response_last_modified, content_encoding,
+                 b"".join(decoder.chunks or []), time.time()))
+
+        if isinstance(d, Dict):
+            return d
+        else:
+            raise Exception("Cannot decode JSON object from " + url)
+
+    def get_image(self, manifest: str, filename: str
+                  ) -> Dict[str, Any] | None:
+        """Return the record of an image of a manifest."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM images WHERE manifest = ? AND file = ?",
+                (manifest, filename))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip((c[0] for c in cursor.description), row))
+
+    def set_image(self, manifest: str, filename: str, page: int, label: str,
+                  source: str, uri: str, strategy: str,
+                  conditional: ConditionalRequest, size: int) -> None:
+        """Save the record of an image of a manifest."""
+        self.write(
+            "INSERT OR REPLACE INTO images VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (manifest, filename, page, label, source, uri, strategy,
+             conditional.response_etag, conditional.response_last_modified,
+             size, time.time()))
+
+    def write(self, statement: str, values: Tuple[Any, ...]) -> None:
+        """Execute a change, and write the last changes to disk."""
+        with self.lock:
+            self.connection.execute(statement, values)
+            self.changes_cnt += 1
+            if self.changes_cnt >= self.batch_size:
+                self.connection.commit()
+                self.changes_cnt = 0
+
+    def commit(self) -> None:
+        """Write the last changes to disk."""
+        with self.lock:
+            self.connection.commit()
+            self.changes_cnt = 0
+
+    def close(self) -> None:
+        """Write the last changes to disk and close the catalog."""
+        self.commit()
+        self.connection.close()
+
+
+class DocumentDownload:
+    """A document of a collection whose pages are downloaded by the threads
+    shared by all the documents."""
+    def __init__(self, document_downloader: "IIIF_Downloader",
+                 subdir: str) -> None:
+        self.downloader: IIIF_Downloader = document_downloader
+        self.subdir: str = subdir
+        self.next_cnt: int = 0  # next page to be queued
+        self.queued_cnt: int = 0  # pages queued and not completed yet
+        self.start_time: float = 0
+        self.counters: Tuple[int, int, int] = (0, 0, 0)
+
+    def start(self) -> None:
+        """Start the clock and take the shared counters."""
+        self.start_time = time.time()
+        self.counters = self.downloader.get_shared_counters()
+
+    def can_queue(self) -> bool:
+        """Check if another page can be queued. Until the strategy is found
+        the pages are downloaded one at a time."""
+        if self.next_cnt >= len(self.downloader.pages) or \
+                self.downloader.stop_event.is_set():
+            return False
+        return self.downloader.strategy is not None or self.queued_cnt == 0
+
+    def is_complete(self) -> bool:
+        """Check if all the pages have been downloaded, or skipped because
+        the download has been stopped."""
+        return self.queued_cnt == 0 and (
+            self.next_cnt >= len(self.downloader.pages) or
+            self.downloader.stop_event.is_set())
+
+
 class IIIF_Downloader:
     """A class containing the downloader features: the manifest parameters,
     the download strategy flags and the user configuration."""
@@ -283,7 +3041,15 @@ class IIIF_Downloader:
                  first_page: int = 1, last_page: int = -1, force: bool = False,
                  use_labels: bool = False, all_images: bool = False,
                  width: int | None = 0, referer: str = "",
-                 num_threads: int = 1, metadata_json: str = "") -> None:
+                 num_threads: int = 1, metadata_json: str = "",
+                 parallel_discovery: bool = False,
+                 strategy_cache: str = "",
+                 info_cache_dir: str = "", max_retries: int = 4,
+                 rate_limit: float = 0, burst: int = 1,
+                 documents_in_flight: int = 2, max_depth: int = 10,
+                 segments: int = 1, sync_catalog: str = "",
+                 http_cache_dir: str = "", http_cache_size: int = 256,
+                 shard: int = 1, shards: int = 1) -> None:
         # User defined parameters
         self.json_file: str = json_file  # manifest or collection
         self.maindir: str = maindir
@@ -294,53 +3060,299 @@ class IIIF_Downloader:
         self.all_images: bool = all_images
         self.width: int | None = width  # -w unused: 0 (default); no arg.: None
         self.referer: str = referer
-        self.num_threads: int = num_threads
+        self.num_threads: int = num_threads  # 0: set automatically
         self.metadata_json: str = metadata_json
+        self.parallel_discovery: bool = parallel_discovery
+        self.strategy_cache_file: str = strategy_cache
+        self.info_cache_dir: str = info_cache_dir
+        self.max_retries: int = max_retries
+        self.rate_limit: float = rate_limit  # requests/s per host, 0: none
+        self.burst: int = burst
+        # Manifests of a collection read or downloaded at the same time
+        self.documents_in_flight: int = documents_in_flight
+        self.max_depth: int = max_depth  # of the nested collections
+        self.segments: int = segments  # per file, 1: no segments
+        self.sync_catalog_file: str = sync_catalog
+        self.http_cache_dir: str = http_cache_dir
+        self.http_cache_size: int = http_cache_size  # MB
+        self.shard: int = shard  # from 1 to shards
+        self.shards: int = shards  # processes sharing the download, 1: none
 
         # Manifest parameters
         self.version: int = 0
         self.manifest_label: str = ""
         self.manifest_id: str = ""
-        self.pages: list[Page] = []
+        self.pages: PageTable = PageTable()
         self.orig_num_pages: int = 0
+        # Pages of the manifests of the collection started so far
+        self.collection_pages_cnt: int = 0
 
-        # Download counters
-        self.total_filesize: int = 0
-        self.downloaded_cnt: int = 0
-        self.skipped_cnt: int = 0
-        self.failed_cnt: int = 0
+        # Download counters, and the ones of the collection of the document
+        self.stats: DownloadStats = DownloadStats()
+        self.collection_stats: DownloadStats | None = None
+
+        # Download strategy, found while downloading the first page
+        self.strategy: ResolvedStrategy | None = None
+        self.failed_strategies: set[str] = set()
+        self.discovery_lock: Lock = Lock()
+        self.strategy_cache: StrategyCache | None = None
+
+        # Journal of the files downloaded in the document directory
+        self.journal: DownloadJournal | None = None
+
+        # Catalog of the documents and images, read and updated by '--sync'
+        self.catalog: SyncCatalog | None = None
+
+        # Images of the document downloaded with '--from-plan'
+        self.plan_entries: List[Dict[str, Any]] = []
+
+        # The pages of a manifest are split between the shards, or the
+        # manifests of a collection (all the ones found are listed)
+        self.shard_pages: bool = True
+        self.shard_manifests: List[str] = []
 
-        # Download strategy flags, true by default
-        # 1. If the service ID is defined in the manifest, try to download the
-        # formatted URI with service ID as base and size = 'full' (1a),
-        # size = 'max' (1b), or size = '<width>,' (1c).
-        self.uri_base_serv_id_full: bool = True
-        self.uri_base_serv_id_max: bool = True
-        self.uri_base_serv_id_width: bool = True
-        # 2. Try to download the image ID as it is written in the manifest, it
-        # may be a formatted URI or another type of URI.
-        self.uri_img_id: bool = True
-        # 3. If the image ID is a formatted URI, try to download it with size
-        # changed to 'full' (3a), 'max' (3b), or '<width>,' (3c).
-        self.uri_base_b_img_id_full: bool = True
-        self.uri_base_b_img_id_max: bool = True
-        self.uri_base_b_img_id_width: bool = True
-        # 4. Lastly, only if the image ID is not the service ID, try to
-        # download the formatted URI with image ID as base and
-        # size = 'full' (4a), size = 'max' (4b), or size = '<width>,' (4c).
-        self.uri_base_img_id_full: bool = True
-        self.uri_base_img_id_max: bool = True
-        self.uri_base_img_id_width: bool = True
+        # Set to stop the download
+        self.stop_event: Event = Event()
+
+        # Image Information documents, read once
+        self.image_information_cache: ImageInformationCache = \
+            ImageInformationCache()
+
+    @property
+    def total_filesize(self) -> int:
+        return self.stats.total_filesize
+
+    @property
+    def downloaded_cnt(self) -> int:
+        return self.stats.downloaded_cnt
+
+    @property
+    def skipped_cnt(self) -> int:
+        return self.stats.skipped_cnt
+
+    @property
+    def failed_cnt(self) -> int:
+        return self.stats.failed_cnt
 
     def run(self) -> None:
         """Download all the files from a manifest or a collection."""
-        # Open json file
-        d = open_json_file(self.json_file, self.referer)
+        self.prepare_run()
+
+        try:
+            # Open json file
+            d = self.open_json_document(self.json_file)
+
+            # Check IIIF version
+            self.get_iiif_version(d)
+
+            # Check if the input file is a manifest or a collection
+            if self.is_collection(d):
+                self.download_iiif_files_from_collection(d)
+            else:
+                self.download_iiif_files_from_manifest(d)
+            self.write_shard_stats()
+        finally:
+            self.finish_run()
+
+    async def run_async(self) -> None:
+        """Download all the files from a manifest or a collection with
+        asyncio tasks instead of threads."""
+        self.prepare_run()
+        if getproxies():
+            logging.warning(
+                "Proxies are not supported by the asyncio download, the \
+connections are direct")
+
+        try:
+            d = await self.async_open_json_document(self.json_file)
+            self.get_iiif_version(d)
+            if self.is_collection(d):
+                await self.async_download_iiif_files_from_collection(d)
+            else:
+                await self.async_download_iiif_files_from_manifest(d)
+            self.write_shard_stats()
+        finally:
+            await async_connection_pool.close()
+            self.finish_run()
+
+    def plan(self, plan_file: str) -> None:
+        """Write the download plan of a manifest or a collection in a JSON
+        Lines file: the URI, the file name, the extension and the dimensions
+        of each image. Only the first page of each document is probed to
+        find the download strategy, no image is downloaded."""
+        self.prepare_run()
+
+        try:
+            d = self.open_json_document(self.json_file)
+            self.get_iiif_version(d)
+            with open(plan_file, "w", encoding="utf-8") as plan:
+                if self.is_collection(d):
+                    self.plan_collection(d, plan)
+                else:
+                    self.plan_manifest(d, plan)
+        finally:
+            self.finish_run()
 
-        # Check IIIF version
-        self.get_iiif_version(d)
+    def run_plan(self, plan_file: str) -> None:
+        """Download the images listed in a plan written by plan(), without
+        reading the documents and looking for the download strategies."""
+        self.prepare_run()
 
-        # Check if the input file is a manifest or a collection
+        try:
+            with open(plan_file, encoding="utf-8") as f:
+                entries = (json.loads(line) for line in f if line.strip())
+                # The images of a document are listed one after the other
+                for directory, document_entries in groupby(
+                        entries, key=lambda entry: str(entry["directory"])):
+                    if self.stop_event.is_set():
+                        break
+                    self.plan_entries = list(document_entries)
+                    self.download_plan_directory(directory)
+        finally:
+            self.plan_entries = []
+            self.finish_run()
+
+    def prepare_run(self) -> None:
+        """Open the caches and apply the user configuration to the settings
+        shared by the downloaders of the process (see SharedSettings)."""
+        # Read the strategies found in the previous runs
+        if self.strategy_cache_file:
+            self.strategy_cache = StrategyCache(self.strategy_cache_file)
+
+        # Save the Image Information documents in a directory
+        if self.info_cache_dir:
+            if not os.path.exists(self.info_cache_dir):
+                os.makedirs(self.info_cache_dir)
+            self.image_information_cache.directory = self.info_cache_dir
+
+        # Read the documents and the images downloaded in the previous runs
+        if self.sync_catalog_file:
+            self.catalog = SyncCatalog(self.sync_catalog_file)
+
+        shared_settings.acquire(self.get_shared_settings())
+
+    def get_shared_settings(self) -> Dict[str, Any]:
+        """Return the user configuration of the objects shared by the
+        downloaders of the process."""
+        return {
+            # Keep one persistent connection per thread
+            "max_per_host": max(8, self.num_threads if self.num_threads > 0
+                                else max_auto_threads),
+            "max_retries": self.max_retries, "rate": self.rate_limit,
+            "burst": self.burst, "segments": self.segments,
+            # Save the json files in a directory
+            "http_cache_dir": self.http_cache_dir or "",
+            "http_cache_size": self.http_cache_size * 1024 * 1024}
+
+    def finish_run(self) -> None:
+        """Close the catalog and release the shared settings."""
+        if self.catalog is not None:
+            self.catalog.close()
+        shared_settings.release()
+
+    def open_json_document(self, json_file: str) -> Dict[str, Any]:
+        """Read a manifest or a collection. With '--sync', a remote document
+        is read again only if it has been modified."""
+        if self.catalog is None or not is_url(json_file):
+            return open_json_file(
+                json_file, self.referer, self.read_streamed_canvas)
+        return self.catalog.open_json_file(
+            json_file, self.referer, self.read_streamed_canvas)
+
+    async def async_open_json_document(self, json_file: str
+                                       ) -> Dict[str, Any]:
+        """Read a manifest or a collection with asyncio. With '--sync', a
+        remote document is read again only if it has been modified."""
+        if self.catalog is None:
+            return await async_open_json_file(
+                json_file, self.referer, self.read_streamed_canvas)
+        return await asyncio.to_thread(self.open_json_document, json_file)
+
+    def read_streamed_canvas(self, path: Tuple[Any, ...], nc: int,
+                             c: Any) -> Any:
+        """Return the Page of a canvas read while the manifest is parsed, so
+        that the canvases are never kept all together, or None if the page is
+        not read. The other items (e.g. the manifests of a collection) are
+        returned as they are."""
+        if not isinstance(c, dict):
+            return c
+        if path == ("items",):
+            if get_document_type(c) != "canvas":
+                return c
+            if nc not in self.get_canvas_range(nc + 1):
+                return None
+            return self.read_canvas3(c, nc)
+        if nc not in self.get_canvas_range(nc + 1):
+            return None
+        return self.read_canvas2(c, nc)
+
+    def get_canvas_range(self, num_canvases: int) -> range:
+        """Return the indices of the canvases whose pages are read: all of
+        them if the metadata are exported, otherwise only the ones in the
+        page range."""
+        if self.metadata_json or self.lastpage == -1:
+            return range(num_canvases)
+        return range(self.firstpage - 1, min(self.lastpage, num_canvases))
+
+    def is_page_in_shard(self, cnt: int) -> bool:
+        """Check if a page of the manifest is downloaded by this shard. The
+        pages of the manifests of a collection are not split."""
+        if self.shards == 1 or not self.shard_pages:
+            return True
+        key = self.get_catalog_key() + "#" + str(cnt + self.firstpage)
+        return get_shard_of(key, self.shards) == self.shard
+
+    def is_manifest_in_shard(self, manifest_id: str) -> bool:
+        """Check if a manifest of the collection is downloaded by this
+        shard."""
+        return self.shards == 1 or \
+            get_shard_of(manifest_id, self.shards) == self.shard
+
+    def get_shard_manifest_id(self, crawler: CollectionCrawler,
+                              block: bool = False) -> str | None:
+        """Return the next manifest ID of the collection downloaded by this
+        shard, or None (see CollectionCrawler.get_manifest_id)."""
+        while True:
+            manifest_id = crawler.get_manifest_id(block)
+            if manifest_id is None:
+                return None
+            self.shard_manifests.append(manifest_id)
+            if self.is_manifest_in_shard(manifest_id):
+                return manifest_id
+            logging.debug("Manifest %s skipped (other shard)", manifest_id)
+
+    def write_shard_stats(self) -> None:
+        """Write the statistics of this shard in the output directory: the
+        pages (or the manifests) of the document, the ones assigned to this
+        shard and the download counters. The file name has a key of the
+        document, since other documents may be downloaded in the same
+        directory. They are checked by merge_shard_stats()."""
+        if self.shards == 1:
+            return
+        if self.shard_pages:
+            units: List[Any] = [
+                cnt + self.firstpage for cnt in range(len(self.pages))]
+            assigned = [unit for unit in units
+                        if self.is_page_in_shard(unit - self.firstpage)]
+        else:
+            units = self.shard_manifests
+            assigned = [unit for unit in units
+                        if self.is_manifest_in_shard(unit)]
+        stats = {
+            "document": self.json_file, "shard": self.shard,
+            "shards": self.shards, "units": units, "assigned": assigned,
+            "downloaded": self.downloaded_cnt, "skipped": self.skipped_cnt,
+            "failed": self.failed_cnt, "stopped": self.stop_event.is_set()}
+        document_key = sha1(self.json_file.encode("utf-8")).hexdigest()[:12]
+        filename = self.maindir + "/" + shard_stats_prefix + document_key + \
+            "_" + str(self.shard) + "of" + str(self.shards) + ".json"
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+        os.replace(tmp_filename, filename)
+
+    def is_collection(self, d: Dict[str, Any]) -> bool:
+        """Check if a document is a collection of manifests or a manifest."""
         if self.version == 2:
             type_key = "@type"
             type_val_manifest = "sc:Manifest"
@@ -352,9 +3364,9 @@ class IIIF_Downloader:
 
         iiif_type = str(d.get(type_key))
         if iiif_type.lower() == type_val_manifest.lower():
-            self.download_iiif_files_from_manifest(d)
-        elif iiif_type.lower() == type_val_collection.lower():
-            self.download_iiif_files_from_collection(d)
+            return False
+        if iiif_type.lower() == type_val_collection.lower():
+            return True
         else:
             raise Exception(
                 "Not a manifest or a collection of manifests (type: '"
@@ -362,92 +3374,260 @@ class IIIF_Downloader:
 
     def download_iiif_files_from_manifest(self, d: Dict[str, Any]) -> None:
         """Download all the files from a manifest."""
+        subdir = self.prepare_manifest(d)
+        if subdir is None:
+            return
+
+        # Loop over each page
+        start_time = time.time()
+        counters = self.get_shared_counters()
+        concurrency = ""
+        tot_pages = len(self.pages)
+        if self.num_threads == 1:
+            for cnt in range(tot_pages):
+                if self.stop_event.is_set():
+                    break
+                self.download_single_page(cnt, subdir)
+        else:
+            # First page download separately, to find the strategy
+            offset = 0
+            while self.strategy is None and offset != tot_pages and \
+                    not self.stop_event.is_set():
+                self.download_single_page(offset, subdir)
+                offset += 1
+
+            # Download remaining pages in parallel
+            concurrency = self.download_pages_in_parallel(
+                offset, tot_pages, subdir)
+
+        self.finish_manifest(subdir, start_time, counters, concurrency)
+
+    async def async_download_iiif_files_from_manifest(
+            self, d: Dict[str, Any]) -> None:
+        """Download all the files from a manifest with asyncio tasks."""
+        subdir = self.prepare_manifest(d)
+        if subdir is None:
+            return
+
+        # First page download separately, to find the strategy
+        start_time = time.time()
+        counters = self.get_shared_counters()
+        tot_pages = len(self.pages)
+        offset = 0
+        while self.strategy is None and offset != tot_pages and \
+                not self.stop_event.is_set():
+            await self.async_download_single_page(offset, subdir)
+            offset += 1
+
+        # Download remaining pages, each task takes the next one
+        num_tasks = self.num_threads if self.num_threads > 0 \
+            else max_auto_threads
+        pages = iter(range(offset, tot_pages))
+        await asyncio.gather(*(
+            self.async_download_pages(pages, subdir)
+            for _ in range(num_tasks)))
+
+        self.finish_manifest(subdir, start_time, counters)
+
+    async def async_download_pages(self, pages: Iterator[int],
+                                   subdir: str) -> None:
+        """Download the pages taken from an iterator shared by several tasks.
+        """
+        for cnt in pages:
+            if self.stop_event.is_set():
+                break
+            try:
+                await self.async_download_single_page(cnt, subdir)
+            except Exception as e:
+                logging.error(
+                    "\033[91mCannot download page n.%s (%s)\033[0m",
+                    str(cnt + self.firstpage), str(e))
+                self.stats.add_failed()
+
+    async def async_download_single_page(self, cnt: int, subdir: str
+                                         ) -> None:
+        """Download one page given its position in the pages list, with
+        asyncio."""
+        if not self.is_page_in_shard(cnt):
+            return
+        page = self.prepare_page(cnt)
+        if page is None:
+            return
+
+        # Loop over each image ID (usually one iteration)
+        for n in range(len(page.id)):
+            filename = self.get_image_filename(page, cnt, n)
+            subdir_filename = subdir + "/" + filename
+            conditional = self.get_conditional_request(
+                page, n, subdir_filename)
+            if conditional is None and \
+                    self.skip_existing_file(subdir_filename, cnt):
+                continue
+
+            # Try to download the file with the strategy found with the
+            # first page, or look for it
+            strategy = self.strategy
+            checksum = FileChecksum()
+            if strategy is not None:
+                filesize, code = await self.async_download_image(
+                    page, n, subdir_filename, strategy.codes, conditional,
+                    self.get_compiled_uri(strategy, cnt, n), checksum)
+            else:
+                filesize, code = await self.async_discover_strategy(
+                    page, n, subdir_filename, conditional, checksum)
+
+            self.record_image(
+                page, cnt, n, subdir_filename, code, filesize, conditional,
+                checksum)
+            self.count_image(filesize, cnt, filename, subdir, conditional)
+
+    def prepare_manifest(self, d: Dict[str, Any]) -> str | None:
+        """Parse a manifest, reset the counters and create the output
+        directory. Return the directory, or None if there are no pages."""
+        if not self.read_manifest(d):
+            return None
+
+        # Create subdirectory from manifest label
+        subdir = self.maindir + "/" + sanitize_name(self.manifest_label)
+        if not os.path.exists(subdir):
+            # The other shards may create it at the same time
+            os.makedirs(subdir, exist_ok=True)
+            logging.debug(
+                "%s created in %s", sanitize_name(self.manifest_label),
+                self.maindir)
+
+        # Read the files downloaded before (each shard has its own journal)
+        self.journal = DownloadJournal(subdir, name=self.get_journal_name())
+
+        # Export json file (once, by the first shard)
+        if self.metadata_json and (self.shard == 1 or not self.shard_pages):
+            self.export_metadata(subdir + "/" + self.metadata_json)
+
+        self.select_pages()
+        return subdir
+
+    def get_journal_name(self) -> str:
+        """Return the file name of the journal: the pages of a manifest split
+        between the shards are written in one journal per shard."""
+        if self.shards == 1 or not self.shard_pages:
+            return DownloadJournal.filename
+        return DownloadJournal.filename.replace(
+            ".jsonl",
+            "_" + str(self.shard) + "of" + str(self.shards) + ".jsonl")
+
+    def read_manifest(self, d: Dict[str, Any]) -> bool:
+        """Parse a manifest and reset the counters and the strategy. Return
+        False if there are no pages."""
         # Parse manifest
         if self.version == 2:
             self.read_iiif_manifest2(d)
         else:
             self.read_iiif_manifest3(d)
-        self.orig_num_pages = len(self.pages)
+
+        # Reset the counters and the strategy of the previous document
+        self.stats = DownloadStats(self.collection_stats)
+        self.strategy = None
+        self.failed_strategies = set()
 
         # Print manifest features
         logging.debug("IIIF version: %s.0", str(self.version))
         logging.debug("Manifest ID: %s", self.manifest_id)
         logging.info("Document title: %s", self.manifest_label)
-        logging.debug("Pages: %s", str(len(self.pages)))
-
-        if self.pages:
-            # Create subdirectory from manifest label
-            subdir = self.maindir + "/" + sanitize_name(self.manifest_label)
-            if not os.path.exists(subdir):
-                os.mkdir(subdir)
-                logging.debug(
-                    "%s created in %s", sanitize_name(self.manifest_label),
-                    self.maindir)
-
-            # Export json file
+        logging.debug("Pages: %s", str(self.orig_num_pages))
+        return self.orig_num_pages > 0
+
+    def select_pages(self) -> None:
+        """Keep only the pages in the range given by the user."""
+        # Create image sub-list [firstpage, lastpage], if all the pages have
+        # been read for the metadata
+        if self.firstpage != 1 or self.lastpage != -1:
             if self.metadata_json:
-                self.export_metadata(subdir + "/" + self.metadata_json)
-
-            # Create image sub-list [firstpage, lastpage]
-            if self.firstpage != 1 or self.lastpage != -1:
                 self.pages = self.pages[self.firstpage - 1:self.lastpage]
-                logging.info(
-                    "Downloading pages %s-%s from a total of %s",
-                    str(self.firstpage), str(self.lastpage),
-                    str(self.orig_num_pages))
-            # size = 'full' is not part of the 3.0 API standard
-            if self.version == 3:
-                self.uri_base_serv_id_full = self.uri_base_b_img_id_full = \
-                    self.uri_base_img_id_full = False
-
-            # Unset all flags except width-related ones if '-w' has been set
-            if self.width != 0:
-                self.uri_base_serv_id_full = self.uri_base_serv_id_max = \
-                    self.uri_img_id = self.uri_base_b_img_id_full = \
-                    self.uri_base_b_img_id_max = self.uri_base_img_id_full = \
-                    self.uri_base_img_id_max = False
-
-            # Loop over each page
-            start_time = time.time()
-            tot_pages = len(self.pages)
-            if self.num_threads <= 1:
-                for cnt in range(tot_pages):
-                    self.download_single_page(cnt, subdir)
-            else:
-                # First page download separately
-                thread_pages_cnt = tot_pages
-                offset = 0
-                while self.downloaded_cnt == 0 and offset != tot_pages:
-                    self.download_single_page(offset, subdir)
-                    offset += 1
-                thread_pages_cnt -= offset
-
-                # Download remaining pages in parallel
-                executor = ThreadPoolExecutor(max_workers=self.num_threads)
-                for cnt in range(thread_pages_cnt):
-                    executor.submit(
-                        self.download_single_page, offset + cnt, subdir)
-                executor.shutdown()
-
-            total_time = time.time() - start_time
-
-            # Print some statistics
-            print_statistics(
-                self.downloaded_cnt, self.skipped_cnt, self.failed_cnt,
-                total_time, self.total_filesize)
-
-            # Rename the directory if something was wrong
-            if self.failed_cnt > 0:
-                err_subdir = self.maindir + "/" + "ERR_" + \
-                    sanitize_name(self.manifest_label)
-                if os.path.exists(err_subdir):
-                    rmtree(err_subdir)
-                os.rename(subdir, err_subdir)
-                logging.error(
-                    "\033[91mSome error with %s\033[0m", self.manifest_label)
+            logging.info(
+                "Downloading pages %s-%s from a total of %s",
+                str(self.firstpage), str(self.lastpage),
+                str(self.orig_num_pages))
+
+    def get_shared_counters(self) -> Tuple[int, int, int]:
+        """Return the counters shared with other documents: Image Information
+        cache hits and misses, and retries."""
+        return (self.image_information_cache.hits,
+                self.image_information_cache.misses, retry_policy.retries)
+
+    def finish_manifest(self, subdir: str, start_time: float,
+                        counters: Tuple[int, int, int],
+                        concurrency: str = "") -> None:
+        """Print the statistics of a manifest and rename its directory if
+        something was wrong."""
+        total_time = time.time() - start_time
+        info_hits, info_misses, retries = counters
+        if self.journal is not None:
+            self.journal.close()
+        if self.catalog is not None:
+            self.catalog.commit()
+
+        # Print some statistics
+        print_statistics(
+            self.stats.downloaded_cnt, self.stats.skipped_cnt,
+            self.stats.failed_cnt, total_time, self.stats.total_filesize,
+            self.image_information_cache.hits - info_hits,
+            self.image_information_cache.misses - info_misses,
+            retry_policy.retries - retries, concurrency)
+
+        # Rename the directory if something was wrong
+        if self.stop_event.is_set():
+            logging.info("Download stopped")
+        elif self.failed_cnt > 0 and (self.shards > 1 and self.shard_pages):
+            # The directory is shared with the other shards
+            logging.error(
+                "\033[91mSome error with %s\033[0m", self.manifest_label)
+        elif self.failed_cnt > 0:
+            err_subdir = self.maindir + "/" + "ERR_" + \
+                sanitize_name(self.manifest_label)
+            if os.path.exists(err_subdir):
+                rmtree(err_subdir)
+            os.rename(subdir, err_subdir)
+            logging.error(
+                "\033[91mSome error with %s\033[0m", self.manifest_label)
 
     def download_single_page(self, cnt: int, subdir: str) -> None:
         """Download one page given its position in the pages list."""
+        if not self.is_page_in_shard(cnt):
+            return
+        page = self.prepare_page(cnt)
+        if page is None:
+            return
+
+        # Loop over each image ID (usually one iteration)
+        for n in range(len(page.id)):
+            filename = self.get_image_filename(page, cnt, n)
+            subdir_filename = subdir + "/" + filename
+            conditional = self.get_conditional_request(
+                page, n, subdir_filename)
+            if conditional is None and \
+                    self.skip_existing_file(subdir_filename, cnt):
+                continue
+
+            # Try to download the file with the strategy found with the
+            # first page, or look for it
+            strategy = self.strategy
+            checksum = FileChecksum()
+            if strategy is not None:
+                filesize, code = self.download_image(
+                    page, n, subdir_filename, strategy.codes, conditional,
+                    self.get_compiled_uri(strategy, cnt, n), checksum)
+            else:
+                filesize, code = self.discover_strategy(
+                    page, n, subdir_filename, conditional, checksum)
+
+            self.record_image(
+                page, cnt, n, subdir_filename, code, filesize, conditional,
+                checksum)
+            self.count_image(filesize, cnt, filename, subdir, conditional)
+
+    def prepare_page(self, cnt: int) -> Page | None:
+        """Print the features of a page and apply the user configuration.
+        Return the page, or None if it has no images."""
         page = self.pages[cnt]
         tot_pages = len(self.pages)
 
@@ -473,7 +3653,7 @@ class IIIF_Downloader:
         # Check if one image ID (or more) was defined in the manifest
         if len(page.id) == 0:
             logging.info("File not available in the manifest")
-            return
+            return None
 
         # Take just the first file when '--all-images' is not set
         if len(page.id) > 1 and not self.all_images:
@@ -484,204 +3664,909 @@ downloaded. Use the --all-images option to download everything",
 
             page.id = [page.id[0]]
 
-        # Loop over each image ID (usually one iteration)
-        for n, i in enumerate(page.id):
-            # Print IDs and file extension
-            logging.debug("Image ID: %s", i)
-            service_id = page.service_id[n]
-            if service_id is not None:
-                logging.debug("Service ID: %s", service_id)
-            ext = page.ext[n]
-            logging.debug("Extension: %s", ext)
-
-            # Create output file name
-            if self.use_labels:
-                filename = sanitize_name(page.label)
-            else:
-                filename = "p" + str(cnt + self.firstpage).zfill(3)
-            if len(page.id) > 1:
-                filename += "_" + str(n + 1)
-            filename += ext
-            logging.debug("Output file name: %s", filename)
-            subdir_filename = subdir + "/" + filename
+        return page
 
-            # Skip the download if the file exists and '-f' is not set
-            if os.path.exists(subdir_filename) and not self.force:
-                logging.info(
-                    "%s exists, skip. Use the -f option to force overwrite \
-the files.", subdir_filename)
-                self.skipped_cnt += 1
-                continue
+    def get_image_filename(self, page: Page, cnt: int, n: int) -> str:
+        """Return the output file name of the n-th image of a page."""
+        # Print IDs and file extension
+        logging.debug("Image ID: %s", page.id[n])
+        if page.service_id[n] is not None:
+            logging.debug("Service ID: %s", page.service_id[n])
+        logging.debug("Extension: %s", page.ext[n])
 
-            # Try to download the file
-            filesize = -1
-
-            uri_base_serv_id = self.uri_base_serv_id_full or \
-                self.uri_base_serv_id_max or \
-                self.uri_base_serv_id_width
-            # Check if a service ID has been defined in the manifest
-            if service_id is not None and uri_base_serv_id:
-                # 1a. Formatted URI: base = service ID, size = full
-                if self.uri_base_serv_id_full:
-                    img_uri = get_default_img_uri(service_id, "full", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_serv_id_full = False
-
-                # 1b. Formatted URI: base = service ID, size = max
-                if self.uri_base_serv_id_max and filesize <= 0:
-                    img_uri = get_default_img_uri(service_id, "max", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_serv_id_max = False
-
-                # 1c. Formatted URI: base = service ID, size = <width>,
-                if self.uri_base_serv_id_width and filesize <= 0:
-                    # Check Image Information width using service ID
-                    if self.width == 0 or self.width is None:
-                        self.check_image_information_width(service_id, page)
-
-                    img_uri = get_default_img_uri(
-                        service_id, str(page.w) + ",", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_serv_id_width = False
-
-            # 2. Image ID as it is
-            if self.uri_img_id and filesize <= 0:
-                filesize = download_file(i, subdir_filename, self.referer)
-                if filesize <= 0:
-                    logging.debug("Cannot download %s", i)
-                    if self.downloaded_cnt == 0:
-                        self.uri_img_id = False
-
-            uri_base_b_img_id = self.uri_base_b_img_id_full or \
-                self.uri_base_b_img_id_max or \
-                self.uri_base_b_img_id_width
-            # Check if the image ID is formatted as the URI pattern
-            regex_match_id = match_uri_pattern(i)
-            if regex_match_id is not None and uri_base_b_img_id:
-                id_base = regex_match_id.group("base")
-                if service_id != id_base:
-                    # 3a. Image ID (formatted URI), size changed to full
-                    if self.uri_base_b_img_id_full and filesize <= 0:
-                        img_uri = get_default_img_uri(id_base, "full", ext)
-                        filesize = download_file(
-                            img_uri, subdir_filename, self.referer)
-                        if filesize <= 0:
-                            logging.debug("Cannot download %s", img_uri)
-                            if self.downloaded_cnt == 0:
-                                self.uri_base_b_img_id_full = False
-
-                    # 3b. Image ID (formatted URI), size changed to max
-                    if self.uri_base_b_img_id_max and filesize <= 0:
-                        img_uri = get_default_img_uri(id_base, "max", ext)
-                        filesize = download_file(
-                            img_uri, subdir_filename, self.referer)
-                        if filesize <= 0:
-                            logging.debug("Cannot download %s", img_uri)
-                            if self.downloaded_cnt == 0:
-                                self.uri_base_b_img_id_max = False
-
-                    # 3c. Image ID (formatted URI), size changed to <width>,
-                    if self.uri_base_b_img_id_width and filesize <= 0:
-                        # Check Image Information width using the base of the
-                        # image ID
-                        if self.width == 0 or self.width is None:
-                            self.check_image_information_width(id_base, page)
-
-                        img_uri = get_default_img_uri(
-                            id_base, str(page.w) + ",", ext)
-                        filesize = download_file(
-                            img_uri, subdir_filename, self.referer)
-                        if filesize <= 0:
-                            logging.debug("Cannot download %s", img_uri)
-                            if self.downloaded_cnt == 0:
-                                self.uri_base_b_img_id_width = False
-
-            uri_base_img_id = self.uri_base_img_id_full or \
-                self.uri_base_img_id_max or self.uri_base_img_id_width
-            # Check if the image ID is different from the service ID
-            if i != service_id and uri_base_img_id:
-                # 4a. formatted URI, base = image ID, size = full
-                if self.uri_base_img_id_full and filesize <= 0:
-                    img_uri = get_default_img_uri(i, "full", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_img_id_full = False
-
-                # 4b. formatted URI, base = image ID, size = max
-                if self.uri_base_img_id_max and filesize <= 0:
-                    img_uri = get_default_img_uri(i, "max", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_img_id_max = False
-
-                # 4c. formatted URI, base = image ID, size = <width>,
-                if filesize <= 0:
-                    img_uri = get_default_img_uri(i, str(page.w) + ",", ext)
-                    filesize = download_file(
-                        img_uri, subdir_filename, self.referer)
-                    if filesize <= 0:
-                        logging.debug("Cannot download %s", img_uri)
-                        if self.downloaded_cnt == 0:
-                            self.uri_base_img_id_width = False
-
-            # Print the final message and update the counters
-            if filesize <= 0:
+        # Create output file name
+        if self.use_labels:
+            filename = sanitize_name(page.label)
+        else:
+            filename = "p" + str(cnt + self.firstpage).zfill(3)
+        if len(page.id) > 1:
+            filename += "_" + str(n + 1)
+        filename += page.ext[n]
+        logging.debug("Output file name: %s", filename)
+        return filename
+
+    def skip_existing_file(self, filepath: str, cnt: int) -> bool:
+        """Check if the download of a file must be skipped because the file
+        has been downloaded before and '-f' is not set."""
+        if self.force:
+            return False
+        if self.journal is not None:
+            exists = self.journal.is_complete(
+                os.path.basename(filepath), cnt + self.firstpage)
+        else:
+            exists = os.path.exists(filepath)
+        if exists:
+            logging.info(
+                "%s exists, skip. Use the -f option to force overwrite the \
+files.", filepath)
+            self.stats.add_skipped()
+            return True
+        return False
+
+    def get_conditional_request(self, page: Page, n: int, filepath: str
+                                ) -> ConditionalRequest | None:
+        """Return the conditional request of the n-th image of a page with
+        '--sync': with the validators of the image downloaded before, if its
+        source has not changed in the manifest. Return None without '--sync',
+        or if the image cannot be checked."""
+        if self.catalog is None or self.force:
+            return None
+        if not os.path.isfile(filepath):
+            return ConditionalRequest()  # new image
+        filename = os.path.basename(filepath)
+        record = self.catalog.get_image(self.get_catalog_key(), filename)
+        if record is None:
+            # Image downloaded without '--sync': its URI is in the journal
+            # and the date of the file is used as validator
+            journal_record = None if self.journal is None else \
+                self.journal.records.get(filename)
+            if journal_record is None or not journal_record.get("uri"):
+                return None
+            return ConditionalRequest(
+                str(journal_record["uri"]), last_modified=formatdate(
+                    os.path.getmtime(filepath), usegmt=True))
+        if record["source"] != self.get_image_source(page, n):
+            logging.info("%s changed in the manifest", filename)
+            return ConditionalRequest()
+        return ConditionalRequest(
+            record["uri"], record["etag"], record["last_modified"])
+
+    def get_catalog_key(self) -> str:
+        """Return the key of the document in the catalog."""
+        return self.manifest_id or self.json_file
+
+    def get_image_source(self, page: Page, n: int) -> str:
+        """Return the description of the n-th image of a page in the manifest
+        (IDs, extension and requested width), which changes if the image is
+        replaced."""
+        return json.dumps(
+            [page.id[n], page.service_id[n], page.ext[n], self.width])
+
+    def record_image(self, page: Page, cnt: int, n: int, filepath: str,
+                     code: str | None, filesize: int,
+                     conditional: ConditionalRequest | None = None,
+                     checksum: FileChecksum | None = None) -> None:
+        """Add a downloaded image to the journal of the document and to the
+        catalog. The checksum computed while downloading it is saved in the
+        journal."""
+        if code is None or filesize <= 0:
+            return
+        uri = self.get_candidate_uri(page, n, code, check_width=False) or ""
+        filename = os.path.basename(filepath)
+        if self.catalog is not None and conditional is not None:
+            self.catalog.set_image(
+                self.get_catalog_key(), filename, cnt + self.firstpage,
+                page.label, self.get_image_source(page, n), uri, code,
+                conditional, filesize)
+        if self.journal is not None and (
+                conditional is None or not conditional.not_modified):
+            self.journal.add(
+                cnt + self.firstpage, filename, uri, code, filesize,
+                get_file_checksum(filepath) if checksum is None
+                else checksum.hexdigest())
+
+    def count_image(self, filesize: int, cnt: int, filename: str,
+                    subdir: str,
+                    conditional: ConditionalRequest | None = None) -> None:
+        """Print the final message of an image and update the counters."""
+        if filesize > 0 and conditional is not None and \
+                conditional.not_modified:
+            logging.info("%s not modified, skip", filename)
+            self.stats.add_skipped()
+        elif filesize <= 0:
+            logging.error(
+                "\033[91mCannot download page n.%s\033[0m",
+                str(cnt + self.firstpage))
+            self.stats.add_failed()
+        else:
+            logging.info(
+                "\033[92m%s (%s kB) saved in %s\033[0m", filename,
+                str(round(filesize / 1000)), subdir)
+            self.stats.add_downloaded(filesize)
+
+    def download_pages_in_parallel(
+            self, first_cnt: int, last_cnt: int, subdir: str,
+            download_page: "Callable[[int, str], None] | None" = None
+            ) -> str:
+        """Download the pages in [first_cnt, last_cnt) with several threads
+        (with download_page, download_single_page by default) and return the
+        report of the concurrency controller, if used. Only a limited number
+        of pages is queued at any time."""
+        if download_page is None:
+            download_page = self.download_single_page
+        controller = None
+        if self.num_threads > 1:
+            max_workers = self.num_threads
+        else:
+            # The number of threads is set by the controller
+            controller = ConcurrencyController(maximum=max_auto_threads)
+            max_workers = max_auto_threads
+        max_queued = 2 * max_workers
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        queued: Dict[Future[None], int] = {}
+        try:
+            for cnt in range(first_cnt, last_cnt):
+                # Wait for some free room in the queue
+                while len(queued) >= max_queued and \
+                        not self.stop_event.is_set():
+                    self.collect_pages(queued)
+                if self.stop_event.is_set():
+                    break
+
+                if controller is None:
+                    future = executor.submit(download_page, cnt, subdir)
+                elif self.acquire_download(controller):
+                    future = executor.submit(
+                        self.download_controlled_page, cnt, subdir,
+                        controller, download_page)
+                else:
+                    break
+                queued[future] = cnt
+
+            # Wait for the last pages
+            while queued and not self.stop_event.is_set():
+                self.collect_pages(queued)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            # Nothing is left in the queue if the download has been stopped
+            executor.shutdown(cancel_futures=True)
+            if queued:
+                self.collect_pages(queued)
+
+        return controller.report() if controller is not None else ""
+
+    def collect_pages(self, queued: Dict[Future[None], int]) -> None:
+        """Wait for some queued pages to be downloaded and count the
+        unexpected errors as failed downloads."""
+        done, _ = wait(queued, timeout=0.5, return_when=FIRST_COMPLETED)
+        for future in done:
+            cnt = queued.pop(future)
+            if future.cancelled():
+                continue
+            e = future.exception()
+            if e is not None:
                 logging.error(
-                    "\033[91mCannot download page n.%s\033[0m",
-                    str(cnt + self.firstpage))
-                self.failed_cnt += 1
+                    "\033[91mCannot download page n.%s (%s)\033[0m",
+                    str(cnt + self.firstpage), str(e))
+                self.stats.add_failed()
+
+    def acquire_download(self, controller: ConcurrencyController) -> bool:
+        """Wait until the controller lets a new download start. Return False
+        if the download has been stopped while waiting."""
+        while not self.stop_event.is_set():
+            if controller.acquire(timeout=0.5):
+                return True
+        return False
+
+    def stop(self) -> None:
+        """Stop the download: the pages being downloaded are completed, the
+        other ones are skipped."""
+        logging.info("Stopping the download...")
+        self.stop_event.set()
+
+    def download_controlled_page(
+            self, cnt: int, subdir: str, controller: ConcurrencyController,
+            download_page: "Callable[[int, str], None] | None" = None
+            ) -> None:
+        """Download one page and tell the controller how long it took."""
+        start_time = time.monotonic()
+        try:
+            (download_page or self.download_single_page)(cnt, subdir)
+        finally:
+            controller.release(time.monotonic() - start_time)
+
+    def discover_strategy(self, page: Page, n: int, filepath: str,
+                          conditional: ConditionalRequest | None = None,
+                          checksum: FileChecksum | None = None
+                          ) -> Tuple[int, str | None]:
+        """Download one image trying all the strategies, in order of priority,
+        and publish the successful one. Return the file size and the
+        strategy. Only one thread at a time looks for the strategy."""
+        with self.discovery_lock:
+            # The strategy may have been found while waiting
+            strategy = self.strategy
+            if strategy is not None:
+                return self.download_image(
+                    page, n, filepath, strategy.codes, conditional,
+                    checksum=checksum)
+
+            # Strategies failed with the previous pages are not attempted
+            codes = self.get_discovery_strategies()
+
+            # Try first the strategy used with the same image server before
+            cache_key = get_strategy_cache_key(page, n)
+            code = self.get_cached_strategy(cache_key, codes)
+            if code is not None:
+                filesize, _ = self.download_image(
+                    page, n, filepath, (code,), conditional, checksum=checksum)
+                if filesize > 0:
+                    self.strategy = self.resolve_strategy(
+                        codes[codes.index(code):])
+                    return filesize, code
+                self.invalidate_cached_strategy(cache_key)
+
+            failed: List[str] = []
+            if self.parallel_discovery:
+                raced_codes = self.race_strategies(page, n, codes)
+                failed = [
+                    code for code in codes[:len(codes) - len(raced_codes)]
+                    if self.is_attempted(page, n, code)]
+                codes = raced_codes
+
+            # Try the strategies one after the other
+            for nc, code in enumerate(codes):
+                start_time = time.monotonic()
+                filesize, _ = self.download_image(
+                    page, n, filepath, (code,), conditional, checksum=checksum)
+                if filesize > 0:
+                    self.publish_strategy(
+                        codes[nc:], failed, cache_key,
+                        time.monotonic() - start_time)
+                    return filesize, code
+                if self.is_attempted(page, n, code):
+                    failed.append(code)
+
+            self.failed_strategies.update(failed)
+            return -1, None
+
+    async def async_discover_strategy(
+            self, page: Page, n: int, filepath: str,
+            conditional: ConditionalRequest | None = None,
+            checksum: FileChecksum | None = None
+            ) -> Tuple[int, str | None]:
+        """Download one image with asyncio trying all the strategies, in order
+        of priority, and publish the successful one. Return the file size and
+        the strategy. The pages are downloaded one at a time until the
+        strategy is found."""
+        # Strategies failed with the previous pages are not attempted
+        codes = self.get_discovery_strategies()
+
+        # Try first the strategy used with the same image server before
+        cache_key = get_strategy_cache_key(page, n)
+        code = self.get_cached_strategy(cache_key, codes)
+        if code is not None:
+            filesize, _ = await self.async_download_image(
+                page, n, filepath, (code,), conditional, checksum=checksum)
+            if filesize > 0:
+                self.strategy = self.resolve_strategy(
+                    codes[codes.index(code):])
+                return filesize, code
+            self.invalidate_cached_strategy(cache_key)
+
+        failed: List[str] = []
+        if self.parallel_discovery:
+            raced_codes = await self.async_race_strategies(page, n, codes)
+            failed = [
+                code for code in codes[:len(codes) - len(raced_codes)]
+                if self.is_attempted(page, n, code)]
+            codes = raced_codes
+
+        # Try the strategies one after the other
+        for nc, code in enumerate(codes):
+            start_time = time.monotonic()
+            filesize, _ = await self.async_download_image(
+                page, n, filepath, (code,), conditional, checksum=checksum)
+            if filesize > 0:
+                self.publish_strategy(
+                    codes[nc:], failed, cache_key,
+                    time.monotonic() - start_time)
+                return filesize, code
+            if self.is_attempted(page, n, code):
+                failed.append(code)
+
+        self.failed_strategies.update(failed)
+        return -1, None
+
+    def get_discovery_strategies(self) -> Tuple[str, ...]:
+        """Return the codes of the eligible strategies that have not failed
+        with the previous pages, or all of them if they have all failed."""
+        eligible = self.get_eligible_strategies()
+        codes = tuple(c for c in eligible if c not in self.failed_strategies)
+        return codes or eligible
+
+    def is_attempted(self, page: Page, n: int, code: str) -> bool:
+        """Check if a request is sent for the n-th image of a page with a
+        strategy: only the strategies attempted and failed are excluded
+        from the discovery with the next pages."""
+        return self.get_candidate_base(page, n, code) is not None
+
+    def get_cached_strategy(self, cache_key: str,
+                            codes: Tuple[str, ...]) -> str | None:
+        """Return the code of the strategy used with the same image server in
+        the previous runs, if it can be attempted."""
+        if self.strategy_cache is None:
+            return None
+        cached = self.strategy_cache.get(cache_key)
+        if cached is None or cached["strategy"] not in codes:
+            return None
+        logging.debug("Cached download strategy: %s", cached["strategy"])
+        return str(cached["strategy"])
+
+    def invalidate_cached_strategy(self, cache_key: str) -> None:
+        """Delete the cached strategy of an image server that failed."""
+        logging.debug("Cached download strategy failed")
+        if self.strategy_cache is not None:
+            self.strategy_cache.invalidate(cache_key)
+
+    def publish_strategy(self, codes: Tuple[str, ...], failed: List[str],
+                         cache_key: str, latency: float) -> None:
+        """Publish the successful strategy (the first code, followed by the
+        fallbacks) and save it in the cache."""
+        logging.debug("Download strategy: %s", codes[0])
+        self.strategy = self.resolve_strategy(codes)
+        self.failed_strategies.update(failed)
+        if self.strategy_cache is not None:
+            self.strategy_cache.set(cache_key, codes[0], latency, failed)
+
+    def resolve_strategy(self, codes: Tuple[str, ...]) -> ResolvedStrategy:
+        """Return the successful strategy (the first code, followed by the
+        fallbacks) with the URIs of all the images, compiled once."""
+        return ResolvedStrategy(codes, self.compile_uris(codes[0]))
+
+    def race_strategies(self, page: Page, n: int, codes: Tuple[str, ...]
+                        ) -> Tuple[str, ...]:
+        """Probe the URIs of all the strategies at the same time and return the
+        codes starting from the successful one with the highest priority."""
+        def probe(code: str, probe_page: Page) -> bool:
+            img_uri = self.get_candidate_uri(probe_page, n, code)
+            return img_uri is not None and probe_file(img_uri, self.referer)
+
+        # Each probe has its own copy of the page, since the width can be
+        # changed by the Image Information
+        probe_pages = [copy(page) for _ in codes]
+        executor = ThreadPoolExecutor(max_workers=max(1, len(codes)))
+        futures = [
+            executor.submit(probe, code, probe_page)
+            for code, probe_page in zip(codes, probe_pages)]
+        try:
+            # Wait for the results in order of priority
+            for nc, future in enumerate(futures):
+                if future.result():
+                    logging.debug("Probe successful for strategy %s",
+                                  codes[nc])
+                    page.w = probe_pages[nc].w
+                    return codes[nc:]
+            return ()
+        finally:
+            # The remaining probes are cancelled
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def async_race_strategies(self, page: Page, n: int,
+                                    codes: Tuple[str, ...]
+                                    ) -> Tuple[str, ...]:
+        """Probe the URIs of all the strategies at the same time with asyncio
+        and return the codes starting from the successful one with the
+        highest priority."""
+        async def probe(code: str, probe_page: Page) -> bool:
+            img_uri = await self.async_get_candidate_uri(probe_page, n, code)
+            return img_uri is not None and \
+                await async_probe_file(img_uri, self.referer)
+
+        # Each probe has its own copy of the page, since the width can be
+        # changed by the Image Information
+        probe_pages = [copy(page) for _ in codes]
+        tasks = [
+            asyncio.ensure_future(probe(code, probe_page))
+            for code, probe_page in zip(codes, probe_pages)]
+        try:
+            # Wait for the results in order of priority
+            for nc, task in enumerate(tasks):
+                if await task:
+                    logging.debug("Probe successful for strategy %s",
+                                  codes[nc])
+                    page.w = probe_pages[nc].w
+                    return codes[nc:]
+            return ()
+        finally:
+            # The remaining probes are cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def download_image(self, page: Page, n: int, filepath: str,
+                       codes: Tuple[str, ...],
+                       conditional: ConditionalRequest | None = None,
+                       uri: str | None = None,
+                       checksum: FileChecksum | None = None
+                       ) -> Tuple[int, str | None]:
+        """Download the n-th image of a page trying the given strategies, in
+        order. Return the file size and the successful strategy. The URI of
+        the first strategy may have been compiled before."""
+        candidates = self.get_candidate_uris(page, n, codes)
+        if uri is not None:
+            candidates = chain(
+                ((codes[0], uri),),
+                self.get_candidate_uris(page, n, codes[1:]))
+        for code, img_uri in candidates:
+            filesize = download_file(
+                img_uri, filepath, self.referer, conditional, checksum)
+            if filesize > 0:
+                return filesize, code
+            logging.debug("Cannot download %s", img_uri)
+        return -1, None
+
+    async def async_download_image(
+            self, page: Page, n: int, filepath: str, codes: Tuple[str, ...],
+            conditional: ConditionalRequest | None = None,
+            uri: str | None = None,
+            checksum: FileChecksum | None = None) -> Tuple[int, str | None]:
+        """Download the n-th image of a page with asyncio trying the given
+        strategies, in order. Return the file size and the successful
+        strategy. The URI of the first strategy may have been compiled
+        before."""
+        for nc, code in enumerate(codes):
+            if nc == 0 and uri is not None:
+                img_uri: str | None = uri
             else:
-                logging.info(
-                    "\033[92m%s (%s kB) saved in %s\033[0m", filename,
-                    str(round(filesize / 1000)), subdir)
-                self.total_filesize += filesize
-                self.downloaded_cnt += 1
+                img_uri = await self.async_get_candidate_uri(page, n, code)
+            if img_uri is None:
+                continue
+            filesize = await async_download_file(
+                img_uri, filepath, self.referer, conditional, checksum)
+            if filesize > 0:
+                return filesize, code
+            logging.debug("Cannot download %s", img_uri)
+        return -1, None
+
+    def get_eligible_strategies(self) -> Tuple[str, ...]:
+        """Return the codes of the strategies that can be attempted with this
+        document and this user configuration, in order of priority."""
+        return tuple(s.code for s in strategies if self.is_eligible(s))
+
+    def is_eligible(self, strategy: Strategy) -> bool:
+        """Check if a strategy can be attempted with this document and this
+        user configuration."""
+        # size = 'full' is not part of the 3.0 API standard
+        if self.version == 3 and strategy.size == "full":
+            return False
+        # Only width-related strategies if '-w' has been set
+        return self.width == 0 or strategy.size == "width"
+
+    def get_candidate_uris(self, page: Page, n: int, codes: Tuple[str, ...]
+                           ) -> Iterator[Tuple[str, str]]:
+        """Yield the code and the URI of each strategy that can be used with
+        the n-th image of a page, in the given order."""
+        for code in codes:
+            img_uri = self.get_candidate_uri(page, n, code)
+            if img_uri is not None:
+                yield code, img_uri
+
+    def get_candidate_uri(self, page: Page, n: int, code: str,
+                          check_width: bool = True) -> str | None:
+        """Return the URI of the n-th image of a page given the code of the
+        strategy, or None if the strategy cannot be used. The Image
+        Information width is read only if check_width is set."""
+        strategy = strategy_codes[code]
+        base = self.get_candidate_base(page, n, code)
+        if base is None:
+            return None
+
+        # Check Image Information width using the base
+        if check_width and self.needs_image_information(code):
+            self.check_image_information_width(base, page)
+        return strategy.get_uri(base, page.w, page.ext[n])
+
+    async def async_get_candidate_uri(self, page: Page, n: int,
+                                      code: str) -> str | None:
+        """Return the URI of the n-th image of a page given the code of the
+        strategy, reading the Image Information with asyncio."""
+        if self.needs_image_information(code):
+            base = self.get_candidate_base(page, n, code)
+            if base is not None:
+                await self.async_check_image_information_width(base, page)
+        return self.get_candidate_uri(page, n, code, check_width=False)
+
+    def needs_image_information(self, code: str) -> bool:
+        """Check if the Image Information width is used by a strategy."""
+        strategy = strategy_codes[code]
+        return strategy.base != "image ID" and strategy.size == "width" and \
+            (self.width == 0 or self.width is None)
+
+    def get_candidate_base(self, page: Page, n: int, code: str) -> str | None:
+        """Return the base of the formatted URI of the n-th image of a page
+        given the code of the strategy, or None if it cannot be used."""
+        return strategy_codes[code].get_base(
+            page.id[n], page.service_id[n])
+
+    def compile_uris(self, code: str) -> List[str | None] | None:
+        """Return the URIs of all the images of the document with a strategy,
+        built in one pass over the columns of the pages, or None if they
+        depend on the Image Information of each image."""
+        if self.needs_image_information(code):
+            return None
+        strategy = strategy_codes[code]
+        pages = self.pages
+        strings = pages.strings
+        uris: List[str | None] = []
+        for cnt in range(len(pages)):
+            # The width of '-w <width>' replaces the width of the page
+            width = self.width if isinstance(self.width, int) and \
+                self.width != 0 else pages.get_size("w", pages.widths, cnt)
+            for i in range(pages.offsets[cnt], pages.offsets[cnt + 1]):
+                base = strategy.get_base(
+                    strings[pages.ids[i]], strings[pages.service_ids[i]])
+                uris.append(None if base is None else strategy.get_uri(
+                    base, width, strings[pages.exts[i]]))
+        return uris
+
+    def get_compiled_uri(self, strategy: ResolvedStrategy, cnt: int,
+                         n: int) -> str | None:
+        """Return the URI of the n-th image of a page with the successful
+        strategy, if it has been compiled."""
+        if strategy.uris is None:
+            return None
+        return strategy.uris[self.pages.offsets[cnt] + n]
+
+    def plan_collection(self, d: Dict[str, Any], plan: TextIO) -> None:
+        """Write the download plan of the manifests of a collection, one
+        after the other."""
+        crawler = CollectionCrawler(self.referer, self.max_depth)
+        crawler.start(d, self.json_file, self.stop_event)
+        self.shard_pages = False  # the manifests are split between shards
+        self.stats = DownloadStats()
+        while not self.stop_event.is_set():
+            manifest_id = self.get_shard_manifest_id(crawler, block=True)
+            if manifest_id is None:
+                if crawler.finished:
+                    break
+                continue
+            try:
+                document_downloader = self.make_document_downloader()
+                document = self.open_json_document(manifest_id)
+                if "@context" in document:
+                    document_downloader.get_iiif_version(document)
+                document_downloader.plan_manifest(document, plan)
+            except Exception as e:
+                logging.error(
+                    "\033[91mCannot read manifest %s (%s)\033[0m",
+                    manifest_id, str(e))
 
-    def download_iiif_files_from_collection(self, d: Dict[str, Any]) -> None:
-        """Download all the files from a collection of manifests."""
-        if self.version == 2:
-            manifests_key = "manifests"
-            id_key = "@id"
+        if crawler.manifests_cnt == 0 and not self.stop_event.is_set():
+            raise Exception("Cannot find manifests in collection")
+
+    def plan_manifest(self, d: Dict[str, Any], plan: TextIO) -> None:
+        """Write the download plan of the pages of a manifest. The strategy
+        is found probing the first page, the URIs of the other pages are
+        built with it."""
+        if not self.read_manifest(d):
+            return
+        self.select_pages()
+
+        directory = sanitize_name(self.manifest_label)
+        images_cnt = 0
+        for cnt in range(len(self.pages)):
+            if self.stop_event.is_set():
+                break
+            if not self.is_page_in_shard(cnt):
+                continue
+            page = self.prepare_page(cnt)
+            if page is None:
+                continue
+            for n in range(len(page.id)):
+                filename = self.get_image_filename(page, cnt, n)
+                code, uri = self.plan_image(page, cnt, n)
+                plan.write(json.dumps({
+                    "manifest": self.get_catalog_key(),
+                    "directory": directory,
+                    "page": cnt + self.firstpage,
+                    "label": page.label,
+                    "file": filename,
+                    "uri": uri,
+                    "strategy": code,
+                    "ext": page.ext[n],
+                    "width": page.w,
+                    "height": page.h}) + "\n")
+                images_cnt += 1
+        logging.info(
+            "Plan of %s: %s images, strategy %s", self.manifest_label,
+            str(images_cnt),
+            self.strategy.codes[0] if self.strategy is not None else "none")
+
+    def plan_image(self, page: Page, cnt: int, n: int
+                   ) -> Tuple[str | None, str | None]:
+        """Return the strategy and the URI of the n-th image of a page, or
+        None if no strategy has been found. The strategy is looked for if it
+        has not been found with the previous pages."""
+        if self.strategy is None:
+            self.probe_strategy(page, n)
+        strategy = self.strategy
+        if strategy is None:
+            return None, None
+        uri = self.get_compiled_uri(strategy, cnt, n)
+        if uri is not None:
+            return strategy.codes[0], uri
+        # The URIs that depend on the Image Information, or the fallbacks
+        for code, uri in self.get_candidate_uris(page, n, strategy.codes):
+            return code, uri
+        return None, None
+
+    def probe_strategy(self, page: Page, n: int) -> None:
+        """Look for the download strategy probing the URIs of the n-th image
+        of a page in order of priority, without downloading it, and publish
+        the successful one."""
+        codes = self.get_discovery_strategies()
+        cache_key = get_strategy_cache_key(page, n)
+
+        failed: List[str] = []
+        if self.parallel_discovery:
+            raced_codes = self.race_strategies(page, n, codes)
+            failed = [
+                code for code in codes[:len(codes) - len(raced_codes)]
+                if self.is_attempted(page, n, code)]
+            codes = raced_codes
+
+        for nc, code in enumerate(codes):
+            start_time = time.monotonic()
+            img_uri = self.get_candidate_uri(page, n, code)
+            if img_uri is not None and probe_file(img_uri, self.referer):
+                self.publish_strategy(
+                    codes[nc:], failed, cache_key,
+                    time.monotonic() - start_time)
+                return
+            if self.is_attempted(page, n, code):
+                failed.append(code)
+        self.failed_strategies.update(failed)
+
+    def download_plan_directory(self, directory: str) -> None:
+        """Download the images of the plan of one document in its
+        directory."""
+        subdir = self.maindir + "/" + directory
+        if not os.path.exists(subdir):
+            os.mkdir(subdir)
+            logging.debug("%s created in %s", directory, self.maindir)
+        self.manifest_label = directory
+        self.manifest_id = str(self.plan_entries[0]["manifest"])
+        self.stats = DownloadStats()
+        self.journal = DownloadJournal(subdir)
+        logging.info("Document: %s", directory)
+
+        start_time = time.time()
+        counters = self.get_shared_counters()
+        concurrency = ""
+        tot_images = len(self.plan_entries)
+        if self.num_threads == 1:
+            for cnt in range(tot_images):
+                if self.stop_event.is_set():
+                    break
+                self.download_planned_image(cnt, subdir)
         else:
-            manifests_key = "items"
-            id_key = "id"
+            concurrency = self.download_pages_in_parallel(
+                0, tot_images, subdir, self.download_planned_image)
+
+        self.finish_manifest(subdir, start_time, counters, concurrency)
+
+    def download_planned_image(self, cnt: int, subdir: str) -> None:
+        """Download one image of the plan given its position in the plan of
+        the document."""
+        entry = self.plan_entries[cnt]
+        filename = str(entry["file"])
+        filepath = subdir + "/" + filename
+        # Position of the page in the range of pages
+        page_cnt = int(entry["page"]) - self.firstpage
+        logging.info(
+            "[n.%s] Label: %s", str(entry["page"]), str(entry["label"]))
+        if self.skip_existing_file(filepath, page_cnt):
+            return
 
-        manifests = d.get(manifests_key)
-        if manifests:
-            logging.info(
-                "%s manifests found in the collection", str(len(manifests)))
-            for m in manifests:
-                manifest_id = m.get(id_key)
-                response = open_url(manifest_id, self.referer)
-                if response is not None:
-                    d = json.loads(response.read().decode("utf-8"))
-                    self.download_iiif_files_from_manifest(d)
-                    self.pages.clear()
-                else:
-                    raise Exception(
-                        "Cannot read remote manifest " + manifest_id)
+        filesize = -1
+        checksum = FileChecksum()
+        if entry["uri"]:
+            filesize = download_file(
+                entry["uri"], filepath, self.referer, checksum=checksum)
+        if filesize > 0 and self.journal is not None:
+            self.journal.add(
+                int(entry["page"]), filename, entry["uri"],
+                str(entry["strategy"]), filesize, checksum.hexdigest())
+        self.count_image(filesize, page_cnt, filename, subdir)
+
+    def download_iiif_files_from_collection(self, d: Dict[str, Any]) -> None:
+        """Download all the files from a collection of manifests. The nested
+        collections are crawled and the next manifests are read while the
+        pages of the current ones are downloaded by threads shared by all the
+        documents."""
+        crawler = CollectionCrawler(self.referer, self.max_depth)
+        crawler.start(d, self.json_file, self.stop_event)
+        self.shard_pages = False  # the manifests are split between shards
+        self.stats = DownloadStats()
+        self.collection_pages_cnt = 0
+        controller = None
+        if self.num_threads > 0:
+            max_workers = self.num_threads
         else:
-            raise Exception(
-                "Cannot find manifests ('" + manifests_key +
-                "') in collection")
+            # The number of threads is set by the controller
+            controller = ConcurrencyController(maximum=max_auto_threads)
+            max_workers = max_auto_threads
+        max_queued = 2 * max_workers
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        reader = ThreadPoolExecutor(max_workers=self.documents_in_flight)
+        fetched: Deque[Future[DocumentDownload | None]] = deque()
+        documents: List[DocumentDownload] = []
+        queued: Dict[Future[None], Tuple[DocumentDownload, int]] = {}
+        try:
+            while not self.stop_event.is_set():
+                # Read the next manifests, as soon as they are found
+                while len(fetched) + len(documents) < \
+                        self.documents_in_flight:
+                    manifest_id = self.get_shard_manifest_id(
+                        crawler, block=not (fetched or documents))
+                    if manifest_id is None:
+                        break
+                    fetched.append(reader.submit(
+                        self.read_collection_manifest, manifest_id))
+
+                # Start the documents in the order of the collection
+                while fetched and fetched[0].done():
+                    document = self.start_document(fetched.popleft())
+                    if document is not None:
+                        documents.append(document)
+                if not (fetched or documents):
+                    if crawler.finished:
+                        break
+                    continue
+
+                # Queue the pages, the ones of the first documents first
+                for document in documents:
+                    while len(queued) < max_queued and document.can_queue():
+                        if controller is not None and \
+                                not self.acquire_download(controller):
+                            break
+                        cnt = document.next_cnt
+                        document.next_cnt += 1
+                        document.queued_cnt += 1
+                        if controller is None:
+                            future = executor.submit(
+                                document.downloader.download_single_page,
+                                cnt, document.subdir)
+                        else:
+                            future = executor.submit(
+                                document.downloader.download_controlled_page,
+                                cnt, document.subdir, controller)
+                        queued[future] = (document, cnt)
+
+                # Wait for a page or for the next manifest
+                self.collect_document_pages(queued, fetched)
+                for document in [doc for doc in documents
+                                 if doc.is_complete()]:
+                    documents.remove(document)
+                    self.finish_document(document, controller)
+
+            if crawler.manifests_cnt == 0 and not self.stop_event.is_set():
+                raise Exception("Cannot find manifests in collection")
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            # Nothing is left in the queue if the download has been stopped
+            executor.shutdown(cancel_futures=True)
+            reader.shutdown(cancel_futures=True)
+            while queued:
+                self.collect_document_pages(queued, deque())
+            for document in documents:
+                self.finish_document(document, controller)
+
+    def read_collection_manifest(self, manifest_id: str
+                                 ) -> DocumentDownload | None:
+        """Read and parse a manifest of the collection. Return None if it has
+        no pages."""
+        document_downloader = self.make_document_downloader()
+        d = self.open_json_document(manifest_id)
+        if "@context" in d:
+            document_downloader.get_iiif_version(d)
+        subdir = document_downloader.prepare_manifest(d)
+        if subdir is None:
+            return None
+        return DocumentDownload(document_downloader, subdir)
+
+    def make_document_downloader(self) -> "IIIF_Downloader":
+        """Return the downloader of one document of the collection, sharing
+        the user configuration, the caches and the stop event."""
+        document_downloader = copy(self)
+        document_downloader.pages = PageTable()
+        document_downloader.collection_stats = self.stats
+        document_downloader.stats = DownloadStats(self.stats)
+        document_downloader.strategy = None
+        document_downloader.failed_strategies = set()
+        document_downloader.discovery_lock = Lock()
+        return document_downloader
+
+    def start_document(self, future: Future[DocumentDownload | None]
+                       ) -> DocumentDownload | None:
+        """Start the download of a manifest that has been read."""
+        try:
+            document = future.result()
+        except Exception as e:
+            logging.error("\033[91mCannot read manifest (%s)\033[0m", str(e))
+            self.stats.add_failed()
+            return None
+        if document is not None:
+            document.start()
+            self.collection_pages_cnt += len(document.downloader.pages)
+        return document
+
+    def collect_document_pages(
+            self, queued: Dict[Future[None], Tuple[DocumentDownload, int]],
+            fetched: Deque[Future[DocumentDownload | None]]) -> None:
+        """Wait for some queued pages to be downloaded, or for the next
+        manifest to be read, and count the unexpected errors as failed
+        downloads."""
+        waiting: List[Future[Any]] = list(queued)
+        if fetched:
+            waiting.append(fetched[0])
+        done, _ = wait(waiting, timeout=0.5, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future not in queued:
+                continue
+            document, cnt = queued.pop(future)
+            document.queued_cnt -= 1
+            if future.cancelled():
+                continue
+            e = future.exception()
+            if e is not None:
+                logging.error(
+                    "\033[91mCannot download page n.%s (%s)\033[0m",
+                    str(cnt + self.firstpage), str(e))
+                document.downloader.stats.add_failed()
+
+    def finish_document(self, document: DocumentDownload,
+                        controller: ConcurrencyController | None) -> None:
+        """Print the statistics of a document of the collection."""
+        document.downloader.finish_manifest(
+            document.subdir, document.start_time, document.counters,
+            controller.report() if controller is not None else "")
+
+    async def async_download_iiif_files_from_collection(
+            self, d: Dict[str, Any]) -> None:
+        """Download all the files from a collection of manifests with asyncio
+        tasks, one manifest after the other, while the nested collections
+        are crawled."""
+        crawler = CollectionCrawler(self.referer, self.max_depth)
+        crawler.start(d, self.json_file, self.stop_event)
+        self.shard_pages = False  # the manifests are split between shards
+        # The counters of the documents are added to the ones of the
+        # collection
+        collection_stats = DownloadStats()
+        self.collection_stats = collection_stats
+        while not self.stop_event.is_set():
+            manifest_id = await asyncio.to_thread(
+                self.get_shard_manifest_id, crawler, True)
+            if manifest_id is None:
+                if crawler.finished:
+                    break
+                continue
+            d = await self.async_open_json_document(manifest_id)
+            if "@context" in d:
+                self.get_iiif_version(d)
+            await self.async_download_iiif_files_from_manifest(d)
+            self.pages.clear()
+        self.stats = collection_stats
+        self.collection_stats = None
+
+        if crawler.manifests_cnt == 0 and not self.stop_event.is_set():
+            raise Exception("Cannot find manifests in collection")
 
     def read_iiif_manifest2(self, d: Dict[str, Any]) -> None:
         """Download all the files from a 2.0/2.1 manifest."""
@@ -729,91 +4614,99 @@ is read", str(len(sequences)))
         assert canvases is not None, \
             "Canvases ('canvases') not found" + issue_str
 
-        for nc, c in enumerate(canvases):
-            debug_check("canvas type", c.get("@type"), "sc:Canvas")
-
-            # "A canvas must have an id"
-            debug_check("canvas ID", c.get("@id"))
-
-            # Create an empty Page node
-            p = Page()
-
-            # Read label, width and height
-            label = c.get("label")
-            iiif_w = c.get("width")
-            if isinstance(iiif_w, str):
-                iiif_w = int(iiif_w)
-            iiif_h = c.get("height")
-            if isinstance(iiif_h, str):
-                iiif_h = int(iiif_h)
-            # "Every canvas must have a label to display, and a height and a
-            # width as integers"
-            debug_check("canvas label", label)
-            debug_check("canvas width", iiif_w)
-            debug_check("canvas height", iiif_h)
-            p.label = sanitize_label(label, "canvas " + str(nc))
-            p.w = iiif_w
-            p.h = iiif_h
-
-            # Read images
-            images = c.get("images")
-            if images:
-                if len(images) > 1:
-                    logging.debug(
-                        "There are %s images in canvas %s", str(len(images)),
-                        str(nc))
-
-                id_list = []
-                ext_list = []
-                service_id_list = []
-                for img in images:
-                    # "All resources must have a type specified [...]
-                    # Association of images with their respective canvases is
-                    # done via annotations"
-                    debug_check(
-                        "image type", img.get("@type"), "oa:Annotation")
-                    # "Each association of a content resource must have the
-                    # motivation field and the value must be “sc:painting”"
-                    debug_check(
-                        "image motivation", img.get("motivation"),
-                        "sc:painting")
-
-                    resource = img.get("resource")
-                    # If resource has multiple images (choice), take just the
-                    # default one
-                    if resource.get("@type") == "oa:Choice":
-                        resource = resource.get("default")
-                        logging.debug(
-                            "The image in canvas %s has multiple choices, but \
-only the default one is read", str(nc))
+        # Read the canvases in the page range only (the others may be None
+        # if they have been skipped while parsing the manifest)
+        self.orig_num_pages = len(canvases)
+        for nc in self.get_canvas_range(len(canvases)):
+            # The canvases may have been read while parsing the manifest
+            c = canvases[nc]
+            self.pages.append(c if isinstance(c, Page) else
+                              self.read_canvas2(c, nc))
 
-                    iiif_id = resource.get("@id")
-                    # "The image must have an @id field"
-                    assert iiif_id is not None, \
-                        "Image ID ('@id') not found" + issue_str
+        self.manifest_label = manifest_label
+        self.manifest_id = manifest_id
 
-                    iiif_format = resource.get("format")
-                    ext = get_extension(iiif_format, iiif_id, nc)
+    def read_canvas2(self, c: Any, nc: int) -> Page:
+        """Return the page of a 2.0/2.1 canvas."""
+        debug_check("canvas type", c.get("@type"), "sc:Canvas")
+
+        # "A canvas must have an id"
+        debug_check("canvas ID", c.get("@id"))
+
+        # Create an empty Page node
+        p = Page()
+
+        # Read label, width and height
+        label = c.get("label")
+        iiif_w = c.get("width")
+        if isinstance(iiif_w, str):
+            iiif_w = int(iiif_w)
+        iiif_h = c.get("height")
+        if isinstance(iiif_h, str):
+            iiif_h = int(iiif_h)
+        # "Every canvas must have a label to display, and a height and a
+        # width as integers"
+        debug_check("canvas label", label)
+        debug_check("canvas width", iiif_w)
+        debug_check("canvas height", iiif_h)
+        p.label = sanitize_label(label, "canvas " + str(nc))
+        p.w = iiif_w
+        p.h = iiif_h
+
+        # Read images
+        images = c.get("images")
+        if images:
+            if len(images) > 1:
+                logging.debug(
+                    "There are %s images in canvas %s", str(len(images)),
+                    str(nc))
+
+            id_list = []
+            ext_list = []
+            service_id_list = []
+            for img in images:
+                # "All resources must have a type specified [...]
+                # Association of images with their respective canvases is
+                # done via annotations"
+                debug_check(
+                    "image type", img.get("@type"), "oa:Annotation")
+                # "Each association of a content resource must have the
+                # motivation field and the value must be “sc:painting”"
+                debug_check(
+                    "image motivation", img.get("motivation"),
+                    "sc:painting")
+
+                resource = img.get("resource")
+                # If resource has multiple images (choice), take just the
+                # default one
+                if resource.get("@type") == "oa:Choice":
+                    resource = resource.get("default")
+                    logging.debug(
+                        "The image in canvas %s has multiple choices, "
+                        "but only the default one is read", str(nc))
 
-                    service = resource.get("service")
-                    if service is not None:
-                        service_id = service.get("@id")
-                    else:
-                        service_id = None
+                iiif_id = resource.get("@id")
+                # "The image must have an @id field"
+                assert iiif_id is not None, \
+                    "Image ID ('@id') not found" + issue_str
 
-                    id_list.append(iiif_id)
-                    ext_list.append(ext)
-                    service_id_list.append(service_id)
+                iiif_format = resource.get("format")
+                ext = get_extension(iiif_format, iiif_id, nc)
 
-                p.id = id_list
-                p.ext = ext_list
-                p.service_id = service_id_list
+                service = resource.get("service")
+                if service is not None:
+                    service_id = service.get("@id")
+                else:
+                    service_id = None
 
-            # Append info to info list
-            self.pages.append(p)
+                id_list.append(iiif_id)
+                ext_list.append(ext)
+                service_id_list.append(service_id)
 
-        self.manifest_label = manifest_label
-        self.manifest_id = manifest_id
+            p.id = id_list
+            p.ext = ext_list
+            p.service_id = service_id_list
+        return p
 
     def read_iiif_manifest3(self, d: Dict[str, Any]) -> None:
         """Download all the files from a 3.0 manifest."""
@@ -852,144 +4745,181 @@ only the default one is read", str(nc))
         assert canvases is not None, \
             "Manifest canvases ('items') not found" + issue_str
 
-        for nc, c in enumerate(canvases):
-            debug_check("canvas type", c.get("type"), "Canvas")
-
-            # "Canvases must be identified by a URI"
-            debug_check("canvas ID", c.get("id"))
-
-            # Create empty Page node
-            p = Page()
-
-            # Read canvas label
-            label = c.get("label", "NA")
-            if label != "NA":
-                # "A Canvas should have the label property [...] The value must
-                # be a JSON object"
-                assert isinstance(label, dict), \
-                    "Canvas label is not a JSON object" + issue_str
-                label = first_value(label)  # Take first value
-                label = str(label[0])
-            p.label = label
-
-            # "A Canvas must have a rectangular aspect ratio"
-            debug_check("canvas height", c.get("height"))
-            debug_check("canvas width", c.get("width"))
-
-            # Read annotation page
-            annotation_page = c.get("items")
-            # "A Canvas should have the items property with at least one item.
-            # Each item must be an Annotation Page"
-            debug_check("annotation page ('items')", annotation_page)
-            if annotation_page:
-                # [Assumption #1] One annotation page in canvas
-                if len(annotation_page) > 1:
-                    logging.debug(
-                        "There are %s annotation pages in canvas %s, but only \
-the first one is read", str(len(annotation_page)), str(nc))
-                annotation_page = annotation_page[0]
-                debug_check(
-                    "annotation page type", annotation_page.get("type"),
-                    "AnnotationPage")
-
-                # "Annotation Pages must have the id"
-                debug_check("annotation page ID", annotation_page.get("id"))
-
-                # Read annotation
-                annotation = annotation_page.get("items")
-                # "An Annotation Page should have the items property with at
-                # least one item. Each item must be an Annotation"
-                debug_check("annotation ('items')", annotation)
-                if annotation:
-                    # [Assumption #2] One annotation in annotation page
-                    if len(annotation) > 1:
-                        logging.debug(
-                            "There are %s annotation in the annotation page \
-of canvas %s, but only the first one is read", str(len(annotation)), str(nc))
-                    annotation = annotation[0]
-                    debug_check(
-                        "annotation type", annotation.get("type"),
-                        "Annotation")
-
-                    # "Annotations must have their own HTTP(S) URIs, conveyed
-                    # in the id property"
-                    debug_check("annotation ID", annotation.get("id"))
-                    # Content [...] must be associated by an Annotation that
-                    # has the motivation value painting"
-                    debug_check(
-                        "annotation motivation", annotation.get("motivation"),
-                        "painting")
-
-                    # Read body or body.source for "specific resources"
-                    body = annotation.get("body")
-                    body_type = body.get("type")
-                    if body_type == "Image":
-                        source = body
-                    elif body_type == "SpecificResource":
-                        source = body.get("source")
-                    else:
-                        raise Exception(
-                            "Unsupported body type: " + body_type + issue_str)
-
-                    # Read image ID, extension, dimensions and service ID
-                    iiif_id = source.get("id")
-                    p.id = [iiif_id]
-                    iiif_format = source.get("format")
-                    p.ext = [get_extension(iiif_format, iiif_id, nc)]
-                    iiif_w = source.get("width")
-                    if isinstance(iiif_w, str):
-                        iiif_w = int(iiif_w)
-                    p.w = iiif_w
-                    iiif_h = source.get("height")
-                    if isinstance(iiif_h, str):
-                        iiif_h = int(iiif_h)
-                    p.h = iiif_h
-                    service = source.get("service")
-                    if service is not None:
-                        if isinstance(service, list):
-                            service = service[0]
-                        p.service_id = [service.get("id")]
-                        if p.service_id == [None]:
-                            # "The @id property may be used in service objects
-                            # for backwards compatibility"
-                            p.service_id = [service.get("@id")]
-                    else:
-                        p.service_id = [None]
-
-            # Append info to list
-            self.pages.append(p)
+        # Read the canvases in the page range only (the others may be None
+        # if they have been skipped while parsing the manifest)
+        self.orig_num_pages = len(canvases)
+        for nc in self.get_canvas_range(len(canvases)):
+            # The canvases may have been read while parsing the manifest
+            c = canvases[nc]
+            self.pages.append(c if isinstance(c, Page) else
+                              self.read_canvas3(c, nc))
 
         self.manifest_label = manifest_label
         self.manifest_id = manifest_id
 
+    def read_canvas3(self, c: Any, nc: int) -> Page:
+        """Return the page of a 3.0 canvas."""
+        debug_check("canvas type", c.get("type"), "Canvas")
+
+        # "Canvases must be identified by a URI"
+        debug_check("canvas ID", c.get("id"))
+
+        # Create empty Page node
+        p = Page()
+
+        # Read canvas label
+        label = c.get("label", "NA")
+        if label != "NA":
+            # "A Canvas should have the label property [...] The value must
+            # be a JSON object"
+            assert isinstance(label, dict), \
+                "Canvas label is not a JSON object" + issue_str
+            label = first_value(label)  # Take first value
+            label = str(label[0])
+        p.label = label
+
+        # "A Canvas must have a rectangular aspect ratio"
+        debug_check("canvas height", c.get("height"))
+        debug_check("canvas width", c.get("width"))
+
+        # Read annotation page
+        annotation_page = c.get("items")
+        # "A Canvas should have the items property with at least one item.
+        # Each item must be an Annotation Page"
+        debug_check("annotation page ('items')", annotation_page)
+        if annotation_page:
+            # [Assumption #1] One annotation page in canvas
+            if len(annotation_page) > 1:
+                logging.debug(
+                    "There are %s annotation pages in canvas %s, "
+                    "but only the first one is read",
+                    str(len(annotation_page)), str(nc))
+            annotation_page = annotation_page[0]
+            debug_check(
+                "annotation page type", annotation_page.get("type"),
+                "AnnotationPage")
+
+            # "Annotation Pages must have the id"
+            debug_check("annotation page ID", annotation_page.get("id"))
+
+            # Read annotation
+            annotation = annotation_page.get("items")
+            # "An Annotation Page should have the items property with at
+            # least one item. Each item must be an Annotation"
+            debug_check("annotation ('items')", annotation)
+            if annotation:
+                # [Assumption #2] One annotation in annotation page
+                if len(annotation) > 1:
+                    logging.debug(
+                        "There are %s annotation in the annotation page "
+                        "of canvas %s, but only the first one is read",
+                        str(len(annotation)), str(nc))
+                annotation = annotation[0]
+                debug_check(
+                    "annotation type", annotation.get("type"),
+                    "Annotation")
+
+                # "Annotations must have their own HTTP(S) URIs, conveyed
+                # in the id property"
+                debug_check("annotation ID", annotation.get("id"))
+                # Content [...] must be associated by an Annotation that
+                # has the motivation value painting"
+                debug_check(
+                    "annotation motivation", annotation.get("motivation"),
+                    "painting")
+
+                # Read body or body.source for "specific resources"
+                body = annotation.get("body")
+                body_type = body.get("type")
+                if body_type == "Image":
+                    source = body
+                elif body_type == "SpecificResource":
+                    source = body.get("source")
+                else:
+                    raise Exception(
+                        "Unsupported body type: " + body_type + issue_str)
+
+                # Read image ID, extension, dimensions and service ID
+                iiif_id = source.get("id")
+                p.id = [iiif_id]
+                iiif_format = source.get("format")
+                p.ext = [get_extension(iiif_format, iiif_id, nc)]
+                iiif_w = source.get("width")
+                if isinstance(iiif_w, str):
+                    iiif_w = int(iiif_w)
+                p.w = iiif_w
+                iiif_h = source.get("height")
+                if isinstance(iiif_h, str):
+                    iiif_h = int(iiif_h)
+                p.h = iiif_h
+                service = source.get("service")
+                if service is not None:
+                    if isinstance(service, list):
+                        service = service[0]
+                    p.service_id = [service.get("id")]
+                    if p.service_id == [None]:
+                        # "The @id property may be used in service objects
+                        # for backwards compatibility"
+                        p.service_id = [service.get("@id")]
+                else:
+                    p.service_id = [None]
+        return p
+
     def check_image_information_width(self, path: str, page: Page) -> None:
         """Look for the Image Information from a path, look for the width in it
         and use it instead of the manifest's width if it's bigger."""
         img_information_uri = sanitize_uri(path) + "/info.json"
         try:
-            img_information_file = open_json_file(
-                img_information_uri, self.referer)
-            try:
-                img_information_w = img_information_file.get("width")
-                if isinstance(img_information_w, int):
-                    if page.w is None:
-                        page.w = img_information_w
-                        logging.debug(
-                            "Using Image Information width (%s)",
-                            str(img_information_w))
-                    else:
-                        if img_information_w > page.w:
-                            logging.debug(
-                                "Using Image Information width (%s) instead \
-of the manifest width (%s)", str(img_information_w), str(page.w))
-                            page.w = img_information_w
-            except Exception as e:
-                logging.warning("Exception: %s", str(e))
-                logging.debug("'width' not found in %s", img_information_uri)
+            img_information_file = self.image_information_cache.get(
+                path, self.referer)
+        except Exception as e:
+            logging.warning("Exception: %s", str(e))
+            logging.debug(
+                "Cannot access info.json file at %s", img_information_uri)
+            return
+        self.use_image_information_width(
+            img_information_file, img_information_uri, page)
+
+    async def async_check_image_information_width(self, path: str,
+                                                  page: Page) -> None:
+        """Look for the Image Information from a path with asyncio, look for
+        the width in it and use it instead of the manifest's width if it's
+        bigger."""
+        img_information_uri = sanitize_uri(path) + "/info.json"
+        try:
+            img_information_file = \
+                await self.image_information_cache.async_get(
+                    path, self.referer)
         except Exception as e:
             logging.warning("Exception: %s", str(e))
             logging.debug(
                 "Cannot access info.json file at %s", img_information_uri)
+            return
+        self.use_image_information_width(
+            img_information_file, img_information_uri, page)
+
+    def use_image_information_width(self, img_information_file: Dict[str, Any],
+                                    img_information_uri: str,
+                                    page: Page) -> None:
+        """Use the width of the Image Information instead of the manifest's
+        width if it's bigger."""
+        try:
+            img_information_w = img_information_file.get("width")
+            if isinstance(img_information_w, int):
+                if page.w is None:
+                    page.w = img_information_w
+                    logging.debug(
+                        "Using Image Information width (%s)",
+                        str(img_information_w))
+                else:
+                    if img_information_w > page.w:
+                        logging.debug(
+                            "Using Image Information width (%s) instead of \
+the manifest width (%s)", str(img_information_w), str(page.w))
+                        page.w = img_information_w
+        except Exception as e:
+            logging.warning("Exception: %s", str(e))
+            logging.debug("'width' not found in %s", img_information_uri)
 
     def get_iiif_version(self, d: Dict[str, Any]) -> None:
         """Check IIIF version from a manifest or a collection."""
@@ -1046,13 +4976,36 @@ def get_pages(pages: str) -> List[int]:
     return [first_page, last_page]
 
 
+def get_threads(threads: str) -> int:
+    """Return the number of threads given one string ('auto': 0)."""
+    if threads == "auto":
+        return 0
+    num_threads = int(threads)
+    if num_threads < 1:
+        raise ValueError("Invalid number of threads")
+    return num_threads
+
+
+def get_shard(shard: str) -> List[int]:
+    """Return the shard and the number of shards as integers given one
+    string."""
+    # Two positive numbers separated by /
+    pattern = r"^([1-9]\d*)/([1-9]\d*)$"
+    if not match(pattern, shard):
+        raise argparse.ArgumentTypeError("Invalid shard (invalid format)")
+    index, shards = map(int, shard.split("/"))
+    if index > shards:
+        raise argparse.ArgumentTypeError("Invalid shard (invalid shards)")
+    return [index, shards]
+
+
 def set_parser() -> argparse.ArgumentParser:
     """Set parser options."""
     parser_ = argparse.ArgumentParser(add_help=False)
 
     general = parser_.add_argument_group("General options")
     general.add_argument(
-        "-m", metavar="<file>", required=True,
+        "-m", metavar="<file>",
         help="Manifest or collection of manifests (local file or url)")
     general.add_argument(
         "-d", metavar="<path>", default=".",
@@ -1067,8 +5020,24 @@ the host")
     general.add_argument(
         "-r", metavar="<referer>", help="Referer of the HTTP requests header")
     general.add_argument(
-        "-t", metavar="<threads>", default=1, type=int,
-        help="Number of threads")
+        "-t", metavar="<threads>", default=1, type=get_threads,
+        help="Number of threads, or 'auto' to adapt it to the servers")
+    general.add_argument(
+        "--segments", metavar="<segments>", default=1, type=int,
+        help="Download each large file in segments at the same time, if the \
+server supports range requests")
+    general.add_argument(
+        "--retries", metavar="<retries>", default=4, type=int,
+        help="Maximum number of retries of a request after a transient error \
+(e.g. 429 Too Many Requests)")
+    general.add_argument(
+        "--rate", metavar="<requests/s>", default=0, type=float,
+        help="Maximum number of requests per second sent to each host (0: no \
+limit)")
+    general.add_argument(
+        "--burst", metavar="<requests>", default=1, type=int,
+        help="Number of requests that can be sent at once to a host, within \
+the --rate limit")
     general.add_argument(
         "-j", metavar="<file>",
         help="Export the document metadata in a .json file")
@@ -1082,6 +5051,58 @@ the host")
         "--all-images", action="store_true",
         help="Download all the images related to the same page in 2.0/2.1 \
 manifests, not just the first one")
+    general.add_argument(
+        "--documents", metavar="<documents>", default=2, type=int,
+        help="Number of manifests of a collection read or downloaded at the \
+same time")
+    general.add_argument(
+        "--depth", metavar="<depth>", default=10, type=int,
+        help="Maximum depth of the collections nested in a collection")
+    general.add_argument(
+        "--parallel-discovery", action="store_true",
+        help="Probe all the download strategies at the same time with the \
+first page")
+    general.add_argument(
+        "--strategy-cache", metavar="<file>",
+        help="Save the download strategies of the image servers in a .json \
+file and use them in the following runs")
+    general.add_argument(
+        "--async", action="store_true", dest="use_async",
+        help="Download with asyncio tasks instead of threads (-t is the \
+number of tasks)")
+    general.add_argument(
+        "--info-cache", metavar="<dir>",
+        help="Save the Image Information files in a directory and use them \
+in the following runs")
+    general.add_argument(
+        "--http-cache", metavar="<dir>",
+        help="Save the manifests, the collections and the Image Information \
+files in a directory, and read them again only when they are stale")
+    general.add_argument(
+        "--http-cache-size", metavar="<MB>", default=256, type=int,
+        help="Maximum size of the --http-cache directory; the least recently \
+used files are deleted")
+    general.add_argument(
+        "--sync", metavar="<catalog>", dest="sync_catalog",
+        help="Download only the new or modified images, using the validators \
+saved in a SQLite catalog by the previous runs")
+    general.add_argument(
+        "--plan", metavar="<file>",
+        help="Write the URI, the file name and the dimensions of each image \
+in a JSON Lines file, probing only the first page, without downloading")
+    general.add_argument(
+        "--from-plan", metavar="<file>",
+        help="Download the images listed in a file written with --plan, \
+without reading the manifests")
+    general.add_argument(
+        "--shard", metavar="<i>/<N>", default=[1, 1], type=get_shard,
+        help="Download only the i-th of N disjoint shards of the pages (or of \
+the manifests of a collection), for N processes sharing the output \
+directory")
+    general.add_argument(
+        "--merge-shards", action="store_true",
+        help="Merge the statistics of the shards in the output directory and \
+check that the download of each document is complete")
     general.add_argument(
         "-h", "--help", action="help",
         help="Print this help message and exit")
@@ -1108,13 +5129,36 @@ if __name__ == "__main__":
     logging.basicConfig(
         level=parser_args["logging_level"], format="%(message)s")
 
+    # Check the download of the shards
+    if parser_args["merge_shards"]:
+        if not merge_shard_stats(parser_args["d"]):
+            parser.exit(1)
+        parser.exit()
+
+    # The manifest is not read when the plan is given
+    if parser_args["m"] is None and parser_args["from_plan"] is None:
+        parser.error("the following arguments are required: -m")
+
     # Create IIIF Downloader class
     firstpage, lastpage = get_pages(parser_args["p"])
     downloader = IIIF_Downloader(
         parser_args["m"], parser_args["d"], firstpage, lastpage,
         parser_args["force"], parser_args["use_labels"],
         parser_args["all_images"], parser_args["w"], parser_args["r"],
-        parser_args["t"], parser_args["j"])
+        parser_args["t"], parser_args["j"],
+        parser_args["parallel_discovery"], parser_args["strategy_cache"],
+        parser_args["info_cache"], parser_args["retries"],
+        parser_args["rate"], parser_args["burst"], parser_args["documents"],
+        parser_args["depth"], parser_args["segments"],
+        parser_args["sync_catalog"], parser_args["http_cache"],
+        parser_args["http_cache_size"], *parser_args["shard"])
 
     # Run IIIF Downloader
-    downloader.run()
+    if parser_args["plan"]:
+        downloader.plan(parser_args["plan"])
+    elif parser_args["from_plan"]:
+        downloader.run_plan(parser_args["from_plan"])
+    elif parser_args["use_async"]:
+        asyncio.run(downloader.run_async())
+    else:
+        downloader.run()
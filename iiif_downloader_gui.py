@@ -210,10 +210,16 @@ class GUI:
         self.cbtn_log.pack(side="left")
         self.ent_log.pack(fill="x")
 
-        # Download button
+        # Download and stop buttons
+        buttons_frame = ttk.Frame(master=frame)
+        buttons_frame.grid(row=11, column=0, columnspan=2, padx=0, pady=5)
         self.btn_download = ttk.Button(
-            master=frame, text="Download document", command=self.run)
-        self.btn_download.grid(row=11, column=0, columnspan=2, padx=0, pady=5)
+            master=buttons_frame, text="Download document", command=self.run)
+        self.btn_stop = ttk.Button(
+            master=buttons_frame, text="Stop", command=self.stop,
+            state="disabled")
+        self.btn_download.pack(side="left")
+        self.btn_stop.pack(side="left", padx=(5, 0))
 
         # Progress bar
         progress_bar_frame = ttk.Frame(master=frame)
@@ -311,7 +317,8 @@ class GUI:
                 sleep(0.5)
 
                 # Update progress bar
-                tot_pages = len(self.downloader.pages)
+                tot_pages = self.downloader.collection_pages_cnt or \
+                    len(self.downloader.pages)
                 if tot_pages != 0:
                     tot_cnt = self.downloader.downloaded_cnt + \
                         self.downloader.skipped_cnt + \
@@ -325,6 +332,7 @@ class GUI:
                 if self.thread_downloader is not None:
                     if not self.thread_downloader.is_alive():
                         self.btn_download.configure(state="normal")
+                        self.btn_stop.configure(state="disabled")
                         break
 
     def read_and_check_values(self) -> None:
@@ -442,6 +450,7 @@ class GUI:
         else:
             # If the downloader has been configured, disable download button
             self.btn_download.configure(state="disabled")
+            self.btn_stop.configure(state="normal")
 
             # Run downloader in daemonic thread
             self.thread_downloader = threading.Thread(
@@ -453,6 +462,12 @@ class GUI:
                 target=self.check_downloader_thread, daemon=True)
             thread_button.start()
 
+    def stop(self) -> None:
+        # Queued pages are skipped, the ones being downloaded are completed
+        if self.downloader is not None:
+            self.downloader.stop()
+        self.btn_stop.configure(state="disabled")
+
     def run_downloader(self) -> None:
         # Child thread exceptions cannot be caught in parent, it is done here
         try:
@@ -464,6 +479,7 @@ class GUI:
     def handle_error(self, error_msg: str) -> None:
         tkmsgbox.showwarning(title="Error", message="Error", detail=error_msg)
         self.btn_download.configure(state="normal")
+        self.btn_stop.configure(state="disabled")
 
 
 if __name__ == '__main__':
@@ -1,4 +1,4 @@
-from test_common import Test
+from test_common import Test, LocalServer
 from test_manifests_data import ver_dict
 import os
 import sys
@@ -7,6 +7,15 @@ import iiif_downloader  # import ../iiif_downloader.py
 import json
 import logging
 import argparse
+import tempfile
+import time
+import asyncio
+import gzip
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Timer
+import shutil
 
 
 class TestGetPages(Test):
@@ -14,6 +23,16 @@ class TestGetPages(Test):
         self.result = iiif_downloader.get_pages(pages_string)
 
 
+class TestGetThreads(Test):
+    def run(self, threads_string):
+        self.result = iiif_downloader.get_threads(threads_string)
+
+
+class TestGetShard(Test):
+    def run(self, shard_string):
+        self.result = iiif_downloader.get_shard(shard_string)
+
+
 class TestSanitizeLabel(Test):
     def run(self, label):
         self.result = iiif_downloader.sanitize_label(label, "")
@@ -37,6 +56,11 @@ class TestMatchURIPattern(Test):
         }
 
 
+class TestRewriteImageID(Test):
+    def run(self, image_id):
+        self.result = iiif_downloader.rewrite_image_id(image_id)
+
+
 class TestSanitizeName(Test):
     def run(self, title):
         self.result = iiif_downloader.sanitize_name(title)
@@ -47,6 +71,379 @@ class TestIsUrl(Test):
         self.result = iiif_downloader.is_url(url)
 
 
+class TestOpenURL_Connections(Test):
+    def run(self, server, path, num_requests):
+        iiif_downloader.connection_pool.clear()
+        server.connections = 0
+        for _ in range(num_requests):
+            response = iiif_downloader.open_url(server.url + path)
+            response.read()
+        self.result = server.connections
+
+
+class TestOpenURL_Body(Test):
+    def run(self, server, path):
+        response = iiif_downloader.open_url(server.url + path)
+        self.result = None if response is None else response.read()
+
+
+class TestOpenJSONFile_Encoding(Test):
+    def run(self, server, path):
+        async def read_async(url):
+            try:
+                return await iiif_downloader.async_open_json_file(url)
+            finally:
+                await iiif_downloader.async_connection_pool.close()
+
+        url = server.url + path
+        self.result = [
+            iiif_downloader.open_json_file(url), asyncio.run(read_async(url))]
+
+
+class TestDownloadFile(Test):
+    def run(self, server, path):
+        filesize = iiif_downloader.download_file(
+            server.url + path, "tmp.jpg", "")
+        content = None
+        if os.path.exists("tmp.jpg"):
+            with open("tmp.jpg", "rb") as f:
+                content = f.read()
+            os.remove("tmp.jpg")
+        self.result = [filesize, content, os.path.exists("tmp.jpg.part")]
+
+
+class TestDownloadRanges(Test):
+    def run(self, server, path, image):
+        server.requests.clear()
+        filepath = tempfile.mkdtemp() + "/file.jpg"
+        checksum = iiif_downloader.FileChecksum()
+        filesize = iiif_downloader.download_file(
+            server.url + path, filepath, "", checksum=checksum)
+        with open(filepath, "rb") as f:
+            content = f.read()
+        self.result = [
+            filesize, content == image, os.path.exists(filepath + ".part"),
+            sorted((r[1].get("Range") for r in server.requests), key=str),
+            checksum.hexdigest() == hashlib.sha256(image).hexdigest()]
+        shutil.rmtree(os.path.dirname(filepath))
+
+
+def make_manifest3(url, num_pages, label="Test"):
+    """Return a 3.0 manifest whose images are hosted at url/iiif/pN."""
+    canvases = []
+    for n in range(num_pages):
+        service_id = url + "/iiif/p" + str(n)
+        canvases.append({
+            "type": "Canvas",
+            "label": {"none": ["Page " + str(n)]},
+            "items": [{"type": "AnnotationPage", "items": [{
+                "type": "Annotation", "motivation": "painting",
+                "body": {
+                    "id": service_id + "/full/max/0/default.jpg",
+                    "type": "Image", "format": "image/jpeg",
+                    "width": 100, "height": 200,
+                    "service": [{"id": service_id}]}}]}]})
+    return {
+        "@context": "http://iiif.io/api/presentation/3/context.json",
+        "id": url + "/manifest.json", "type": "Manifest",
+        "label": {"none": [label]}, "items": canvases}
+
+
+class TestDownloadManifest(Test):
+    def run(self, manifest, num_threads, options={}):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir, num_threads=num_threads,
+            **options)
+        downloader.run()
+        shutil.rmtree(maindir)
+        self.result = [
+            downloader.downloaded_cnt, downloader.skipped_cnt,
+            downloader.failed_cnt, downloader.strategy.codes[0]]
+
+
+class TestDownloadPlan(Test):
+    def run(self, server, manifest, num_threads):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        server.requests.clear()
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir)
+        downloader.plan(maindir + "/plan.jsonl")
+        with open(maindir + "/plan.jsonl") as f:
+            entries = [json.loads(line) for line in f]
+        # Only the first page is probed, the other ones are not requested
+        images = [r[0] for r in server.requests
+                  if not r[0].endswith("info.json")]
+        planned_dirs = os.listdir(maindir)
+
+        downloader = iiif_downloader.IIIF_Downloader(
+            "", maindir, num_threads=num_threads)
+        downloader.run_plan(maindir + "/plan.jsonl")
+        files = sorted(os.listdir(maindir + "/Test"))
+        shutil.rmtree(maindir)
+        self.result = [
+            len(entries), entries[1], images, sorted(planned_dirs),
+            downloader.downloaded_cnt, downloader.failed_cnt, files[:2]]
+
+
+class TestDownloadJournal(Test):
+    def run(self, server, manifest, legacy):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir)
+        downloader.run()
+
+        # Delete one image (and the journal), then download the rest again
+        subdir = maindir + "/Test"
+        os.remove(subdir + "/p001.jpg")
+        if legacy:
+            os.remove(subdir + "/" + iiif_downloader.DownloadJournal.filename)
+        server.requests.clear()
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir)
+        downloader.run()
+        journal = iiif_downloader.DownloadJournal(subdir)
+        checksum = iiif_downloader.get_file_checksum(subdir + "/p001.jpg")
+        shutil.rmtree(maindir)
+        self.result = [
+            downloader.downloaded_cnt, downloader.skipped_cnt,
+            [r[0] for r in server.requests], len(journal.complete),
+            journal.records["p001.jpg"]["sha256"] == checksum]
+
+
+class TestSyncCatalog(Test):
+    def run(self, server, manifests):
+        maindir = tempfile.mkdtemp()
+        self.result = []
+        for manifest in manifests:
+            body = json.dumps(manifest).encode("utf-8")
+            server.route("/sync/manifest.json", (200, {}, serve_etag(body)))
+            server.requests.clear()
+            downloader = iiif_downloader.IIIF_Downloader(
+                server.url + "/sync/manifest.json", maindir,
+                sync_catalog=maindir + "/catalog.db")
+            downloader.run()
+            self.result.append([
+                downloader.downloaded_cnt, downloader.skipped_cnt,
+                len([r for r in server.requests if "If-None-Match" in r[1]])])
+        shutil.rmtree(maindir)
+
+
+class TestDownloadCollection(Test):
+    def run(self, server, num_manifests, num_threads, documents_in_flight):
+        collection = {
+            "@context": "http://iiif.io/api/presentation/3/context.json",
+            "id": server.url + "/collection.json", "type": "Collection",
+            "label": {"none": ["Collection"]}, "items": []}
+        for m in range(num_manifests):
+            manifest = make_manifest3(server.url, 5, "Doc " + str(m))
+            server.route(
+                "/manifest" + str(m) + ".json",
+                (200, {"Content-Type": "application/json"},
+                 json.dumps(manifest).encode()))
+            collection["items"].append({
+                "id": server.url + "/manifest" + str(m) + ".json",
+                "type": "Manifest"})
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/collection.json", "w") as f:
+            json.dump(collection, f)
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/collection.json", maindir, num_threads=num_threads,
+            documents_in_flight=documents_in_flight)
+        downloader.run()
+        subdirs = sorted(d for d in os.listdir(maindir) if d.startswith("Doc"))
+        shutil.rmtree(maindir)
+        self.result = [
+            downloader.downloaded_cnt, downloader.failed_cnt,
+            downloader.collection_pages_cnt, len(downloader.pages), subdirs]
+
+
+class TestDownloadShards(Test):
+    def run(self, documents, shards, use_async):
+        # The documents are downloaded in the same directory
+        maindir = tempfile.mkdtemp()
+        downloaded_cnt = 0
+        for nd, document in enumerate(documents):
+            json_file = maindir + "/document" + str(nd) + ".json"
+            with open(json_file, "w") as f:
+                json.dump(document, f)
+            for shard in range(1, shards + 1):
+                downloader = iiif_downloader.IIIF_Downloader(
+                    json_file, maindir, num_threads=4, shard=shard,
+                    shards=shards)
+                if use_async:
+                    asyncio.run(downloader.run_async())
+                else:
+                    downloader.run()
+                downloaded_cnt += downloader.downloaded_cnt
+        complete = iiif_downloader.merge_shard_stats(maindir)
+        with open(maindir + "/.iiif_shards.json") as f:
+            reports = sorted(report["units"] for report in json.load(f))
+
+        # A missing shard is found by the merge
+        os.remove(maindir + "/" + next(
+            name for name in sorted(os.listdir(maindir))
+            if name.endswith("_1of" + str(shards) + ".json")))
+        incomplete = iiif_downloader.merge_shard_stats(maindir)
+        files = [name for _, _, names in os.walk(maindir) for name in names
+                 if name.endswith(".jpg")]
+        shutil.rmtree(maindir)
+        self.result = [
+            downloaded_cnt, len(files), reports, complete, incomplete]
+
+
+class TestCollectionCrawler(Test):
+    def run(self, server, path, max_depth):
+        d = iiif_downloader.open_json_file(server.url + path)
+        crawler = iiif_downloader.CollectionCrawler(max_depth=max_depth)
+        crawler.start(d, server.url + path, Event())
+        manifest_ids = []
+        while not crawler.finished:
+            manifest_id = crawler.get_manifest_id(block=True)
+            if manifest_id is not None:
+                manifest_ids.append(manifest_id[len(server.url):])
+        self.result = [manifest_ids, crawler.collections_cnt]
+
+
+class TestDownloadManifestAsync(Test):
+    def run(self, manifest, num_tasks):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir, num_threads=num_tasks)
+        asyncio.run(downloader.run_async())
+        shutil.rmtree(maindir)
+        self.result = [
+            downloader.downloaded_cnt, downloader.skipped_cnt,
+            downloader.failed_cnt, downloader.strategy.codes[0]]
+
+
+class TestDownloadFileAsync(Test):
+    def run(self, server, path):
+        filepath = tempfile.mkdtemp() + "/file"
+        filesize = asyncio.run(iiif_downloader.async_download_file(
+            server.url + path, filepath, ""))
+        content = None
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as f:
+                content = f.read()
+        self.result = [filesize, content, os.path.exists(filepath + ".part")]
+        shutil.rmtree(os.path.dirname(filepath))
+
+
+class TestStrategyCache(Test):
+    def run(self, server, manifest):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        cache_file = maindir + "/strategies.json"
+        # The second run reads the strategy found in the first one
+        probed_uris = []
+        for _ in range(2):
+            server.requests.clear()
+            downloader = iiif_downloader.IIIF_Downloader(
+                maindir + "/manifest.json", maindir, force=True,
+                strategy_cache=cache_file)
+            downloader.run()
+            probed_uris.append(sorted(set(r[0] for r in server.requests)))
+        with open(cache_file) as f:
+            entry = json.load(f)["127.0.0.1:" + server.url.split(":")[-1] +
+                                 " service"]
+        shutil.rmtree(maindir)
+        self.result = [entry["strategy"], entry["failed"],
+                       "/iiif/p0/full/max/0/default.jpg" in probed_uris[0],
+                       "/iiif/p0/full/max/0/default.jpg" in probed_uris[1]]
+
+
+class TestImageInformationCache(Test):
+    def run(self, server, path, num_threads):
+        server.requests.clear()
+        cache = iiif_downloader.ImageInformationCache()
+        executor = ThreadPoolExecutor(max_workers=num_threads)
+        futures = [executor.submit(cache.get, server.url + path)
+                   for _ in range(num_threads)]
+        widths = set(f.result()["width"] for f in futures)
+        executor.shutdown()
+        cache.get(server.url + path)
+        self.result = [len(server.requests), widths, cache.hits, cache.misses]
+
+
+class TestHTTPCache(Test):
+    def run(self, server, paths, max_size):
+        cache_dir = tempfile.mkdtemp()
+        iiif_downloader.http_cache.directory = cache_dir
+        iiif_downloader.http_cache.max_size = max_size
+        iiif_downloader.http_cache.files = None
+        server.requests.clear()
+        docs = [iiif_downloader.open_json_file(server.url + path)
+                for path in paths]
+        iiif_downloader.http_cache.directory = ""
+        self.result = [
+            docs, len(server.requests),
+            len([r for r in server.requests if "If-None-Match" in r[1]]),
+            len(os.listdir(cache_dir))]
+        shutil.rmtree(cache_dir)
+
+
+class TestOpenURL_Retries(Test):
+    def run(self, server, path):
+        retries = iiif_downloader.retry_policy.retries
+        response = iiif_downloader.open_url(server.url + path)
+        self.result = [
+            None if response is None else response.read(),
+            iiif_downloader.retry_policy.retries - retries]
+
+
+class TestRateLimiter(Test):
+    def run(self, rate, burst, num_requests):
+        limiter = iiif_downloader.RateLimiter(rate, burst)
+        start_time = time.monotonic()
+        for _ in range(num_requests):
+            limiter.acquire("host")
+        elapsed_time = time.monotonic() - start_time
+        # Expected time: (num_requests - burst) / rate, with some tolerance
+        expected_time = max(0, num_requests - burst) / rate if rate else 0
+        self.result = expected_time <= elapsed_time < expected_time + 0.1
+
+
+class TestConcurrencyController(Test):
+    def run(self, num_downloads, retry_at):
+        controller = iiif_downloader.ConcurrencyController(initial=2)
+        limits = []
+        for n in range(num_downloads):
+            controller.acquire()
+            if n == retry_at:
+                iiif_downloader.retry_policy.retries += 1
+            controller.release(0.1)
+            limits.append(controller.limit)
+        self.result = limits
+
+
+class TestStopDownload(Test):
+    def run(self, manifest, num_threads, stop_time):
+        maindir = tempfile.mkdtemp()
+        with open(maindir + "/manifest.json", "w") as f:
+            json.dump(manifest, f)
+        downloader = iiif_downloader.IIIF_Downloader(
+            maindir + "/manifest.json", maindir, num_threads=num_threads)
+        thread = Thread(target=downloader.run)
+        thread.start()
+        time.sleep(stop_time)
+        downloader.stop()
+        thread.join()
+        shutil.rmtree(maindir)
+        self.result = [
+            0 < downloader.downloaded_cnt < len(manifest["items"]),
+            downloader.failed_cnt]
+
+
 class TestReadManifest_GetVersion(Test):
     def run(self, file_name):
         downloader = iiif_downloader.IIIF_Downloader()
@@ -71,6 +468,74 @@ class TestReadManifest_TotPages(Test):
             self.result = len(downloader.pages)
 
 
+class TestReadManifest_Streamed(Test):
+    def run(self, file_name, version):
+        downloader = iiif_downloader.IIIF_Downloader()
+        d = iiif_downloader.open_json_file(
+            file_name, "", downloader.read_streamed_canvas)
+
+        if (version == '2'):
+            downloader.read_iiif_manifest2(d)
+        else:
+            downloader.read_iiif_manifest3(d)
+        self.result = len(downloader.pages)
+
+
+class TestReadManifest_PageRange(Test):
+    def run(self, file_name, version, streamed):
+        downloader = iiif_downloader.IIIF_Downloader()
+        downloader.firstpage, downloader.lastpage = 2, 3
+        read_item = downloader.read_streamed_canvas if streamed else None
+        d = iiif_downloader.open_json_file(file_name, "", read_item)
+
+        if (version == '2'):
+            downloader.read_iiif_manifest2(d)
+        else:
+            downloader.read_iiif_manifest3(d)
+        self.result = [len(downloader.pages), downloader.orig_num_pages]
+
+
+class TestCompileURIs(Test):
+    def run(self, file_name, version, width):
+        downloader = iiif_downloader.IIIF_Downloader(width=width)
+        downloader.version = int(version)
+        d = iiif_downloader.open_json_file(
+            file_name, "", downloader.read_streamed_canvas)
+        if (version == '2'):
+            downloader.read_iiif_manifest2(d)
+        else:
+            downloader.read_iiif_manifest3(d)
+
+        # The URIs compiled in one pass are the ones built page by page
+        self.result = True
+        for code in downloader.get_eligible_strategies():
+            uris = downloader.compile_uris(code)
+            if uris is None:
+                continue
+            for cnt, page in enumerate(downloader.pages):
+                if width != 0:
+                    page.w = width
+                for n in range(len(page.id)):
+                    uri = downloader.get_candidate_uri(page, n, code)
+                    if uri != uris[downloader.pages.offsets[cnt] + n]:
+                        self.result = False
+
+
+class TestJSONStreamParser(Test):
+    def run(self, doc, chunk_size):
+        text = json.dumps(doc, indent=2)
+        streamed = []
+
+        def read_item(path, n, item):
+            streamed.append((path, n))
+            return "item " + str(n)
+
+        chunks = (text[i:i + chunk_size]
+                  for i in range(0, len(text), chunk_size))
+        d = iiif_downloader.JSONStreamParser(chunks, read_item).parse()
+        self.result = [d, streamed]
+
+
 class TestReadManifest_Metadata(Test):
     def run(self, file_name, version):
         downloader = iiif_downloader.IIIF_Downloader()
@@ -137,6 +602,27 @@ assert len(default_downloader.pages) == 1
 default_downloader = iiif_downloader.IIIF_Downloader()
 assert len(default_downloader.pages) == 0
 
+# Page table: the pages are stored in columns and read back as Page objects
+page_table = iiif_downloader.PageTable()
+for n in range(3):
+    page = iiif_downloader.Page()
+    page.label = "Page " + str(n)
+    page.w = [100, None, 1.5][n]
+    page.id = ["id" + str(i) for i in range(n)]
+    page.ext = [".jpg"] * n
+    page.service_id = [None, "service"][:n]
+    page_table.append(page)
+assert len(page_table) == 3
+assert [p.w for p in page_table] == [100, None, 1.5]
+assert page_table[-1].id == ["id0", "id1"]
+assert page_table[2].service_id == [None, "service"]
+assert page_table.strings.count(".jpg") == 1  # each string is stored once
+assert [p.label for p in page_table[1:]] == ["Page 1", "Page 2"]
+page_table[0].w = 200  # the table is not changed
+assert page_table[0].w == 100
+page_table.clear()
+assert len(page_table) == 0 and list(page_table) == []
+
 # Page range
 logging.info("Page range tests")
 pages_strings = [
@@ -171,6 +657,25 @@ err_pages_strings = [
 for err_pages_string in err_pages_strings:
     test.run_and_check_exception(err_pages_string)
 
+# Threads
+logging.info("Threads tests")
+threads_strings = ["1", "16", "auto"]
+refs = [1, 16, 0]
+for threads_string, ref in zip(threads_strings, refs):
+    test = TestGetThreads(ref)
+    test.run_and_check_ref(threads_string)
+test = TestGetThreads("no-ref")
+for err_threads_string in ["0", "-1", "a", ""]:
+    test.run_and_check_exception(err_threads_string)
+
+# Shard
+logging.info("Shard tests")
+test = TestGetShard([2, 4])
+test.run_and_check_ref("2/4")
+test = TestGetShard("no-ref")
+for err_shard_string in ["0/4", "5/4", "1/0", "1-4", "a/b", ""]:
+    test.run_and_check_exception(err_shard_string)
+
 # Sanitize label
 logging.info("Sanitize label tests")
 labels = [
@@ -252,6 +757,29 @@ for r in region_list:
                     test = TestMatchURIPattern(ref)
                     test.run_and_check_ref(uri)
 
+# Rewrite image ID
+logging.info("Rewrite image ID tests")
+image_ids = [
+    "https://iiiflb.blavatnikarchive.org/iiif/3/baf__/b0001/full/max/0/"
+    "default.jpg",
+    "https://example.org/iiif/3/baf__/b0001/full/max/0/default.jpg",
+    "https://example.org/iiif/2/b0001/full/full/0/default.jpg",
+]
+refs = [
+    "https://iiiflb.blavatnikarchive.org/iiif/3/baf__b0001/full/max/0/"
+    "default.jpg",
+    "https://example.org/iiif/3/baf__/b0001/full/max/0/default.jpg",
+    "https://example.org/iiif/2/b0001/full/full/0/default.jpg",
+]
+for image_id, ref in zip(image_ids, refs):
+    test = TestRewriteImageID(ref)
+    test.run_and_check_ref(image_id)
+# The image ID is rewritten only when a formatted URI is built from it
+assert iiif_downloader.strategy_codes["2"].get_base(image_ids[0], None) == \
+    image_ids[0]
+assert iiif_downloader.strategy_codes["4b"].get_base(image_ids[0], None) == \
+    refs[0]
+
 # Sanitize name
 logging.info("Sanitize name tests")
 names = [
@@ -299,6 +827,24 @@ for url, ref in zip(urls, refs):
     test = TestIsUrl(ref)
     test.run_and_check_ref(url)
 
+# Streaming parser: the canvases (3.0 items, first 2.0/2.1 sequence) are
+# given one at a time to read_item, the rest of the document is kept
+doc3 = {"label": {"en": ["a\\\"b"]}, "n": 12345,
+        "items": [{"id": 1}, {"id": 2}],
+        "structures": [{"items": [{"id": 3}]}]}
+doc2 = {"sequences": [{"canvases": [{"@id": 1}], "x": [1.5e3, None]},
+                      {"canvases": [{"@id": 2}]}]}
+refs = [
+    [{**doc3, "items": ["item 0", "item 1"]}, [(("items",), 0),
+                                               (("items",), 1)]],
+    [{"sequences": [{"canvases": ["item 0"], "x": [1500.0, None]},
+                    {"canvases": [{"@id": 2}]}]},
+     [(("sequences", 0, "canvases"), 0)]]]
+for doc, ref in zip([doc3, doc2], refs):
+    for chunk_size in [1, 3, 1000]:
+        test = TestJSONStreamParser(ref)
+        test.run_and_check_ref(doc, chunk_size)
+
 # Manifests
 logging.info("Manifests tests")
 for version in ["2", "3"]:
@@ -315,6 +861,20 @@ for version in ["2", "3"]:
         test = TestReadManifest_TotPages(ref)
         test.run_and_check_ref(file_name, version)
 
+        # Tot pages, with the canvases parsed one at a time
+        test = TestReadManifest_Streamed(ref)
+        test.run_and_check_ref(file_name, version)
+
+        # URIs of all the pages compiled with each strategy
+        test = TestCompileURIs(True)
+        test.run_and_check_ref(file_name, version, 0)
+        test.run_and_check_ref(file_name, version, 500)
+
+        # Pages 2-3 only, with the total number of pages
+        test = TestReadManifest_PageRange([min(max(ref - 1, 0), 2), ref])
+        test.run_and_check_ref(file_name, version, False)
+        test.run_and_check_ref(file_name, version, True)
+
         # Metadata (file is saved multiple times, it can be resource-consuming)
         if (parser_args['metadata']):
             ref = ver_dict[version]['ids'][i]['tot']
@@ -325,3 +885,346 @@ for version in ["2", "3"]:
         ref = ver_dict[version]['ids'][i]['na']
         test = TestReadManifest_TotNA(ref)
         test.run_and_check_ref(file_name, version)
+
+# Network
+logging.info("Network tests")
+iiif_downloader.retry_policy.backoff_base = 0.01  # short retry delays
+server = LocalServer()
+server.route("/a", (200, {"Content-Type": "text/plain"}, b"body a"))
+server.route("/redirect", (302, {"Location": "/a"}, b""))
+
+# Persistent connections: one connection for many requests
+test = TestOpenURL_Connections(1)
+test.run_and_check_ref(server, "/a", 5)
+test = TestOpenURL_Connections(1)
+test.run_and_check_ref(server, "/redirect", 5)
+
+# Redirections and errors
+paths = ["/a", "/redirect", "/missing"]
+refs = [b"body a", b"body a", None]
+for path, ref in zip(paths, refs):
+    test = TestOpenURL_Body(ref)
+    test.run_and_check_ref(server, path)
+
+# Compressed json files (gzip, deflate with and without zlib header)
+doc = {"label": "Compressed \u00e8", "items": list(range(1000))}
+body = json.dumps(doc).encode("utf-8")
+raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+bodies = {
+    "gzip": gzip.compress(body), "deflate": zlib.compress(body),
+    "raw-deflate": raw_deflate.compress(body) + raw_deflate.flush(),
+    "identity": body}
+for name, encoded_body in bodies.items():
+    encoding = name.replace("raw-", "")
+    server.route("/" + name + ".json", (200, {}, lambda headers, e=encoding,
+                 b=encoded_body: (200, {"Content-Encoding": e}, b)
+                 if "gzip" in headers.get("Accept-Encoding", "")
+                 else (406, {}, b"")))
+    test = TestOpenJSONFile_Encoding([doc, doc])
+    test.run_and_check_ref(server, "/" + name + ".json")
+
+# Streaming download: complete, wrong content type and truncated files
+image = os.urandom(1000000)
+server.route("/image.jpg", (200, {"Content-Type": "image/jpeg"}, image))
+server.route("/page.html", (200, {"Content-Type": "text/html"}, b"html"))
+server.route(
+    "/truncated.jpg",
+    (200, {"Content-Type": "image/jpeg", "Content-Length": "1000",
+           "Connection": "close"}, image[:10]))
+paths = ["/image.jpg", "/page.html", "/truncated.jpg"]
+refs = [[len(image), image, False], [-1, None, False], [-1, None, False]]
+for path, ref in zip(paths, refs):
+    test = TestDownloadFile(ref)
+    test.run_and_check_ref(server, path)
+
+
+# Interrupted downloads are resumed with a range request if the file has a
+# validator and it has not changed, otherwise they restart
+def serve_range(image, etag):
+    def body(headers):
+        response_headers = {
+            "Content-Type": "image/jpeg", "ETag": etag,
+            "Accept-Ranges": "bytes"}
+        if headers.get("Range") and headers.get("If-Range") == etag:
+            first, last = headers["Range"][6:].split("-")
+            last = last or str(len(image) - 1)
+            response_headers["Content-Range"] = "bytes " + first + "-" + \
+                last + "/" + str(len(image))
+            return 206, response_headers, image[int(first):int(last) + 1]
+        return 200, response_headers, image
+    return body
+
+
+paths = ["/resume.jpg", "/changed.jpg", "/no-etag.jpg"]
+etags = ['"v1"', '"v2"', None]
+refs_ranges = [[None, "bytes=500000-"], [None, "bytes=500000-"], [None, None]]
+for path, etag, ref_ranges in zip(paths, etags, refs_ranges):
+    interrupted_headers = {
+        "Content-Type": "image/jpeg", "Content-Length": str(len(image)),
+        "Connection": "close"}
+    if etag is not None:
+        interrupted_headers["ETag"] = '"v1"'
+    server.route(path, (200, interrupted_headers, image[:500000]),
+                 (200, {}, serve_range(image, etag or '"v1"')))
+    test = TestDownloadRanges([len(image), True, False, ref_ranges, True])
+    test.run_and_check_ref(server, path, image)
+
+# Large files are downloaded in segments at the same time
+iiif_downloader.segment_policy.segments = 4
+iiif_downloader.segment_policy.min_size = 100000
+server.route("/large.jpg", (200, {}, serve_range(image, '"v1"')))
+test = TestDownloadRanges([len(image), True, False, [
+    None, "bytes=250000-499999", "bytes=500000-749999",
+    "bytes=750000-999999"], True])
+test.run_and_check_ref(server, "/large.jpg", image)
+iiif_downloader.segment_policy.segments = 1
+
+# Download a whole manifest: strategy 1b (size = 'max') is not available, the
+# strategy 1c (size = '<width>,') is found with the first page
+for n in range(20):
+    server.route(
+        "/iiif/p" + str(n) + "/full/100,/0/default.jpg",
+        (200, {"Content-Type": "image/jpeg"}, image[:1000]))
+for num_threads in [1, 8]:
+    test = TestDownloadManifest([20, 0, 0, "1c"])
+    test.run_and_check_ref(make_manifest3(server.url, 20), num_threads)
+
+# Same download, with the strategies probed at the same time
+test = TestDownloadManifest([20, 0, 0, "1c"])
+test.run_and_check_ref(
+    make_manifest3(server.url, 20), 8, {"parallel_discovery": True})
+
+# The first page has no service ID and cannot be downloaded: the strategies
+# with the service ID, never attempted, are still tried with the second page
+manifest = make_manifest3(server.url, 2)
+body = manifest["items"][0]["items"][0]["items"][0]["body"]
+body["id"] = server.url + "/missing/p0/full/max/0/default.jpg"
+del body["service"]
+for num_threads in [1, 8]:
+    test = TestDownloadManifest([1, 0, 1, "1c"])
+    test.run_and_check_ref(manifest, num_threads)
+
+# The strategy cache avoids the failed strategy in the second run
+test = TestStrategyCache(["1c", ["1b"], True, False])
+test.run_and_check_ref(server, make_manifest3(server.url, 2))
+
+# An entry without the expected fields is a miss, and no temporary file is
+# left next to the cache file
+cache_dir = tempfile.mkdtemp()
+with open(cache_dir + "/strategies.json", "w") as f:
+    json.dump({"old": {"strategy": "1a"}, "bad": "1b"}, f)
+strategy_cache = iiif_downloader.StrategyCache(cache_dir + "/strategies.json")
+assert strategy_cache.get("old") is None and strategy_cache.get("bad") is None
+strategy_cache.set("new", "1c", 0.1, [])
+assert strategy_cache.get("new")["strategy"] == "1c"
+assert os.listdir(cache_dir) == ["strategies.json"]
+shutil.rmtree(cache_dir)
+
+
+# Plan of the download: the strategy is found probing the first page, then
+# the images of the plan are downloaded without reading the manifest
+for num_threads in [1, 8]:
+    test = TestDownloadPlan([20, {
+        "manifest": server.url + "/manifest.json", "directory": "Test",
+        "page": 2, "label": "Page 1", "file": "p002.jpg",
+        "uri": server.url + "/iiif/p1/full/100,/0/default.jpg",
+        "strategy": "1c", "ext": ".jpg", "width": 100, "height": 200}, [
+            "/iiif/p0/full/max/0/default.jpg",
+            "/iiif/p0/full/100,/0/default.jpg"],
+        ["manifest.json", "plan.jsonl"], 20, 0,
+        [iiif_downloader.DownloadJournal.filename, "p001.jpg"]])
+    test.run_and_check_ref(server, make_manifest3(server.url, 20), num_threads)
+
+
+# Sync: the manifest and the images are requested with their ETags, and only
+# the canvas changed in the manifest is downloaded again
+def serve_etag(body):
+    etag = '"' + iiif_downloader.sha1(body).hexdigest() + '"'
+
+    def serve(headers):
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"Content-Type": "image/jpeg", "ETag": etag}, body
+    return serve
+
+
+manifest = make_manifest3(server.url + "/sync", 3)
+changed_manifest = json.loads(json.dumps(manifest))
+changed_manifest["items"][1]["items"][0]["items"][0]["body"]["service"][0][
+    "id"] = server.url + "/sync/iiif/q1"
+for n in ["p0", "p1", "p2", "q1"]:
+    server.route("/sync/iiif/" + n + "/full/100,/0/default.jpg",
+                 (200, {}, serve_etag(n.encode() * 100)))
+test = TestSyncCatalog([[3, 0, 0], [0, 3, 4], [1, 2, 3]])
+test.run_and_check_ref(server, [manifest, manifest, changed_manifest])
+
+# The journal of the first run (or, without journal, the files in the
+# directory) tells which images must be downloaded again
+for legacy in [False, True]:
+    test = TestDownloadJournal(
+        [1, 2, ["/iiif/p0/full/max/0/default.jpg", "/iiif/p0/info.json",
+                "/iiif/p0/full/100,/0/default.jpg"], 3, True])
+    test.run_and_check_ref(server, make_manifest3(server.url, 3), legacy)
+
+# Image Information documents requested at the same time are read once
+server.route("/info/info.json", (200, {}, lambda headers: (
+    time.sleep(0.2) or (200, {}, b'{"width": 1000}'))))
+test = TestImageInformationCache([1, {1000}, 8, 1])
+test.run_and_check_ref(server, "/info", 8)
+
+
+# HTTP cache: fresh responses are not requested again, stale ones are
+# revalidated with their ETag, and the least recently used are deleted
+def serve_json(cache_control, n):
+    etag = '"' + str(n) + '"'
+
+    def serve(headers):
+        response_headers = {"Cache-Control": cache_control, "ETag": etag}
+        if headers.get("If-None-Match") == etag:
+            return 304, response_headers, b""
+        return 200, response_headers, b'{"n": ' + str(n).encode() + b'}'
+    return serve
+
+
+for n, cache_control in enumerate(["max-age=60", "no-cache", "no-store"]):
+    server.route("/cache/" + str(n) + ".json",
+                 (200, {}, serve_json(cache_control, n)))
+paths = ["/cache/0.json", "/cache/1.json", "/cache/2.json"]
+refs = [[[{"n": 0}] * 2, 1, 0, 1], [[{"n": 1}] * 2, 2, 1, 1],
+        [[{"n": 2}] * 2, 2, 0, 0]]
+for path, ref in zip(paths, refs):
+    test = TestHTTPCache(ref)
+    test.run_and_check_ref(server, [path, path], 1000000)
+test = TestHTTPCache([[{"n": 0}, {"n": 1}, {"n": 0}], 3, 0, 1])
+test.run_and_check_ref(server, ["/cache/0.json", "/cache/1.json",
+                                "/cache/0.json"], 100)
+
+# Retries after transient errors, with and without Retry-After
+server.route(
+    "/busy", (429, {"Retry-After": "0"}, b""), (503, {}, b""),
+    (200, {}, b"body busy"))
+server.route("/down", (500, {}, b""))
+paths = ["/busy", "/down", "/missing"]
+refs = [[b"body busy", 2], [None, 4], [None, 0]]
+for path, ref in zip(paths, refs):
+    test = TestOpenURL_Retries(ref)
+    test.run_and_check_ref(server, path)
+
+# Rate limiter: after the burst, one request every 1/rate seconds
+rates = [50, 50, 0]
+bursts = [1, 5, 1]
+for rate, burst in zip(rates, bursts):
+    test = TestRateLimiter(True)
+    test.run_and_check_ref(rate, burst, 10)
+
+# One configuration per process: a downloader started while another one is
+# running does not change its settings
+first_downloader = iiif_downloader.IIIF_Downloader(rate_limit=20, burst=4)
+first_downloader.prepare_run()
+second_downloader = iiif_downloader.IIIF_Downloader()
+second_downloader.prepare_run()
+assert iiif_downloader.rate_limiter.rate == 20
+second_downloader.finish_run()
+assert iiif_downloader.rate_limiter.burst == 4
+first_downloader.finish_run()
+second_downloader.prepare_run()
+assert iiif_downloader.rate_limiter.rate == 0
+second_downloader.finish_run()
+
+# Adaptive concurrency: +1 after a window of downloads, halved after a retry
+test = TestConcurrencyController(
+    [2, 3, 3, 3, 4, 4, 4, 4, 5, 2, 2, 3])
+test.run_and_check_ref(12, 9)
+# A page waiting for the controller is not queued if the download is stopped
+controller = iiif_downloader.ConcurrencyController(initial=1)
+assert controller.acquire() and not controller.acquire(timeout=0.1)
+stopped_downloader = iiif_downloader.IIIF_Downloader()
+Timer(0.2, stopped_downloader.stop).start()
+assert not stopped_downloader.acquire_download(controller)
+test = TestDownloadManifest([20, 0, 0, "1c"])
+test.run_and_check_ref(make_manifest3(server.url, 20), 0)
+
+# Collections: the manifests are read in advance and their pages are
+# downloaded by the same threads
+for num_threads, documents_in_flight in [(1, 1), (8, 3)]:
+    test = TestDownloadCollection(
+        [20, 0, 20, 0, ["Doc 0", "Doc 1", "Doc 2", "Doc 3"]])
+    test.run_and_check_ref(server, 4, num_threads, documents_in_flight)
+
+# Shards: the pages of a manifest (or the manifests of a collection) are split
+# between the shards, and the merge of their statistics checks the download
+collection = {
+    "@context": "http://iiif.io/api/presentation/3/context.json",
+    "id": server.url + "/collection.json", "type": "Collection",
+    "label": {"none": ["Collection"]}, "items": [{
+        "id": server.url + "/manifest" + str(m) + ".json",
+        "type": "Manifest"} for m in range(4)]}
+for use_async in [False, True]:
+    test = TestDownloadShards([20, 20, [20], True, False])
+    test.run_and_check_ref([make_manifest3(server.url, 20)], 3, use_async)
+    test = TestDownloadShards([20, 20, [4], True, False])
+    test.run_and_check_ref([collection], 2, use_async)
+    # Two documents in the same directory have their own statistics
+    test = TestDownloadShards([30, 30, [10, 20], True, False])
+    test.run_and_check_ref([
+        make_manifest3(server.url, 20, "First"),
+        make_manifest3(server.url, 10, "Second")], 3, use_async)
+
+# Nested and paged collections (3.0 and 2.1): manifests in order, each one
+# once, without cycles and within the maximum depth
+collections = {
+    "/c/root.json": {
+        "@context": "http://iiif.io/api/presentation/3/context.json",
+        "id": server.url + "/c/root.json", "type": "Collection", "items": [
+            {"id": server.url + "/m/0.json", "type": "Manifest"},
+            {"id": server.url + "/c/sub.json", "type": "Collection"},
+            {"id": server.url + "/m/1.json", "type": "Manifest"}]},
+    "/c/sub.json": {
+        "@context": "http://iiif.io/api/presentation/2/context.json",
+        "@id": server.url + "/c/sub.json", "@type": "sc:Collection",
+        "collections": [
+            {"@id": server.url + "/c/root.json", "@type": "sc:Collection"},
+            {"@id": server.url + "/c/deep.json", "@type": "sc:Collection"}],
+        "manifests": [{"@id": server.url + "/m/0.json"}],
+        "first": server.url + "/c/page1.json"},
+    "/c/page1.json": {
+        "@id": server.url + "/c/page1.json", "@type": "sc:Collection",
+        "members": [{"@id": server.url + "/m/2.json", "@type": "sc:Manifest"}],
+        "next": server.url + "/c/page2.json"},
+    "/c/page2.json": {
+        "@id": server.url + "/c/page2.json", "@type": "sc:Collection",
+        "manifests": [{"@id": server.url + "/m/3.json"}]},
+    "/c/deep.json": {
+        "@id": server.url + "/c/deep.json", "@type": "sc:Collection",
+        "manifests": [{"@id": server.url + "/m/4.json"}]},
+}
+for path, collection in collections.items():
+    server.route(path, (200, {"Content-Type": "application/json"},
+                        json.dumps(collection).encode()))
+test = TestCollectionCrawler(
+    [["/m/0.json", "/m/1.json", "/m/4.json", "/m/2.json", "/m/3.json"], 5])
+test.run_and_check_ref(server, "/c/root.json", 10)
+test = TestCollectionCrawler([["/m/0.json", "/m/1.json"], 1])
+test.run_and_check_ref(server, "/c/root.json", 0)
+
+# Asyncio download: redirections, errors, truncated files and a whole
+# manifest downloaded by many tasks
+server.route("/redirect.jpg", (302, {"Location": "/image.jpg"}, b""))
+paths = ["/redirect.jpg", "/page.html", "/missing", "/truncated.jpg"]
+refs = [[len(image), image, False], [-1, None, False], [-1, None, False],
+        [-1, None, False]]
+for path, ref in zip(paths, refs):
+    test = TestDownloadFileAsync(ref)
+    test.run_and_check_ref(server, path)
+for num_tasks in [1, 100]:
+    test = TestDownloadManifestAsync([20, 0, 0, "1c"])
+    test.run_and_check_ref(make_manifest3(server.url, 20), num_tasks)
+
+# Stop a download: the queued pages are not downloaded
+for n in range(20, 100):
+    server.route(
+        "/iiif/p" + str(n) + "/full/100,/0/default.jpg",
+        (200, {}, lambda headers: (time.sleep(0.05) or (
+            200, {"Content-Type": "image/jpeg"}, image[:1000]))))
+test = TestStopDownload([True, 0])
+test.run_and_check_ref(make_manifest3(server.url, 100), 4, 0.5)
@@ -1,3 +1,7 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
 class Test:
     def __init__(self, ref):
         self.ref = ref
@@ -20,3 +24,54 @@ class Test:
         except Exception:
             return
         raise Exception("Exception not raised, when it should be.")
+
+
+class LocalServer:
+    """A local HTTP/1.1 server returning predefined responses, used to test
+    the network functions without an Internet connection."""
+    def __init__(self):
+        # path: list of (status, headers, body), the last one is repeated
+        self.routes = {}
+        self.requests = []  # (path, headers) of each request
+        self.connections = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                responses = server.routes.get(
+                    self.path, [(404, {}, b"Not Found")])
+                status, headers, body = responses[0]
+                if len(responses) > 1:
+                    responses.pop(0)
+                if callable(body):
+                    status, headers, body = body(self.headers)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                if "Content-Length" not in headers:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.httpd.server_address[1])
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def route(self, path, *responses):
+        self.routes[path] = list(responses)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()